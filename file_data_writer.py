@@ -0,0 +1,118 @@
+import csv
+import json
+import logging
+from typing import List
+from sml_block_maper import SmlEntry
+from write_data import WriteData
+
+logger = logging.getLogger('general_logger')
+
+FILE_FORMAT_CSV = "csv"
+FILE_FORMAT_JSON_LINES = "jsonl"
+FILE_FORMAT_PARQUET = "parquet"
+FILE_FORMATS = [FILE_FORMAT_CSV, FILE_FORMAT_JSON_LINES, FILE_FORMAT_PARQUET]
+
+# columns in the order of the JSON output
+FILE_COLUMNS = ["obis", "obisName", "status", "time", "unit", "scaler", "value", "signature"]
+
+
+class CsvDataWriter(WriteData):
+    def __init__(self, filePath: str):
+        super().__init__()
+        self.file = open(filePath, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(FILE_COLUMNS)
+
+    def writeData(self, data: List[SmlEntry]):
+        self.writer.writerows([[getattr(dataItem, column) for column in FILE_COLUMNS] for dataItem in data])
+
+    def close(self):
+        self.file.close()
+
+
+class JsonLinesDataWriter(WriteData):
+    def __init__(self, filePath: str):
+        super().__init__()
+        self.file = open(filePath, "w", encoding="utf-8")
+
+    def writeData(self, data: List[SmlEntry]):
+        self.file.writelines([json.dumps(dataItem.__dict__) + "\n" for dataItem in data])
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetDataWriter(WriteData):
+    """
+    Columnar output, the rows are buffered and written in row groups of rowGroupSize rows.
+    Numeric values are in the value column, octet strings like the device id in the valueText column.
+    """
+
+    def __init__(self, filePath: str, rowGroupSize: int = 65536):
+        super().__init__()
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            logging.error("pyarrow package not found, install it to write parquet files")
+            raise
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema(
+            [
+                ("obis", pyarrow.string()),
+                ("obisName", pyarrow.string()),
+                ("status", pyarrow.int64()),
+                ("time", pyarrow.int64()),
+                ("unit", pyarrow.string()),
+                ("scaler", pyarrow.int16()),
+                ("value", pyarrow.float64()),
+                ("valueText", pyarrow.string()),
+            ]
+        )
+        self.writer = pyarrow.parquet.ParquetWriter(filePath, self.schema)
+        self.rowGroupSize = rowGroupSize
+        self.columns = {name: [] for name in self.schema.names}
+
+    def writeData(self, data: List[SmlEntry]):
+        columns = self.columns
+        for dataItem in data:
+            value = dataItem.value
+            numeric = isinstance(value, (int, float))
+            columns["obis"].append(dataItem.obis)
+            columns["obisName"].append(dataItem.obisName)
+            columns["status"].append(dataItem.status if isinstance(dataItem.status, int) else None)
+            columns["time"].append(dataItem.time if isinstance(dataItem.time, int) else None)
+            columns["unit"].append(dataItem.unit)
+            columns["scaler"].append(dataItem.scaler)
+            columns["value"].append(value if numeric else None)
+            columns["valueText"].append(None if numeric or value is None else str(value))
+        if len(columns["obis"]) >= self.rowGroupSize:
+            self.writeRowGroup()
+
+    def writeRowGroup(self):
+        if len(self.columns["obis"]) == 0:
+            return
+        self.writer.write_table(self.pyarrow.Table.from_pydict(self.columns, schema=self.schema))
+        self.columns = {name: [] for name in self.schema.names}
+
+    def close(self):
+        self.writeRowGroup()
+        self.writer.close()
+
+
+def findFileFormat(filePath: str):
+    for fileFormat in FILE_FORMATS:
+        if filePath.endswith("." + fileFormat):
+            return fileFormat
+    if filePath.endswith(".json"):
+        return FILE_FORMAT_JSON_LINES
+    return None
+
+
+def createFileWriter(filePath: str, fileFormat: str = None):
+    fileFormat = fileFormat if fileFormat is not None else findFileFormat(filePath)
+    if fileFormat == FILE_FORMAT_CSV:
+        return CsvDataWriter(filePath)
+    if fileFormat == FILE_FORMAT_PARQUET:
+        return ParquetDataWriter(filePath)
+    return JsonLinesDataWriter(filePath)
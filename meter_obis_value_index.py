@@ -1,10 +1,9 @@
 #!/usr/bin/python3
 
-from obis_keys import ObisEntryValueIndex
+from obis_keys import ObisEntryValueIndex, ObisFilterRule
 from enum import Enum
 from sml_step_reader import SmlConfig
 import logging
-from typing import Union
 
 
 class Meters(Enum):
@@ -19,15 +18,53 @@ class Meters(Enum):
 class MeterProperties:
     additionObisValuesIndex: dict
 
-    def __init__(self, defaultValueIndex: ObisEntryValueIndex, smlConfig: SmlConfig):
+    def __init__(
+        self,
+        defaultValueIndex: ObisEntryValueIndex,
+        smlConfig: SmlConfig,
+        defaultFilterRule: ObisFilterRule = None,
+    ):
         self.defaultValueIndex = defaultValueIndex
         self.additionObisValuesIndex = dict()
         self.smlConfig = smlConfig
+        # publish filter rules, used with the --filter option
+        self.defaultFilterRule = defaultFilterRule
+        self.filterRules = dict()
+        # list of ObisExtractionPlan per telegram shape, compiled by sml_block_maper from the mapped telegrams
+        self.extractionPlans = dict()
+        # SmlMessageCache of the mapped entries per message, see sml_message_cache
+        self.messageCache = None
 
     def addAdditionalObisEntryValueIndex(
         self, obisKey: str, valuesIndex: ObisEntryValueIndex
     ):
         self.additionObisValuesIndex[obisKey] = valuesIndex
+        self.extractionPlans.clear()
+        if self.messageCache is not None:
+            self.messageCache.clear()
+
+    def addObisFilterRule(self, obisKey: str, filterRule: ObisFilterRule):
+        self.filterRules[obisKey] = filterRule
+
+    def updateFrom(self, meterProperties: "MeterProperties"):
+        """
+        Take the values of the reloaded profile, the readers keep their reference to this object.
+        """
+        crcCheck = self.smlConfig.crcCheck
+        self.defaultValueIndex = meterProperties.defaultValueIndex
+        self.additionObisValuesIndex = meterProperties.additionObisValuesIndex
+        self.smlConfig = meterProperties.smlConfig
+        self.smlConfig.crcCheck = crcCheck
+        if self.defaultFilterRule is not None and meterProperties.defaultFilterRule is not None:
+            # the entry filter keeps a reference to the default rule
+            vars(self.defaultFilterRule).update(vars(meterProperties.defaultFilterRule))
+        else:
+            self.defaultFilterRule = meterProperties.defaultFilterRule
+        self.filterRules.clear()
+        self.filterRules.update(meterProperties.filterRules)
+        self.extractionPlans.clear()
+        if self.messageCache is not None:
+            self.messageCache.clear()
 
     def getObisValueIndexFor(self, obisKey: str = None):
         if obisKey is not None:
@@ -40,16 +77,23 @@ class MeterProperties:
         return self.defaultValueIndex
 
 
-def findMeterConfiguration(meterKey: Union[Meters, str]):
-    meter = Meters[meterKey] if isinstance(meterKey, str) else meterKey
-    if Meters.BZPlus3.value == meter.value:
-        return bZPlus3Configuration()
-    
-    if Meters.eBZ_DD3_DD3BZ06DTA_SMZ1.value== meter.value:
-        return eBZDD3DD3BZ06DTASMZ1()
-    
+# additional directories with meter profiles, searched before the profiles of the reader
+meterProfileDirectories = []
+
+
+def findMeterConfiguration(meterKey: "Meters | str"):
+    """
+    Load the meter profile of a meter name (see meter_profiles) or of a profile file path.
+    """
+    from meter_profile import findMeterProfilePath, loadMeterProfile
+
+    profileName = meterKey.name if isinstance(meterKey, Meters) else str(meterKey)
+    profilePath = findMeterProfilePath(profileName, meterProfileDirectories)
+    if profilePath is not None:
+        return loadMeterProfile(profilePath)
+
     logging.warning(
-        "No supported meter for {}. Add new device on file meter_obis_value_index.py".format(
+        "No supported meter for {}. Add a meter profile to the directory meter_profiles or create one with --probe".format(
             meterKey
         )
     )
@@ -58,19 +102,17 @@ def findMeterConfiguration(meterKey: Union[Meters, str]):
     )
 
 
-def findSupportedMeter():
-    return list(Meters)
+def reloadMeterConfiguration(meterProperties: MeterProperties, meterKey: "Meters | str"):
+    logger = logging.getLogger('general_logger')
+    try:
+        meterProperties.updateFrom(findMeterConfiguration(meterKey))
+        logger.info("Meter profile {} reloaded".format(meterKey))
+    except Exception as e:
+        # keep reading with the loaded profile
+        logger.error("Meter profile {} not reloaded: {}".format(meterKey, e))
 
 
-def eBZDD3DD3BZ06DTASMZ1():
-    return MeterProperties( ObisEntryValueIndex(1,unitIndex=3 ,valueIndex=5),SmlConfig() )
+def findSupportedMeter():
+    from meter_profile import listMeterProfiles
 
-def bZPlus3Configuration():
-    obisValueIndexBzPlus = MeterProperties(
-        ObisEntryValueIndex(0, -1, -1, 2, 3, 4, -1, manualScaler=0.1),
-        SmlConfig(startEscapeSequenz="1b1b1b1b"),
-    )
-    obisValueIndexBzPlus.addAdditionalObisEntryValueIndex(
-        "0100100700", ObisEntryValueIndex(0, -1, -1, 3, 4, 5, -1)
-    )
-    return obisValueIndexBzPlus
+    return listMeterProfiles(meterProfileDirectories)
@@ -0,0 +1,195 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable
+from write_data import WriteData
+from sml_block_maper import mapSmlBlocksObisEntry
+from sml_step_reader import encodeSmlFrame
+from sml_frame_decoder import SmlFrameDecoder, SmlReadStats
+from sml_message_cache import mapSmlFrame, addMessageCacheMetrics
+from meter_obis_value_index import MeterProperties
+from sml_metrics import MetricsRegistry, METRICS_DISABLED, METRIC_TYPE_GAUGE, METRIC_TYPE_COUNTER
+
+logger = logging.getLogger('general_logger')
+
+# wait until the next stage takes the item
+QUEUE_POLICY_BLOCK = "block"
+# drop the oldest queued item to make space for the new one
+QUEUE_POLICY_DROP_OLDEST = "drop-oldest"
+QUEUE_POLICIES = [QUEUE_POLICY_BLOCK, QUEUE_POLICY_DROP_OLDEST]
+
+# marks the end of the items for a stage
+STOP_ITEM = None
+
+
+class PipelineQueue(queue.Queue):
+    def __init__(self, maxsize: int, policy: str = QUEUE_POLICY_DROP_OLDEST):
+        super().__init__(maxsize)
+        self.policy = policy
+        self.droppedCount = 0
+
+    def offer(self, item):
+        if self.policy == QUEUE_POLICY_BLOCK:
+            self.put(item)
+            return
+        while True:
+            try:
+                self.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.get_nowait()
+                    self.droppedCount += 1
+                    logger.warning("Queue full, {} items dropped".format(self.droppedCount))
+                except queue.Empty:
+                    pass
+
+
+class MeterPipeline:
+    """
+    Read, decode and write in separate threads:
+    the reader thread only reads the serial port and splits the stream into frames,
+    the decode thread parses and maps the frames and the writer thread writes the entries.
+    There is one decode thread, so the telegrams reach the writer in the order of the meter.
+    """
+
+    def __init__(
+        self,
+        openSerial: Callable,
+        writer: WriteData,
+        meterProperties: MeterProperties,
+        queueSize: int = 32,
+        queuePolicy: str = QUEUE_POLICY_DROP_OLDEST,
+        reconnectDelay: float = 60,
+        metrics: MetricsRegistry = METRICS_DISABLED,
+        metricsLabels: dict = None,
+    ):
+        super().__init__()
+        self.openSerial = openSerial
+        self.writer = writer
+        self.meterProperties = meterProperties
+        self.reconnectDelay = reconnectDelay
+        self.stats = SmlReadStats()
+        self.frameQueue = PipelineQueue(queueSize, queuePolicy)
+        self.entryQueue = PipelineQueue(queueSize, queuePolicy)
+        self.stopEvent = threading.Event()
+        self.readerThread = None
+        self.decodeThread = None
+        self.writerThread = None
+        self.metrics = metrics
+        self.addMetrics(metrics, metricsLabels or dict())
+
+    def addMetrics(self, metrics: MetricsRegistry, labels: dict):
+        metrics.addReadStats(self.stats, labels)
+        self.parseSeconds = metrics.histogram("sml_parse_seconds", "Time to parse a frame", labels)
+        self.mapSeconds = metrics.histogram("sml_map_seconds", "Time to map the sml blocks to entries", labels)
+        # with the message cache a frame is parsed and mapped in one step, only the decode time is measured
+        self.decodeSeconds = metrics.histogram("sml_decode_seconds", "Time to parse and map a frame", labels)
+        self.publishSeconds = metrics.histogram("sml_publish_seconds", "Time to write the entries", labels)
+        self.publishErrors = metrics.counter("sml_publish_errors_total", "Failed writes of entries", labels)
+        if self.meterProperties.messageCache is not None:
+            addMessageCacheMetrics(metrics, self.meterProperties.messageCache, labels)
+        for queueName, pipelineQueue in [("frames", self.frameQueue), ("entries", self.entryQueue)]:
+            queueLabels = dict(labels, queue=queueName)
+            metrics.callback(
+                "sml_queue_depth", METRIC_TYPE_GAUGE, "Queued items", pipelineQueue.qsize, queueLabels
+            )
+            metrics.callback(
+                "sml_queue_dropped_total",
+                METRIC_TYPE_COUNTER,
+                "Items dropped because the queue was full",
+                lambda pipelineQueue=pipelineQueue: pipelineQueue.droppedCount,
+                queueLabels,
+            )
+
+    def start(self):
+        self.writerThread = threading.Thread(target=self.writeEntries, name="sml-writer", daemon=True)
+        self.writerThread.start()
+        self.decodeThread = threading.Thread(target=self.decodeFrames, name="sml-decode", daemon=True)
+        self.decodeThread.start()
+        self.readerThread = threading.Thread(target=self.readSerial, name="sml-reader", daemon=True)
+        self.readerThread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+
+    def join(self):
+        """
+        Wait until stop is called, then let the stages finish the queued items.
+        """
+        while not self.stopEvent.wait(1):
+            pass
+        self.readerThread.join()
+        self.frameQueue.put(STOP_ITEM)
+        self.decodeThread.join()
+        self.entryQueue.put(STOP_ITEM)
+        self.writerThread.join()
+        self.writer.close()
+        if self.meterProperties.messageCache is not None:
+            logger.info("Message cache: {}".format(self.meterProperties.messageCache.stats))
+
+    def readSerial(self):
+        while not self.stopEvent.is_set():
+            try:
+                with self.openSerial() as serialDevice:
+                    logger.info("Read data from serial port {}".format(serialDevice.port))
+                    decoder = SmlFrameDecoder(self.meterProperties.smlConfig, stats=self.stats)
+                    while not self.stopEvent.is_set():
+                        # read all bytes of the receive buffer at once, wait for at least one byte
+                        chunk = serialDevice.read(serialDevice.in_waiting or 1)
+                        if len(chunk) == 0:
+                            self.stats.readTimeoutCount += 1
+                            continue
+                        self.stats.byteCount += len(chunk)
+                        if decoder.smlConfig is not self.meterProperties.smlConfig:
+                            # the meter profile was reloaded
+                            decoder = SmlFrameDecoder(self.meterProperties.smlConfig, stats=self.stats)
+                        for frame in decoder.feed(chunk):
+                            self.frameQueue.offer(frame)
+            except Exception as e:
+                logger.error(e)
+                self.stopEvent.wait(self.reconnectDelay)
+
+    def decodeFrames(self):
+        timed = self.metrics.enabled
+        while True:
+            frame = self.frameQueue.get()
+            if frame is STOP_ITEM:
+                return
+            try:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Serial raw:\n{}".format(frame.raw.hex()))
+                if timed and self.meterProperties.messageCache is not None:
+                    # parsing and mapping are one step with the message cache
+                    start = time.perf_counter()
+                    smlEntries = mapSmlFrame(frame, self.meterProperties, self.stats)
+                    self.decodeSeconds.observe(time.perf_counter() - start)
+                elif timed:
+                    start = time.perf_counter()
+                    smlBlocks = encodeSmlFrame(frame, self.meterProperties.smlConfig, self.stats)
+                    parsed = time.perf_counter()
+                    smlEntries = mapSmlBlocksObisEntry(smlBlocks, self.meterProperties)
+                    mapped = time.perf_counter()
+                    self.parseSeconds.observe(parsed - start)
+                    self.mapSeconds.observe(mapped - parsed)
+                    self.decodeSeconds.observe(mapped - start)
+                else:
+                    smlEntries = mapSmlFrame(frame, self.meterProperties, self.stats)
+                if len(smlEntries) > 0:
+                    self.entryQueue.offer(smlEntries)
+            except Exception as e:
+                logger.error(e)
+
+    def writeEntries(self):
+        while True:
+            smlEntries = self.entryQueue.get()
+            if smlEntries is STOP_ITEM:
+                return
+            try:
+                start = time.perf_counter()
+                self.writer.writeData(smlEntries)
+                self.publishSeconds.observe(time.perf_counter() - start)
+            except Exception as e:
+                self.publishErrors.inc()
+                logger.error(e)
@@ -0,0 +1,167 @@
+import json
+import logging
+import time
+from collections import Counter
+from typing import List
+from obis_keys import OBIS_NAMES
+from sml_units import SmlUnits
+from sml_step_reader import SmlConfig, SmlBlock, encodeSmlFrame
+from sml_frame_decoder import SmlFrameDecoder, SmlFrame
+from meter_serial import newInstanceOfSerial
+from multi_meter_daemon import createSerialProperties
+
+logger = logging.getLogger('general_logger')
+
+# serial settings tried by the probe, the usual settings of SML meters first
+PROBE_SERIAL_SETTINGS = [
+    {"baudrate": 9600, "bytesize": 8, "parity": "N", "stopbits": 1},
+    {"baudrate": 9600, "bytesize": 7, "parity": "E", "stopbits": 1},
+    {"baudrate": 115200, "bytesize": 8, "parity": "N", "stopbits": 1},
+    {"baudrate": 19200, "bytesize": 8, "parity": "N", "stopbits": 1},
+    {"baudrate": 4800, "bytesize": 8, "parity": "N", "stopbits": 1},
+    {"baudrate": 2400, "bytesize": 8, "parity": "N", "stopbits": 1},
+]
+
+# values of a SML list entry, the time is a child block when the meter sends it as list
+SML_LIST_ENTRY_VALUES = ["obis", "status", "time", "unit", "scaler", "value", "signature"]
+SML_LIST_ENTRY_VALUES_TIME_LIST = ["obis", "status", "unit", "scaler", "value", "signature"]
+
+
+def readFrames(serialSettings: dict, devicePath: str, candidateTimeout: float, minFrames: int):
+    """
+    Read the port with the serial settings until minFrames frames with a valid CRC are found or the time is over.
+    """
+    serialProps = createSerialProperties(dict(serialSettings, device=devicePath))
+    serialProps.timeout = min(0.2, candidateTimeout)
+    decoder = SmlFrameDecoder(SmlConfig())
+    frames = []
+    deadline = time.monotonic() + candidateTimeout
+    with newInstanceOfSerial(serialProps) as serialDevice:
+        while time.monotonic() < deadline and len(frames) < minFrames:
+            chunk = serialDevice.read(serialDevice.in_waiting or 1)
+            frames.extend(decoder.feed(chunk))
+    return frames
+
+
+def probeSerialSettings(
+    devicePath: str,
+    candidates: List[dict] = PROBE_SERIAL_SETTINGS,
+    candidateTimeout: float = 5.0,
+    minFrames: int = 1,
+):
+    """
+    Returns the first serial settings with valid SML frames and the frames, or None and an empty list.
+    """
+    for serialSettings in candidates:
+        logger.info("Probe {} with {}".format(devicePath, serialSettings))
+        try:
+            frames = readFrames(serialSettings, devicePath, candidateTimeout, minFrames)
+        except Exception as e:
+            logger.error("Probe with {} failed: {}".format(serialSettings, e))
+            continue
+        if len(frames) > 0:
+            return serialSettings, frames
+    return None, []
+
+
+def inferValueIndex(values: list, obisPosition: int):
+    """
+    Positions of the values of a SML list entry, None when the values do not look like a list entry.
+    """
+    remaining = len(values) - obisPosition
+    if remaining == len(SML_LIST_ENTRY_VALUES):
+        names = SML_LIST_ENTRY_VALUES
+    elif remaining == len(SML_LIST_ENTRY_VALUES_TIME_LIST):
+        names = SML_LIST_ENTRY_VALUES_TIME_LIST
+    else:
+        return None
+    index = {name: obisPosition + offset for offset, name in enumerate(names)}
+    unit = values[index["unit"]]
+    scaler = values[index["scaler"]]
+    if unit is not None and unit not in SmlUnits:
+        return None
+    if scaler is not None and not (isinstance(scaler, int) and -128 <= scaler <= 127):
+        return None
+    return index
+
+
+def collectObisLayouts(smlBlock: SmlBlock, layouts: dict):
+    for obisPosition, smlBlockValue in enumerate(smlBlock.values):
+        if smlBlockValue in OBIS_NAMES:
+            index = inferValueIndex(smlBlock.values, obisPosition)
+            if index is not None:
+                layouts.setdefault(smlBlockValue, Counter())[tuple(index.items())] += 1
+            break
+    for childBlock in smlBlock.childList:
+        collectObisLayouts(childBlock, layouts)
+
+
+def inferMeterProfile(frames: List[SmlFrame], name: str = "probed", serialSettings: dict = None):
+    """
+    Build a meter profile from the OBIS list entries of the frames.
+    The most common value index is the default index, OBIS keys with another layout get an override.
+    """
+    smlConfig = SmlConfig()
+    layouts = dict()
+    for frame in frames:
+        for smlBlock in encodeSmlFrame(frame, smlConfig):
+            collectObisLayouts(smlBlock, layouts)
+    if len(layouts) == 0:
+        return None
+
+    obisLayouts = {obisKey: counter.most_common(1)[0][0] for obisKey, counter in layouts.items()}
+    defaultLayout = Counter(obisLayouts.values()).most_common(1)[0][0]
+    defaultIndex = dict(defaultLayout)
+    profile = {
+        "name": name,
+        "description": "Probed meter with {} OBIS entries".format(len(obisLayouts)),
+    }
+    if serialSettings is not None:
+        # probed port settings for the config file of several meters
+        profile["serial"] = serialSettings
+    profile["sml"] = {
+        "startEscapeSequence": smlConfig.startEscapeSequenz,
+        "endEscapeSequence": smlConfig.endEscapeSequenz,
+        "version": smlConfig.smlVersion,
+    }
+    profile["index"] = defaultIndex
+    overrides = dict()
+    for obisKey, layout in obisLayouts.items():
+        if layout != defaultLayout:
+            index = dict(layout)
+            overrides[obisKey] = {
+                "index": {key: value for key, value in index.items() if defaultIndex.get(key) != value}
+            }
+    if len(overrides) > 0:
+        profile["obis"] = overrides
+    return profile
+
+
+def probeMeter(
+    devicePath: str,
+    name: str = "probed",
+    candidates: List[dict] = PROBE_SERIAL_SETTINGS,
+    candidateTimeout: float = 5.0,
+):
+    serialSettings, frames = probeSerialSettings(devicePath, candidates, candidateTimeout)
+    if serialSettings is None:
+        logger.error("No SML frames found on {}".format(devicePath))
+        return None
+    return inferMeterProfile(frames, name, serialSettings)
+
+
+def probeData(data: bytes, name: str = "probed", crcCheck: bool = True):
+    """
+    Build a meter profile from a capture of the serial stream.
+    """
+    decoder = SmlFrameDecoder(SmlConfig(crcCheck=crcCheck))
+    return inferMeterProfile(list(decoder.feed(data)), name)
+
+
+def writeMeterProfile(profile: dict, profilePath: str = None):
+    profileJson = json.dumps(profile, indent=4)
+    if profilePath is None:
+        print(profileJson)
+        return
+    with open(profilePath, "w", encoding="utf-8") as profileFile:
+        profileFile.write(profileJson + "\n")
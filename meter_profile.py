@@ -0,0 +1,177 @@
+import json
+import logging
+import math
+import os
+from obis_keys import ObisEntryValueIndex, ObisFilterRule
+from sml_step_reader import SmlConfig
+from sml_units import SmlUnits
+from meter_obis_value_index import MeterProperties
+
+try:
+    import pickle
+except ImportError:
+    # micropython, profiles are compiled on every start
+    pickle = None
+
+logger = logging.getLogger('general_logger')
+
+# directory of the profiles shipped with the reader
+METER_PROFILE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "meter_profiles")
+METER_PROFILE_SUFFIXES = (".json", ".yml", ".yaml")
+# increase when the compiled MeterProperties change, older cache files are compiled again
+METER_PROFILE_CACHE_VERSION = 5
+
+# profile index keys and the matching ObisEntryValueIndex argument
+PROFILE_INDEX_KEYS = {
+    "obis": "obisIndex",
+    "status": "statusIndex",
+    "time": "timeIndex",
+    "unit": "unitIndex",
+    "scaler": "scalerIndex",
+    "value": "valueIndex",
+    "signature": "valueSignature",
+}
+PROFILE_OBIS_OVERRIDE_KEYS = ("index", "scaler", "unit", "name", "exact")
+UNIT_CODES = {name: code for code, name in sorted(SmlUnits.items(), reverse=True)}
+
+
+def readMeterProfileFile(profilePath: str):
+    with open(profilePath, "r", encoding="utf-8") as profileFile:
+        if profilePath.endswith((".yml", ".yaml")):
+            import yaml
+
+            return yaml.safe_load(profileFile)
+        return json.load(profileFile)
+
+
+def compileUnit(unit):
+    if unit is None or isinstance(unit, int):
+        return unit
+    if unit not in UNIT_CODES:
+        raise ValueError("Unknown unit {} in the meter profile".format(unit))
+    return UNIT_CODES[unit]
+
+
+def compileScaler(scaler):
+    """
+    The scaler is the power of ten like the SML scaler. Older profiles have the factor, e.g. 0.1 for -1.
+    """
+    if scaler is None or (isinstance(scaler, int) and not isinstance(scaler, bool)):
+        return scaler
+    if isinstance(scaler, float) and scaler > 0:
+        exponent = round(math.log10(scaler))
+        if math.isclose(scaler, 10.0 ** exponent):
+            logger.warning("Scaler factor {} in the meter profile, use the power of ten {}".format(scaler, exponent))
+            return exponent
+    raise ValueError("Scaler {} in the meter profile is no power of ten".format(scaler))
+
+
+def compileValueIndex(index: dict, scaler: int, unit, name: str, exact: bool = False):
+    arguments = {"obisIndex": -1}
+    for profileKey, value in index.items():
+        if profileKey not in PROFILE_INDEX_KEYS:
+            raise ValueError("Unknown index {} in the meter profile".format(profileKey))
+        arguments[PROFILE_INDEX_KEYS[profileKey]] = value
+    return ObisEntryValueIndex(
+        manualScaler=compileScaler(scaler),
+        manualUnit=compileUnit(unit),
+        publishName=name,
+        exactValue=bool(exact),
+        **arguments
+    )
+
+
+def compileMeterProfile(profile: dict):
+    """
+    Compile a meter profile to the meter properties. Every OBIS override is merged with the defaults,
+    so the mapper finds the complete value index of an OBIS key with one lookup.
+    """
+    sml = profile.get("sml", dict())
+    smlConfig = SmlConfig(
+        startEscapeSequenz=sml.get("startEscapeSequence", "1b1b1b1b"),
+        endEscapeSequenz=sml.get("endEscapeSequence", "1b1b1b1b1a"),
+        smlVersion=sml.get("version", "01010101"),
+        lazyHex=sml.get("lazyHex", False),
+    )
+    defaultIndex = profile.get("index", dict())
+    defaultFilter = profile.get("filter")
+    meterProperties = MeterProperties(
+        compileValueIndex(
+            defaultIndex, profile.get("scaler"), profile.get("unit"), None, profile.get("exact", False)
+        ),
+        smlConfig,
+        ObisFilterRule(**defaultFilter) if defaultFilter is not None else None,
+    )
+    for obisKey, override in profile.get("obis", dict()).items():
+        if any(key in override for key in PROFILE_OBIS_OVERRIDE_KEYS):
+            meterProperties.addAdditionalObisEntryValueIndex(
+                obisKey,
+                compileValueIndex(
+                    dict(defaultIndex, **override.get("index", dict())),
+                    override.get("scaler", profile.get("scaler")),
+                    override.get("unit", profile.get("unit")),
+                    override.get("name"),
+                    override.get("exact", profile.get("exact", False)),
+                ),
+            )
+        if "filter" in override:
+            meterProperties.addObisFilterRule(obisKey, ObisFilterRule(**override["filter"]))
+    return meterProperties
+
+
+def findMeterProfilePath(meterKey: str, directories: list = None):
+    if meterKey.endswith(METER_PROFILE_SUFFIXES) and os.path.isfile(meterKey):
+        return meterKey
+    for directory in (directories or []) + [METER_PROFILE_DIRECTORY]:
+        for suffix in METER_PROFILE_SUFFIXES:
+            profilePath = os.path.join(directory, meterKey + suffix)
+            if os.path.isfile(profilePath):
+                return profilePath
+    return None
+
+
+def listMeterProfiles(directories: list = None):
+    names = []
+    for directory in (directories or []) + [METER_PROFILE_DIRECTORY]:
+        if not os.path.isdir(directory):
+            continue
+        for fileName in sorted(os.listdir(directory)):
+            name, suffix = os.path.splitext(fileName)
+            if suffix in METER_PROFILE_SUFFIXES and name not in names:
+                names.append(name)
+    return names
+
+
+def profileCachePath(profilePath: str):
+    directory, fileName = os.path.split(os.path.abspath(profilePath))
+    return os.path.join(directory, "__pycache__", fileName + ".profile.pickle")
+
+
+def loadMeterProfile(profilePath: str, useCache: bool = True):
+    """
+    Load the compiled profile from the cache file next to the profile or compile and cache it.
+    The cache is valid as long as the modification time and the size of the profile are unchanged.
+    """
+    useCache = useCache and pickle is not None
+    if useCache:
+        fileStat = os.stat(profilePath)
+        cacheKey = (METER_PROFILE_CACHE_VERSION, fileStat.st_mtime_ns, fileStat.st_size)
+        cachePath = profileCachePath(profilePath)
+        try:
+            with open(cachePath, "rb") as cacheFile:
+                cachedKey, meterProperties = pickle.load(cacheFile)
+            if cachedKey == cacheKey:
+                return meterProperties
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError, AttributeError, ImportError):
+            pass
+
+    meterProperties = compileMeterProfile(readMeterProfileFile(profilePath))
+    if useCache:
+        try:
+            os.makedirs(os.path.dirname(cachePath), exist_ok=True)
+            with open(cachePath + ".tmp", "wb") as cacheFile:
+                pickle.dump((cacheKey, meterProperties), cacheFile)
+            os.replace(cachePath + ".tmp", cachePath)
+        except OSError as e:
+            logger.info("Meter profile cache not written: {}".format(e))
+    return meterProperties
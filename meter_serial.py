@@ -0,0 +1,185 @@
+import logging
+import os
+
+try:
+    import fcntl
+    import selectors
+    import termios
+except ImportError:
+    # no POSIX tty, only pyserial
+    termios = None
+
+logger = logging.getLogger('general_logger')
+
+# termios on POSIX systems, pyserial for other systems and port URLs like rfc2217://
+SERIAL_BACKEND_AUTO = "auto"
+SERIAL_BACKEND_PYSERIAL = "pyserial"
+SERIAL_BACKEND_TERMIOS = "termios"
+SERIAL_BACKENDS = [SERIAL_BACKEND_AUTO, SERIAL_BACKEND_PYSERIAL, SERIAL_BACKEND_TERMIOS]
+# bytes after which a blocking read returns, larger values make Linux return single 64 byte chunks
+# of its tty read buffer instead of everything received
+TERMIOS_VMIN = 64
+
+
+class SerialProperties:
+    def __init__(
+        self,
+        devicePath="/dev/ttyAMA0",
+        serialPort=9600,
+        xonxoff=0,
+        rtscts=0,
+        bytesize=8,
+        parity="N",
+        stopbits=1,
+        timeout=1.0,
+        backend=SERIAL_BACKEND_AUTO,
+        readSize=4096,
+        burstGap=0.1,
+    ):
+        super().__init__()
+        self.devicePath = devicePath
+        self.serialPort = serialPort
+        self.xonxoff = xonxoff
+        self.rtscts = rtscts
+        self.bytesize = bytesize
+        self.parity = parity
+        self.stopbits = stopbits
+        self.timeout = timeout
+        self.backend = backend
+        # bytes per read of the termios backend
+        self.readSize = readSize
+        # seconds without a byte which end a burst of the termios backend (VTIME, 0.1 s steps)
+        self.burstGap = burstGap
+
+
+class RawSerial:
+    """
+    Serial port opened once in raw mode with termios. With a timeout the kernel returns a read after
+    VMIN bytes or when no byte arrived for VTIME, so one read gets a whole burst of the meter instead
+    of single bytes. The port is waited for with a selector (epoll on Linux), a timeout of 0 reads
+    without blocking, e.g. for the event loop of the multi meter daemon.
+    Implements the part of the pyserial interface used by the readers.
+    """
+
+    def __init__(self, serialProps: SerialProperties):
+        super().__init__()
+        self.port = serialProps.devicePath
+        self.timeout = serialProps.timeout
+        self.readSize = serialProps.readSize
+        self.fd = os.open(self.port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        self.selector = None
+        try:
+            configureRawTty(self.fd, serialProps)
+            if self.timeout != 0:
+                os.set_blocking(self.fd, True)
+                self.selector = selectors.DefaultSelector()
+                self.selector.register(self.fd, selectors.EVENT_READ)
+        except Exception:
+            os.close(self.fd)
+            raise
+
+    def fileno(self):
+        return self.fd
+
+    @property
+    def in_waiting(self):
+        return int.from_bytes(fcntl.ioctl(self.fd, termios.FIONREAD, b"\x00\x00\x00\x00"), "little")
+
+    def read(self, size: int = 1):
+        """
+        The next burst, at most max(size, readSize) bytes. Empty after the timeout.
+        Raises OSError when the port is readable but has no data, e.g. an unplugged USB adapter.
+        """
+        size = max(size, self.readSize)
+        if self.selector is None:
+            try:
+                return os.read(self.fd, size)
+            except BlockingIOError:
+                return b""
+        if len(self.selector.select(self.timeout)) == 0:
+            return b""
+        data = os.read(self.fd, size)
+        if len(data) == 0:
+            # like pyserial, a hung up tty is readable without data
+            raise OSError("device reports readiness to read but returned no data")
+        return data
+
+    def close(self):
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def configureRawTty(fd: int, serialProps: SerialProperties):
+    iflag, oflag, cflag, lflag, ispeed, ospeed, cc = termios.tcgetattr(fd)
+    speed = getattr(termios, "B{}".format(int(serialProps.serialPort)), None)
+    if speed is None:
+        raise ValueError("Baud rate {} not supported by termios".format(serialProps.serialPort))
+    iflag &= ~(
+        termios.IGNBRK | termios.BRKINT | termios.PARMRK | termios.ISTRIP | termios.INLCR | termios.IGNCR
+    )
+    iflag &= ~(termios.ICRNL | termios.IXON | termios.IXOFF | termios.INPCK)
+    if serialProps.xonxoff:
+        iflag |= termios.IXON | termios.IXOFF
+    oflag &= ~termios.OPOST
+    lflag &= ~(termios.ECHO | termios.ECHONL | termios.ICANON | termios.ISIG | termios.IEXTEN)
+    cflag &= ~(termios.CSIZE | termios.PARENB | termios.PARODD | termios.CSTOPB)
+    cflag |= termios.CREAD | termios.CLOCAL
+    cflag |= {5: termios.CS5, 6: termios.CS6, 7: termios.CS7}.get(int(serialProps.bytesize), termios.CS8)
+    if serialProps.parity in ("E", "O"):
+        cflag |= termios.PARENB | (termios.PARODD if serialProps.parity == "O" else 0)
+        iflag |= termios.INPCK
+    if serialProps.stopbits == 2:
+        cflag |= termios.CSTOPB
+    if hasattr(termios, "CRTSCTS"):
+        cflag = cflag | termios.CRTSCTS if serialProps.rtscts else cflag & ~termios.CRTSCTS
+    if serialProps.timeout == 0:
+        # non-blocking reads return what is in the receive buffer
+        cc[termios.VMIN] = 0
+        cc[termios.VTIME] = 0
+    else:
+        # VTIME is the gap after a byte in 0.1 s which ends the read
+        cc[termios.VMIN] = TERMIOS_VMIN
+        cc[termios.VTIME] = max(1, min(255, int(round(serialProps.burstGap * 10))))
+    termios.tcsetattr(fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, speed, speed, cc])
+
+
+def findSerialBackend(serialProps: SerialProperties):
+    backend = serialProps.backend
+    if backend == SERIAL_BACKEND_AUTO:
+        if termios is not None and "://" not in serialProps.devicePath:
+            return SERIAL_BACKEND_TERMIOS
+        return SERIAL_BACKEND_PYSERIAL
+    if backend == SERIAL_BACKEND_TERMIOS and termios is None:
+        logger.warning("termios not available, the serial port is opened with pyserial")
+        return SERIAL_BACKEND_PYSERIAL
+    return backend
+
+
+def newInstanceOfSerial(serialProps: SerialProperties):
+    if findSerialBackend(serialProps) == SERIAL_BACKEND_TERMIOS:
+        return RawSerial(serialProps)
+    try:
+        import serial
+    except ImportError:
+        logging.error("serial package not found")
+        raise
+    return serial.Serial(
+        serialProps.devicePath,
+        serialProps.serialPort,
+        xonxoff=serialProps.xonxoff,
+        rtscts=serialProps.rtscts,
+        bytesize=serialProps.bytesize,
+        parity=serialProps.parity,
+        stopbits=serialProps.stopbits,
+        timeout=serialProps.timeout,
+    )
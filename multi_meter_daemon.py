@@ -0,0 +1,346 @@
+import asyncio
+import json
+import logging
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from write_data import (
+    WriteData,
+    MqttDataWriter,
+    MqttTopicWriter,
+    MultiDataWriter,
+    SharedDataWriter,
+    MQTT_MODE_ENTRY,
+)
+from sml_block_maper import mapSmlBlocksObisEntry
+from sml_step_reader import encodeSmlFrame
+from sml_frame_decoder import SmlFrameDecoder, SmlReadStats
+from meter_obis_value_index import (
+    findMeterConfiguration,
+    reloadMeterConfiguration,
+    meterProfileDirectories,
+    MeterProperties,
+)
+from meter_serial import SerialProperties, newInstanceOfSerial
+from sml_entry_filter import FilterDataWriter, createEntryFilter
+from sml_aggregator import AggregateDataWriter, SmlAggregator
+from sml_metrics import MetricsRegistry, METRICS_DISABLED
+from write_ahead_buffer import WriteAheadBuffer, FSYNC_INTERVAL
+from sml_serializer import EntrySerializer, SERIALIZER_JSON
+from sml_message_cache import (
+    SmlMessageCache,
+    mapSmlFrame,
+    addMessageCacheMetrics,
+    DEFAULT_MESSAGE_CACHE_SIZE,
+)
+
+logger = logging.getLogger('general_logger')
+
+
+class MeterPort:
+    """
+    One serial port with its own frame decoder. The port is read by the event loop when data is available.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        serialProps: SerialProperties,
+        meterProperties: MeterProperties,
+        writer: WriteData,
+        reconnectDelay: float = 60,
+        metrics: MetricsRegistry = METRICS_DISABLED,
+        meterKey: str = None,
+        writeExecutor: ThreadPoolExecutor = None,
+    ):
+        super().__init__()
+        self.name = name
+        self.meterKey = meterKey
+        # single worker thread for writers which block, the entries are written in the order of the frames
+        self.writeExecutor = writeExecutor
+        self.serialProps = serialProps
+        self.meterProperties = meterProperties
+        self.writer = writer
+        self.reconnectDelay = reconnectDelay
+        self.stats = SmlReadStats()
+        self.serialDevice = None
+        self.decoder = None
+        self.failed = None
+        self.metrics = metrics
+        labels = {"meter": name}
+        metrics.addReadStats(self.stats, labels)
+        self.parseSeconds = metrics.histogram("sml_parse_seconds", "Time to parse a frame", labels)
+        self.mapSeconds = metrics.histogram("sml_map_seconds", "Time to map the sml blocks to entries", labels)
+        # with the message cache a frame is parsed and mapped in one step, only the decode time is measured
+        self.decodeSeconds = metrics.histogram("sml_decode_seconds", "Time to parse and map a frame", labels)
+        self.publishSeconds = metrics.histogram("sml_publish_seconds", "Time to write the entries", labels)
+        self.publishErrors = metrics.counter("sml_publish_errors_total", "Failed writes of entries", labels)
+        if meterProperties.messageCache is not None:
+            addMessageCacheMetrics(metrics, meterProperties.messageCache, labels)
+
+    def open(self, loop: asyncio.AbstractEventLoop):
+        self.serialDevice = newInstanceOfSerial(self.serialProps)
+        self.decoder = SmlFrameDecoder(self.meterProperties.smlConfig, stats=self.stats)
+        self.failed = loop.create_future()
+        loop.add_reader(self.serialDevice.fileno(), self.onReadable)
+        logger.info("Read data from serial port {}".format(self.serialProps.devicePath))
+
+    def close(self, loop: asyncio.AbstractEventLoop):
+        if self.serialDevice is not None:
+            loop.remove_reader(self.serialDevice.fileno())
+            self.serialDevice.close()
+            self.serialDevice = None
+
+    def onReadable(self):
+        # only read and decode errors close the port, a failed write is logged by writeEntries
+        try:
+            chunk = self.serialDevice.read(self.serialDevice.in_waiting or 1)
+            if len(chunk) == 0:
+                # the event loop only calls onReadable for a readable port, no data is a hung up port
+                raise OSError("device reports readiness to read but returned no data")
+            self.stats.byteCount += len(chunk)
+            if self.decoder.smlConfig is not self.meterProperties.smlConfig:
+                # the meter profile was reloaded
+                self.decoder = SmlFrameDecoder(self.meterProperties.smlConfig, stats=self.stats)
+            for frame in self.decoder.feed(chunk):
+                if self.metrics.enabled:
+                    self.writeFrameTimed(frame)
+                    continue
+                smlEntries = mapSmlFrame(frame, self.meterProperties, self.stats)
+                if len(smlEntries) > 0:
+                    self.writeEntries(smlEntries)
+        except Exception as e:
+            if not self.failed.done():
+                self.failed.set_exception(e)
+
+    def writeFrameTimed(self, frame):
+        start = time.perf_counter()
+        if self.meterProperties.messageCache is not None:
+            # parsing and mapping are one step with the message cache
+            smlEntries = mapSmlFrame(frame, self.meterProperties, self.stats)
+            self.decodeSeconds.observe(time.perf_counter() - start)
+        else:
+            smlBlocks = encodeSmlFrame(frame, self.meterProperties.smlConfig, self.stats)
+            parsed = time.perf_counter()
+            smlEntries = mapSmlBlocksObisEntry(smlBlocks, self.meterProperties)
+            mapped = time.perf_counter()
+            self.parseSeconds.observe(parsed - start)
+            self.mapSeconds.observe(mapped - parsed)
+            self.decodeSeconds.observe(mapped - start)
+        if len(smlEntries) > 0:
+            self.writeEntries(smlEntries)
+
+    def writeEntries(self, smlEntries):
+        if self.writeExecutor is not None:
+            self.writeExecutor.submit(self.writeEntriesNow, smlEntries)
+        else:
+            self.writeEntriesNow(smlEntries)
+
+    def writeEntriesNow(self, smlEntries):
+        try:
+            start = time.perf_counter()
+            self.writer.writeData(smlEntries)
+            self.publishSeconds.observe(time.perf_counter() - start)
+        except Exception as e:
+            self.publishErrors.inc()
+            logger.error("{}: {}".format(self.name, e))
+
+    def reloadProfile(self):
+        if self.meterKey is not None:
+            reloadMeterConfiguration(self.meterProperties, self.meterKey)
+
+    async def run(self, stopEvent: asyncio.Event):
+        loop = asyncio.get_running_loop()
+        stopTask = asyncio.ensure_future(stopEvent.wait())
+        try:
+            while not stopEvent.is_set():
+                try:
+                    self.open(loop)
+                    await asyncio.wait(
+                        [self.failed, stopTask], return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if self.failed.done():
+                        self.failed.result()
+                except Exception as e:
+                    logger.error("{}: {}".format(self.name, e))
+                    self.close(loop)
+                    # wait before reopening the port, stop immediately on shutdown
+                    await asyncio.wait([stopTask], timeout=self.reconnectDelay)
+                finally:
+                    self.close(loop)
+        finally:
+            stopTask.cancel()
+
+
+# config keys of a meter and the matching SerialProperties attribute
+SERIAL_CONFIG_KEYS = {
+    "baudrate": "serialPort",
+    "xonxoff": "xonxoff",
+    "rtscts": "rtscts",
+    "bytesize": "bytesize",
+    "parity": "parity",
+    "stopbits": "stopbits",
+    "backend": "backend",
+}
+
+
+def createSerialProperties(meterConfig: dict):
+    # the event loop only reads when data is available, so the port never blocks
+    serialProps = SerialProperties(devicePath=meterConfig["device"], timeout=0)
+    for configKey, attribute in SERIAL_CONFIG_KEYS.items():
+        if configKey in meterConfig:
+            setattr(serialProps, attribute, meterConfig[configKey])
+    return serialProps
+
+
+def loadMultiMeterConfig(configPath: str):
+    with open(configPath, "r") as configFile:
+        if configPath.endswith((".yml", ".yaml")):
+            import yaml
+
+            return yaml.safe_load(configFile)
+        return json.load(configFile)
+
+
+def createMeterPorts(config: dict, writer: WriteData = None, metrics: MetricsRegistry = METRICS_DISABLED):
+    """
+    Create the meter ports of the config. All meters share one writer, with mqtt every meter publishes on its own topic.
+    """
+    meterProfileDirectories.extend(
+        directory for directory in config.get("profiles", []) if directory not in meterProfileDirectories
+    )
+    mqttConfig = config.get("mqtt")
+    mqttWriter = None
+    if writer is None and mqttConfig is not None:
+        bufferConfig = mqttConfig.get("buffer")
+        mqttWriter = MqttDataWriter(
+            mqttConfig.get("url", "localhost"),
+            mqttConfig.get("port", 1883),
+            mqttConfig.get("topic", ""),
+            mqttConfig.get("qos", 0),
+            mode=mqttConfig.get("mode", MQTT_MODE_ENTRY),
+            metrics=metrics,
+            writeAheadBuffer=WriteAheadBuffer(
+                bufferConfig["directory"],
+                segmentSize=bufferConfig.get("segmentSize", 1 << 20),
+                maxSegments=bufferConfig.get("segments", 16),
+                fsyncPolicy=bufferConfig.get("fsync", FSYNC_INTERVAL),
+            )
+            if bufferConfig is not None
+            else None,
+            drainRate=mqttConfig.get("drainRate", 20),
+            serializer=EntrySerializer(
+                mqttConfig.get("format", SERIALIZER_JSON),
+                mqttConfig.get("fields"),
+                mqttConfig.get("dropFields"),
+            ),
+        )
+        writer = mqttWriter
+    sqliteWriter = createSqliteWriter(config["sqlite"]) if "sqlite" in config else None
+    if writer is None and sqliteWriter is None:
+        writer = WriteData()
+    writeExecutor = None
+    if sqliteWriter is not None:
+        # the sqlite writer commits, deletes expired rows and vacuums in writeData, not on the event loop
+        writeExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="meter-writer")
+
+    meterPorts = []
+    for meterConfig in config["meters"]:
+        # the meter writer is closed per meter, the shared writer once after all meters
+        meterWriter = None if writer is None else SharedDataWriter(writer)
+        if mqttWriter is not None and "topic" in meterConfig:
+            meterWriter = MqttTopicWriter(mqttWriter, meterConfig["topic"])
+        if sqliteWriter is not None:
+            # every meter has its own series in the database, without mqtt the values are only stored
+            from sqlite_data_writer import SqliteMeterWriter
+
+            meterSqliteWriter = SqliteMeterWriter(
+                sqliteWriter, meterConfig.get("name", meterConfig["device"])
+            )
+            if meterWriter is None:
+                meterWriter = meterSqliteWriter
+            else:
+                meterWriter = MultiDataWriter([meterWriter, meterSqliteWriter])
+        meterProperties = findMeterConfiguration(meterConfig["meter"])
+        meterProperties.smlConfig.crcCheck = meterConfig.get("crcCheck", True)
+        messageCacheSize = meterConfig.get("messageCache", DEFAULT_MESSAGE_CACHE_SIZE)
+        if messageCacheSize > 0:
+            meterProperties.messageCache = SmlMessageCache(messageCacheSize)
+        # the aggregator gets every telegram, the filter only gets the summaries
+        if meterConfig.get("filter", False):
+            meterWriter = FilterDataWriter(meterWriter, createEntryFilter(meterProperties))
+        if "aggregate" in meterConfig:
+            meterWriter = AggregateDataWriter(meterWriter, SmlAggregator(meterConfig["aggregate"]))
+        meterPorts.append(
+            MeterPort(
+                meterConfig.get("name", meterConfig["device"]),
+                createSerialProperties(meterConfig),
+                meterProperties,
+                meterWriter,
+                reconnectDelay=config.get("reconnectDelay", 60),
+                metrics=metrics,
+                meterKey=meterConfig["meter"],
+                writeExecutor=writeExecutor,
+            )
+        )
+    if sqliteWriter is not None:
+        writer = sqliteWriter if writer is None else MultiDataWriter([writer, sqliteWriter])
+    return meterPorts, writer
+
+
+def createSqliteWriter(sqliteConfig: dict):
+    """
+    Database of the config, the retention is given in days per resolution: "raw", "60", "900" and "3600".
+    """
+    from sqlite_data_writer import SqliteDataWriter, RAW_RESOLUTION, ROLLUP_WINDOWS
+
+    retention = dict()
+    for resolution in (RAW_RESOLUTION,) + ROLLUP_WINDOWS:
+        key = "raw" if resolution == RAW_RESOLUTION else str(resolution)
+        if key in sqliteConfig.get("retention", dict()):
+            days = sqliteConfig["retention"][key]
+            retention[resolution] = None if days is None else days * 86400
+    return SqliteDataWriter(
+        sqliteConfig["path"],
+        flushInterval=sqliteConfig.get("flushInterval", 10),
+        retention=retention,
+    )
+
+
+async def runMeterPorts(meterPorts: List[MeterPort], stopEvent: asyncio.Event = None):
+    loop = asyncio.get_running_loop()
+    if stopEvent is None:
+        stopEvent = asyncio.Event()
+        for signum in [signal.SIGTERM, signal.SIGINT]:
+            loop.add_signal_handler(signum, stopEvent.set)
+        if hasattr(signal, "SIGHUP"):
+            loop.add_signal_handler(
+                signal.SIGHUP, lambda: [meterPort.reloadProfile() for meterPort in meterPorts]
+            )
+    await asyncio.gather(*[meterPort.run(stopEvent) for meterPort in meterPorts])
+
+
+def runMultiMeter(configPath: str, writer: WriteData = None, metrics: MetricsRegistry = METRICS_DISABLED):
+    config = loadMultiMeterConfig(configPath)
+    meterPorts, writer = createMeterPorts(config, writer, metrics)
+    logger.info("Starting read data of {} meters".format(len(meterPorts)))
+    try:
+        asyncio.run(runMeterPorts(meterPorts))
+    finally:
+        closeMeterPorts(meterPorts, writer)
+
+
+def closeMeterPorts(meterPorts: List[MeterPort], writer: WriteData):
+    """
+    Close the writer of every meter, which writes the open aggregation window, then the shared writer.
+    The queued writes are finished first.
+    """
+    for writeExecutor in {meterPort.writeExecutor for meterPort in meterPorts} - {None}:
+        writeExecutor.shutdown(wait=True)
+    for meterPort in meterPorts:
+        try:
+            meterPort.writer.close()
+        except Exception as e:
+            logger.error("{}: {}".format(meterPort.name, e))
+    writer.close()
@@ -52,7 +52,10 @@ class ObisEntryValueIndex:
         valueIndex: int=-1,
         valueSignature: int=-1,
         obisKey: str = None,
-        manualScaler: float = None,
+        manualScaler: int = None,
+        manualUnit: int = None,
+        publishName: str = None,
+        exactValue: bool = False,
     ):
         self.obisIndex = obisIndex
         self.statusIndex = statusIndex
@@ -61,4 +64,39 @@ class ObisEntryValueIndex:
         self.scalerIndex = scalerIndex
         self.valueIndex = valueIndex
         self.valueSignature = valueSignature
+        # power of ten of the meter profile instead of the telegram scaler
         self.manualScaler = manualScaler
+        # unit code and name of the meter profile instead of the telegram values
+        self.manualUnit = manualUnit
+        self.publishName = publishName
+        # publish the unscaled integer value with the scaler
+        self.exactValue = exactValue
+
+
+class ObisFilterRule:
+    """
+    Publish an entry when its value changed by more than both deadbands, but not more often than minInterval seconds.
+    An unchanged entry is published again after maxSilence seconds (None: never).
+    """
+
+    def __init__(
+        self,
+        absoluteDeadband: float = 0,
+        relativeDeadband: float = 0,
+        minInterval: float = 0,
+        maxSilence: float = None,
+    ):
+        super().__init__()
+        self.absoluteDeadband = absoluteDeadband
+        self.relativeDeadband = relativeDeadband
+        self.minInterval = minInterval
+        self.maxSilence = maxSilence
+
+    def changed(self, value, lastValue):
+        if not isinstance(value, (int, float)) or not isinstance(lastValue, (int, float)):
+            return value != lastValue
+        difference = abs(value - lastValue)
+        return (
+            difference > self.absoluteDeadband
+            and difference > self.relativeDeadband * abs(lastValue)
+        )
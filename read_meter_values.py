@@ -1,122 +1,70 @@
 #!/usr/bin/python3
 
 import argparse
+import signal
 import sys
-import time
 import logging
 from typing import List
-from write_data import WriteData, MqttDataWriter
+from write_data import WriteData, MqttDataWriter, MultiDataWriter, MQTT_MODES, MQTT_MODE_ENTRY
 from sml_block_maper import mapSmlBlocksObisEntry
 from obis_keys import ObisEntryValueIndex
 from sml_step_reader import encodeSml
+from meter_pipeline import MeterPipeline, QUEUE_POLICIES, QUEUE_POLICY_DROP_OLDEST
 from meter_obis_value_index import (
     findSupportedMeter,
     findMeterConfiguration,
+    reloadMeterConfiguration,
+    meterProfileDirectories,
     MeterProperties,
 )
-from testing.init_test import parsSmlFileData
-import threading
+from meter_serial import SerialProperties, newInstanceOfSerial, SERIAL_BACKENDS, SERIAL_BACKEND_AUTO
+from sml_entry_filter import FilterDataWriter, createEntryFilter
+from sml_aggregator import AggregateDataWriter, SmlAggregator
+from sml_metrics import MetricsRegistry, METRICS_DISABLED
+from file_data_writer import createFileWriter, FILE_FORMATS
+from write_ahead_buffer import WriteAheadBuffer, FSYNC_POLICIES, FSYNC_INTERVAL
+from sml_serializer import EntrySerializer, parseFieldList, SERIALIZER_FORMATS, SERIALIZER_JSON
+from sml_message_cache import SmlMessageCache, DEFAULT_MESSAGE_CACHE_SIZE
 
-try:
-    import serial
-except ImportError:
-    logging.error("serial package not found")
+# the multi meter daemon (asyncio), replay (multiprocessing), sqlite, probe and test modules
+# are imported by their option, a plain serial reader starts without them
 
 logger = logging.getLogger('general_logger')
 
-class SerialProperties:
-    def __init__(
-        self,
-        devicePath="/dev/ttyAMA0",
-        serialPort=9600,
-        xonxoff=0,
-        rtscts=0,
-        bytesize=8,
-        parity="N",
-        stopbits=1,
-    ):
-        super().__init__()
-        self.devicePath = devicePath
-        self.serialPort = serialPort
-        self.xonxoff = xonxoff
-        self.rtscts = rtscts
-        self.bytesize = bytesize
-        self.parity = parity
-        self.stopbits = stopbits
-
 
 def run(
     writer: WriteData,
     meterProperties: MeterProperties,
     serialProps: SerialProperties,
+    queueSize: int = 32,
+    queuePolicy: str = QUEUE_POLICY_DROP_OLDEST,
+    metrics: MetricsRegistry = METRICS_DISABLED,
+    meterKey: str = None,
 ):
     logger.info("Starting read data")
-    while True:
-        with newInstanceOfSerial(serialProps)  as serialDevice:
-            try:
-                serialDevice.close() #when the port is already open, close the port 
-                generateMetrics(serialDevice, writer, meterProperties)
-            except serial.SerialException as e:
-                logger.error(e)
-            except Exception as e:
-                logger.error(e)
-            except KeyboardInterrupt:
-                serialDevice.close()
-                sys.stdout.write("\program closed!\n")
-                exit()
-            finally:
-                serialDevice.close()
-        time.sleep(60)
-
-        
-
-def newInstanceOfSerial(serialProps: SerialProperties):
-    return serial.Serial(
-        serialProps.devicePath,
-        serialProps.serialPort,
-        xonxoff=serialProps.xonxoff,
-        rtscts=serialProps.rtscts,
-        bytesize=serialProps.bytesize,
-        parity=serialProps.parity,
-        stopbits=serialProps.stopbits,
-    ) 
-
-
-def generateMetrics(serialDevice, writer: WriteData, meterProperties: MeterProperties):
-    logger.info("Read data from serial port {}".format(serialProperties.devicePath))
-    smlMsg = bytearray()
-    startSequenc = bytes.fromhex(meterProperties.smlConfig.msgBlockStartBlock)
-    endSequenc = bytes.fromhex(meterProperties.smlConfig.endEscapeSequenz)
-    startIndex=0
-    # open and close the serial connection to prevent serial connection breaks and consistently data sets.
-    serialDevice.open()
-    
-    # find start sequenc
-    while True:
-        smlMsg.extend(serialDevice.read())
-        startIndex = smlMsg.find(startSequenc)
-    
-        if startIndex >= 0:
-            break
-        
-    # buffer bytes and map bytes to SML data set
-    smlMsg = bytearray(smlMsg[startIndex:])
-    while True:
-        smlMsg.extend(serialDevice.read())
-        if smlMsg.find(endSequenc) >= 0:
-            smlMsg.extend(serialDevice.read(3))
-            logger.debug("Serial raw:\n{}".format(smlMsg.hex()))
-            threading.Thread(
-                target=convertDataToSmlEntries(
-                    smlMsg, writer, meterProperties
-                )
-            )
-            smlMsg.clear()
-            break
-        
-    time.sleep(20)    
-    serialDevice.close()
-            
+    pipeline = MeterPipeline(
+        lambda: newInstanceOfSerial(serialProps),
+        writer,
+        meterProperties,
+        queueSize=queueSize,
+        queuePolicy=queuePolicy,
+        metrics=metrics,
+    )
+    # systemd stops the service with SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: pipeline.stop())
+    if meterKey is not None and hasattr(signal, "SIGHUP"):
+        # reload the meter profile without restart
+        signal.signal(
+            signal.SIGHUP, lambda signum, frame: reloadMeterConfiguration(meterProperties, meterKey)
+        )
+    pipeline.start()
+    try:
+        pipeline.join()
+    except KeyboardInterrupt:
+        pipeline.stop()
+        pipeline.join()
+    sys.stdout.write("program closed!\n")
+
 
 def convertDataToSmlEntries(
     data: bytes, writer: WriteData, meterProperties: MeterProperties
@@ -139,10 +87,43 @@ def initialArgumentParser():
         help="The name of the device which is monitored",
         default="/dev/ttyAMA0",
     )
-    parser.add_argument("--meter", help="The supported meter device. You can use the ")
+    parser.add_argument(
+        "--serial-backend",
+        help="Read the device with termios (raw tty, bulk reads) or pyserial, auto: termios on POSIX",
+        choices=SERIAL_BACKENDS,
+        default=SERIAL_BACKEND_AUTO,
+    )
+    parser.add_argument(
+        "--meter", help="The supported meter device (see --support) or the path of a meter profile file"
+    )
+    parser.add_argument(
+        "--profiles",
+        help="Directory with additional meter profiles, can be used several times",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--no-crc",
+        help="Do not check the CRC16 of frames and messages",
+        action="store_true",
+    )
     parser.add_argument(
         "--support", help="List of supported meters", action="store_true"
     )
+    parser.add_argument(
+        "--filter",
+        help="Publish entries only on change, with the deadbands and intervals of the meter",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--aggregate",
+        help="Write one summary (mean, min, max, last or counter delta) per OBIS entry every AGGREGATE seconds, e.g. 10, 60 or 900",
+        type=float,
+    )
+    parser.add_argument(
+        "--config",
+        help="Read all meters of the JSON or YAML config file in one process",
+    )
     mqttParser = parser.add_argument_group("mqtt")
     mqttParser.add_argument(
         "--port", help="The port where to expose the exporter", default=1883
@@ -152,15 +133,125 @@ def initialArgumentParser():
     )
     mqttParser.add_argument("--qos", help="The mqtt qos", default=0)
     mqttParser.add_argument("--url", help="The url", default="http://localhost")
+    mqttParser.add_argument(
+        "--mqtt-mode",
+        help="Publish every entry, one JSON document per telegram or only changed entries",
+        choices=MQTT_MODES,
+        default=MQTT_MODE_ENTRY,
+    )
+    mqttParser.add_argument(
+        "--mqtt-queue",
+        help="Maximum number of queued mqtt messages while the broker is not reachable",
+        type=int,
+        default=1000,
+    )
     mqttParser.add_argument(
         "--mqtt",
         action="store_true",
     )
+    mqttParser.add_argument(
+        "--buffer",
+        help="Directory of the write-ahead buffer which stores the messages while the broker is not reachable",
+    )
+    mqttParser.add_argument(
+        "--buffer-segments", help="Maximum number of buffer segment files", type=int, default=16
+    )
+    mqttParser.add_argument(
+        "--buffer-segment-size", help="Size of a buffer segment file in KB", type=int, default=1024
+    )
+    mqttParser.add_argument(
+        "--fsync",
+        help="Sync the buffer to disk after every message, every 5 seconds or never",
+        choices=FSYNC_POLICIES,
+        default=FSYNC_INTERVAL,
+    )
+    mqttParser.add_argument(
+        "--drain-rate",
+        help="Maximum number of messages of an outage published per second after a reconnect",
+        type=float,
+        default=20,
+    )
+
+    payloadParser = parser.add_argument_group(
+        "payload", description="Format and fields of the console output and the mqtt messages."
+    )
+    payloadParser.add_argument(
+        "--payload-format",
+        help="Serialize the entries with json, orjson (json if not installed), MessagePack or CBOR",
+        choices=SERIALIZER_FORMATS,
+        default=SERIALIZER_JSON,
+    )
+    payloadParser.add_argument(
+        "--fields", help="Comma separated entry fields which are kept, e.g. obis,value,unit"
+    )
+    payloadParser.add_argument(
+        "--drop-fields", help="Comma separated entry fields which are left out, e.g. signature,status,obisName"
+    )
 
     parser.add_argument("-rr", help="repetition rate in 1 minute", default=1)
+    sqliteParser = parser.add_argument_group("sqlite", description="Store the values in a local database.")
+    sqliteParser.add_argument(
+        "--sqlite",
+        help="SQLite database file for the values and the 1 minute, 15 minute and 1 hour rollups",
+    )
+    sqliteParser.add_argument(
+        "--sqlite-retention",
+        help="Days to keep the raw values, the rollups are kept longer",
+        type=float,
+        default=7,
+    )
+    pipelineParser = parser.add_argument_group("pipeline")
+    pipelineParser.add_argument(
+        "--message-cache",
+        help="Number of SML messages whose entries are cached per meter, 0 parses every message",
+        type=int,
+        default=DEFAULT_MESSAGE_CACHE_SIZE,
+    )
+    pipelineParser.add_argument(
+        "--queue-size", help="Maximum number of queued frames and telegrams", type=int, default=32
+    )
+    pipelineParser.add_argument(
+        "--queue-policy",
+        help="Wait for the next stage or drop the oldest item when a queue is full",
+        choices=QUEUE_POLICIES,
+        default=QUEUE_POLICY_DROP_OLDEST,
+    )
+    parser.add_argument(
+        "--metrics-port",
+        help="Serve counters and latency histograms of the read stages on http://localhost:PORT/metrics",
+        type=int,
+    )
     testGroup = parser.add_argument_group("test", description="Run test for sml data.")
     testGroup.add_argument("--test", "-t", action="store_true")
     testGroup.add_argument("--file", "-f", help="File path to the hex data file.")
+    replayGroup = parser.add_argument_group(
+        "replay", description="Decode a large captured hex or binary file in constant memory."
+    )
+    replayGroup.add_argument("--replay", help="File path to the hex or binary capture file.")
+    replayGroup.add_argument(
+        "--output",
+        "-o",
+        help="Output file, the format is taken from the extension (.csv, .jsonl, .parquet). Default JSON on stdout.",
+    )
+    replayGroup.add_argument("--format", help="Format of the output file", choices=FILE_FORMATS)
+    replayGroup.add_argument(
+        "--processes", help="Number of processes which decode ranges of the file", type=int, default=1
+    )
+    replayGroup.add_argument(
+        "--chunk-size", help="Size of the file ranges of the processes in MB", type=float, default=0.25
+    )
+    probeGroup = parser.add_argument_group(
+        "probe", description="Find the serial settings and the value index of an unknown meter."
+    )
+    probeGroup.add_argument(
+        "--probe",
+        help="Probe the device, or the hex data file of --file, and print the meter profile",
+        action="store_true",
+    )
+    probeGroup.add_argument("--probe-output", help="Save the probed meter profile to the file")
+    probeGroup.add_argument(
+        "--probe-timeout", help="Seconds to read the device per serial setting", type=float, default=5.0
+    )
 
     return parser
 
@@ -169,18 +260,107 @@ if __name__ == "__main__":
     parser = initialArgumentParser()
     args = parser.parse_args()
 
+    meterProfileDirectories.extend(args.profiles)
     meterConfiguration = findMeterConfiguration(args.meter)
+    meterConfiguration.smlConfig.crcCheck = not args.no_crc
     logger.setLevel(args.log)
-    serialProperties = SerialProperties(devicePath=args.device)
+    serialProperties = SerialProperties(devicePath=args.device, backend=args.serial_backend)
+    serializer = EntrySerializer(
+        args.payload_format, parseFieldList(args.fields), parseFieldList(args.drop_fields)
+    )
+    metrics = METRICS_DISABLED
+    if args.metrics_port is not None:
+        from sml_metrics import MetricsServer
+
+        metrics = MetricsRegistry()
+        MetricsServer(metrics, args.metrics_port).start()
 
     if args.support:
         print(findSupportedMeter())
+    elif args.probe:
+        from meter_probe import probeMeter, probeData, writeMeterProfile
+
+        profileName = args.meter or "probed"
+        if args.file:
+            with open(args.file, "r") as hexFile:
+                profile = probeData(bytes.fromhex(hexFile.read()), profileName, crcCheck=not args.no_crc)
+        else:
+            profile = probeMeter(args.device, profileName, candidateTimeout=args.probe_timeout)
+        if profile is None:
+            logger.error("No OBIS list entries found, no meter profile written")
+            sys.exit(1)
+        writeMeterProfile(profile, args.probe_output)
+    elif args.config:
+        from multi_meter_daemon import runMultiMeter
+
+        runMultiMeter(args.config, metrics=metrics)
     elif args.test:
+        from testing.init_test import parsSmlFileData
+
         logger.info("Run test")
         parsSmlFileData(args.file, meterConfiguration)
-    elif args.mqtt:
-        mqttWrite = MqttDataWriter(args.url, args.port, args.topic, args.qos)
-        run(mqttWrite, meterConfiguration, serialProperties)
+    elif args.replay:
+        from sml_replay import replayCapture
+
+        writer = createFileWriter(args.output, args.format) if args.output else WriteData(serializer)
+        try:
+            stats = replayCapture(
+                args.replay,
+                args.meter,
+                writer,
+                processes=args.processes,
+                chunkSize=int(args.chunk_size * (1 << 20)),
+                crcCheck=not args.no_crc,
+            )
+            logger.info("Replay finished: {}".format(stats.__dict__))
+        finally:
+            writer.close()
     else:
-        writer = WriteData()
-        valueResults = run(writer, meterConfiguration, serialProperties)
+        if args.mqtt:
+            writer = MqttDataWriter(
+                args.url,
+                args.port,
+                args.topic,
+                args.qos,
+                mode=args.mqtt_mode,
+                maxQueuedMessages=args.mqtt_queue,
+                metrics=metrics,
+                writeAheadBuffer=WriteAheadBuffer(
+                    args.buffer,
+                    segmentSize=args.buffer_segment_size << 10,
+                    maxSegments=args.buffer_segments,
+                    fsyncPolicy=args.fsync,
+                )
+                if args.buffer
+                else None,
+                drainRate=args.drain_rate,
+                serializer=serializer,
+            )
+        else:
+            writer = WriteData(serializer)
+        if args.sqlite:
+            from sqlite_data_writer import SqliteDataWriter, RAW_RESOLUTION
+
+            sqliteWriter = SqliteDataWriter(
+                args.sqlite,
+                meter=args.meter,
+                retention={RAW_RESOLUTION: args.sqlite_retention * 86400},
+            )
+            # without mqtt the values are only stored, not printed
+            writer = MultiDataWriter([writer, sqliteWriter]) if args.mqtt else sqliteWriter
+        # the aggregator gets every telegram, the filter only gets the summaries
+        if args.filter:
+            writer = FilterDataWriter(writer, createEntryFilter(meterConfiguration))
+        if args.aggregate is not None:
+            writer = AggregateDataWriter(writer, SmlAggregator(args.aggregate))
+        if args.message_cache > 0:
+            meterConfiguration.messageCache = SmlMessageCache(args.message_cache)
+        run(
+            writer,
+            meterConfiguration,
+            serialProperties,
+            args.queue_size,
+            args.queue_policy,
+            metrics,
+            args.meter,
+        )
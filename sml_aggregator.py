@@ -0,0 +1,193 @@
+import time
+from typing import List
+from sml_block_maper import SmlEntry, scaleValue
+from obis_keys import OBIS_NAMES
+from write_data import WriteData
+
+
+def isCounterObisKey(obisKey: str):
+    """
+    OBIS value group D 8 is a time integral (energy register), its change per window is reported.
+    """
+    return len(obisKey) >= 8 and obisKey[6:8] == "08"
+
+
+class ObisAggregate:
+    """
+    firstBase and lastBase are the unscaled integer values, counter deltas are computed from them
+    without the rounding of the scaled float values. They are None for other values or a changed scaler.
+    """
+
+    __slots__ = ("count", "sum", "min", "max", "first", "last", "unit", "firstBase", "lastBase", "scaler")
+
+    def __init__(self, value: float, unit: str, baseValue: int = None, scaler: int = 0):
+        self.count = 1
+        self.sum = value
+        self.min = value
+        self.max = value
+        self.first = value
+        self.last = value
+        self.unit = unit
+        self.firstBase = baseValue
+        self.lastBase = baseValue
+        self.scaler = scaler
+
+    def add(self, value: float, baseValue: int = None, scaler: int = 0):
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+        self.last = value
+        if scaler == self.scaler:
+            self.lastBase = baseValue
+        else:
+            self.firstBase = None
+            self.lastBase = None
+
+    def counterDelta(self, previous: "ObisAggregate" = None):
+        """
+        Change of the counter since the last value of the previous window or the first value of this one.
+        """
+        if previous is None:
+            baseValue, value = self.firstBase, self.first
+        elif previous.scaler == self.scaler:
+            baseValue, value = previous.lastBase, previous.last
+        else:
+            baseValue, value = None, previous.last
+        if baseValue is not None and self.firstBase is not None and self.lastBase is not None:
+            return scaleValue(self.lastBase - baseValue, self.scaler)
+        return self.last - value
+
+
+class SmlAggregateEntry:
+    """
+    Summary of an OBIS entry for one window. value is the mean of a measurement or the delta of a counter.
+    """
+
+    def __init__(
+        self,
+        obis: str,
+        aggregate: ObisAggregate,
+        windowStart: float,
+        window: float,
+        counter: bool,
+        previous: ObisAggregate = None,
+    ):
+        super().__init__()
+        self.obis = obis
+        self.obisName = OBIS_NAMES.get(obis)
+        self.unit = aggregate.unit
+        self.windowStart = windowStart
+        self.window = window
+        self.count = aggregate.count
+        if counter:
+            self.value = aggregate.counterDelta(previous)
+        else:
+            self.value = aggregate.sum / aggregate.count
+        self.min = aggregate.min
+        self.max = aggregate.max
+        self.last = aggregate.last
+
+    @property
+    def summary(self):
+        return {
+            "min": self.min,
+            "max": self.max,
+            "last": self.last,
+            "count": self.count,
+            "windowStart": self.windowStart,
+            "window": self.window,
+        }
+
+    def __str__(self):
+        return "{} ({})  {}".format(self.obis, self.obisName, self.value)
+
+
+class SmlAggregator:
+    """
+    Aggregate numeric entries per OBIS key in windows aligned to the clock, e.g. 10, 60 or 900 seconds.
+    Memory is constant per OBIS key: count, sum, min, max, first and last value of the open window.
+    """
+
+    def __init__(self, window: float, counterKeys: set = None, clock=time.time):
+        super().__init__()
+        self.window = window
+        self.counterKeys = counterKeys
+        self.clock = clock
+        self.windowStart = None
+        self.aggregates = dict()
+        # counter aggregates of the previous window, the delta includes the step between two windows
+        self.counterBases = dict()
+
+    def isCounter(self, obisKey: str):
+        if self.counterKeys is not None:
+            return obisKey in self.counterKeys
+        return isCounterObisKey(obisKey)
+
+    def addEntries(self, data: List[SmlEntry]):
+        """
+        Add the entries of a telegram. Returns the summaries of the closed window or an empty list.
+        """
+        now = self.clock()
+        summaries = []
+        if self.windowStart is None:
+            self.windowStart = now - now % self.window
+        elif now >= self.windowStart + self.window:
+            summaries = self.flush()
+            self.windowStart = now - now % self.window
+
+        aggregates = self.aggregates
+        for dataItem in data:
+            value = dataItem.value
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            baseValue = dataItem.baseValue if type(dataItem.baseValue) is int else None
+            aggregate = aggregates.get(dataItem.obis)
+            if aggregate is None:
+                aggregates[dataItem.obis] = ObisAggregate(value, dataItem.unit, baseValue, dataItem.scaler)
+            else:
+                aggregate.add(value, baseValue, dataItem.scaler)
+        return summaries
+
+    def flush(self):
+        summaries = []
+        for obisKey, aggregate in self.aggregates.items():
+            counter = self.isCounter(obisKey)
+            summaries.append(
+                SmlAggregateEntry(
+                    obisKey,
+                    aggregate,
+                    self.windowStart,
+                    self.window,
+                    counter,
+                    self.counterBases.get(obisKey),
+                )
+            )
+            if counter:
+                self.counterBases[obisKey] = aggregate
+        self.aggregates = dict()
+        return summaries
+
+
+class AggregateDataWriter(WriteData):
+    """
+    Write one summary per OBIS key and window with the wrapped writer instead of every telegram.
+    """
+
+    def __init__(self, writer: WriteData, aggregator: SmlAggregator):
+        super().__init__()
+        self.writer = writer
+        self.aggregator = aggregator
+
+    def writeData(self, data: List[SmlEntry]):
+        summaries = self.aggregator.addEntries(data)
+        if len(summaries) > 0:
+            self.writer.writeData(summaries)
+
+    def close(self):
+        summaries = self.aggregator.flush()
+        if len(summaries) > 0:
+            self.writer.writeData(summaries)
+        self.writer.close()
@@ -0,0 +1,176 @@
+import logging
+from typing import Dict, Iterable
+from obis_keys import OBIS_NAMES
+from sml_block_maper import (
+    SCALER_POWERS,
+    ObisExtractionPlan,
+    compileObisExtractionPlan,
+    findObisExtractionPlanValues,
+    telegramShape,
+    valueAt,
+)
+from sml_step_reader import encodeSmlFrame
+from sml_frame_decoder import SmlFrameDecoder, SmlFrame, SmlReadStats
+from meter_obis_value_index import MeterProperties
+
+logger = logging.getLogger('general_logger')
+
+
+class ObisColumns:
+    """
+    Columns of one OBIS key with one row per telegram which contains a numeric value of the key.
+    The columns are lists while telegrams are added and NumPy arrays after toArrays.
+    """
+
+    def __init__(self, obis: str, name: str):
+        super().__init__()
+        self.obis = obis
+        self.name = name
+        # position of the telegram in the batch
+        self.telegramIndexes = []
+        # timestamp of the telegram, NaN without timestamps
+        self.timestamps = []
+        self.rawValues = []
+        # power of ten of the meter properties or of the entry, 0 without scaler
+        self.scalers = []
+        # SML unit code, -1 without unit
+        self.units = []
+        self.values = None
+
+    def __len__(self):
+        return len(self.telegramIndexes)
+
+    def append(self, telegramIndex: int, timestamp: float, rawValue: int, scaler, unit):
+        self.telegramIndexes.append(telegramIndex)
+        self.timestamps.append(timestamp)
+        self.rawValues.append(rawValue)
+        self.scalers.append(scaler if isinstance(scaler, int) and -128 <= scaler < 128 else 0)
+        self.units.append(unit if isinstance(unit, int) else -1)
+
+    def toArrays(self, numpy):
+        self.telegramIndexes = numpy.array(self.telegramIndexes, dtype=numpy.int64)
+        self.timestamps = numpy.array(self.timestamps, dtype=numpy.float64)
+        try:
+            self.rawValues = numpy.array(self.rawValues, dtype=numpy.int64)
+        except OverflowError:
+            # unsigned 64 bit counters above the int64 range
+            self.rawValues = numpy.array(self.rawValues, dtype=numpy.float64)
+        self.scalers = numpy.array(self.scalers, dtype=numpy.int16)
+        self.units = numpy.array(self.units, dtype=numpy.int16)
+        # same scaling as SmlEntry.sensorValue, negative scalers divide by the power of ten
+        powers = numpy.array(SCALER_POWERS, dtype=numpy.float64)[self.scalers + 128]
+        rawValues = self.rawValues.astype(numpy.float64)
+        self.values = numpy.where(self.scalers < 0, rawValues / powers, rawValues * powers)
+
+
+class TelegramBatchMapper:
+    """
+    Map telegrams with the same schema to columns per OBIS key. The values are taken with the OBIS extraction
+    plan of the meter properties, no SmlEntry is created. Telegrams with another shape get their own plan.
+    """
+
+    def __init__(self, meterProperties: MeterProperties):
+        super().__init__()
+        self.meterProperties = meterProperties
+        self.plans: Dict[tuple, ObisExtractionPlan] = dict()
+        self.columns: Dict[str, ObisColumns] = dict()
+        self.stats = SmlReadStats()
+        self.decoder = SmlFrameDecoder(meterProperties.smlConfig, stats=self.stats)
+        self.telegramCount = 0
+
+    def findPlan(self, smlBlocks: list):
+        shape = telegramShape(smlBlocks)
+        plan = self.plans.get(shape)
+        if plan is None:
+            plan = compileObisExtractionPlan(smlBlocks, self.meterProperties)
+            self.plans[shape] = plan
+        return plan
+
+    def addFrame(self, frame: SmlFrame, timestamp: float = float("nan")):
+        smlBlocks = encodeSmlFrame(frame, self.meterProperties.smlConfig, self.stats)
+        if len(smlBlocks) == 0:
+            return
+        plan = self.findPlan(smlBlocks)
+        entryValues = findObisExtractionPlanValues(plan, smlBlocks)
+        if entryValues is None:
+            # same shape but the OBIS keys moved, compile the plan of the telegram
+            plan = compileObisExtractionPlan(smlBlocks, self.meterProperties)
+            self.plans[plan.shape] = plan
+            entryValues = findObisExtractionPlanValues(plan, smlBlocks)
+        for entry, values in zip(plan.entries, entryValues):
+            rawValue = valueAt(values, entry.valueIndex)
+            if not isinstance(rawValue, int) or isinstance(rawValue, bool):
+                # octet strings like the device id have no numeric column
+                continue
+            columns = self.columns.get(entry.obisKey)
+            if columns is None:
+                columns = ObisColumns(entry.obisKey, entry.publishName or OBIS_NAMES.get(entry.obisKey))
+                self.columns[entry.obisKey] = columns
+            columns.append(
+                self.telegramCount,
+                timestamp,
+                rawValue,
+                entry.manualScaler
+                if entry.manualScaler is not None
+                else valueAt(values, entry.scalerIndex),
+                entry.manualUnit if entry.manualUnit is not None else valueAt(values, entry.unitIndex),
+            )
+
+    def addTelegram(self, telegram, timestamp: float = float("nan")):
+        """
+        Add a telegram as SmlFrame or as bytes of the frame.
+        """
+        if isinstance(telegram, SmlFrame):
+            self.addFrame(telegram, timestamp)
+        else:
+            self.decoder.reset()
+            for frame in self.decoder.feed(telegram):
+                self.addFrame(frame, timestamp)
+        self.telegramCount += 1
+
+    def finish(self):
+        try:
+            import numpy
+        except ImportError:
+            logging.error("numpy package not found, install it for the batch mapping")
+            raise
+        for columns in self.columns.values():
+            columns.toArrays(numpy)
+        return self.columns
+
+
+def mapTelegramBatch(
+    telegrams: Iterable, meterProperties: MeterProperties, timestamps: Iterable[float] = None
+):
+    """
+    Map a sequence of telegrams (bytes or SmlFrame) to NumPy columns per OBIS key.
+    timestamps are optional, e.g. the receive times of archived telegrams.
+    """
+    batchMapper = TelegramBatchMapper(meterProperties)
+    if timestamps is None:
+        for telegram in telegrams:
+            batchMapper.addTelegram(telegram)
+    else:
+        for telegram, timestamp in zip(telegrams, timestamps):
+            batchMapper.addTelegram(telegram, timestamp)
+    return batchMapper.finish()
+
+
+def captureFrames(filePath: str, decoder: SmlFrameDecoder):
+    from sml_replay import CaptureFile
+
+    with CaptureFile(filePath, decoder.startSequenc, decoder.escapeSequenc) as captureFile:
+        for chunk in captureFile.chunks(0, captureFile.size):
+            decoder.stats.byteCount += len(chunk)
+            yield from decoder.feed(chunk)
+
+
+def mapCaptureBatch(filePath: str, meterProperties: MeterProperties):
+    """
+    Map all frames of a hex or binary capture file (see sml_replay) to NumPy columns per OBIS key.
+    """
+    batchMapper = TelegramBatchMapper(meterProperties)
+    for frame in captureFrames(filePath, SmlFrameDecoder(meterProperties.smlConfig, stats=batchMapper.stats)):
+        batchMapper.addTelegram(frame)
+    return batchMapper.finish()
+
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+# CRC-16/X.25 (DIN EN 62056-46) used for SML transport frames and SML messages:
+# reflected polynomial 0x1021, initial value 0xffff, final xor 0xffff
+
+try:
+    # crc_hqx calculates the not reflected CRC-CCITT in C
+    from binascii import crc_hqx
+except ImportError:
+    crc_hqx = None
+
+
+def _createCrc16X25Table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8408 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+def _createBitReverseTable():
+    table = bytearray(256)
+    for byte in range(256):
+        reversedByte = 0
+        for bit in range(8):
+            if byte & (1 << bit):
+                reversedByte |= 0x80 >> bit
+        table[byte] = reversedByte
+    return bytes(table)
+
+
+CRC16_X25_TABLE = _createCrc16X25Table()
+BIT_REVERSE_TABLE = _createBitReverseTable()
+
+
+def crc16X25Table(data: bytes):
+    crc = 0xFFFF
+    table = CRC16_X25_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc ^ 0xFFFF
+
+
+def crc16X25Batch(data: bytes):
+    """
+    The reflected CRC of the data is the bit reversed not reflected CRC of the bit reversed data bytes.
+    Bit reversing and the CRC run in C for the whole data at once.
+    """
+    crc = crc_hqx(bytes(data).translate(BIT_REVERSE_TABLE), 0xFFFF)
+    crc = (BIT_REVERSE_TABLE[crc & 0xFF] << 8) | BIT_REVERSE_TABLE[crc >> 8]
+    return crc ^ 0xFFFF
+
+
+crc16X25 = crc16X25Batch if crc_hqx is not None else crc16X25Table
+
+
+def checkFrameCrc(frame: bytes):
+    """
+    The frame checksum covers all bytes of the frame in front of it and is sent low byte first.
+    """
+    if len(frame) < 2:
+        return False
+    return crc16X25(frame[:-2]) == (frame[-2] | (frame[-1] << 8))
+
+
+def checkMessageCrc(message: bytes, checkSum: int):
+    """
+    The message checksum covers the message from the list type-length field up to the checksum element.
+    The checksum is sent low byte first and parsed as big endian unsigned value.
+    """
+    crc = crc16X25(message)
+    return checkSum == (((crc & 0xFF) << 8) | (crc >> 8))
@@ -0,0 +1,261 @@
+import logging
+import random
+from typing import List
+from sml_crc import crc16X25
+from obis_keys import ObisEntryValueIndex
+from meter_obis_value_index import MeterProperties
+from sml_aggregator import isCounterObisKey
+
+logger = logging.getLogger('general_logger')
+
+# OBIS keys of an electricity meter with unit code and scaler
+DEFAULT_OBIS_ENTRIES = [
+    ("0100010800", 30, -1),
+    ("0100010801", 30, -1),
+    ("0100010802", 30, -1),
+    ("0100020800", 30, -1),
+    ("0100020801", 30, -1),
+    ("0100020802", 30, -1),
+    ("0100100700", 27, 0),
+    ("0100240700", 27, 0),
+    ("0100380700", 27, 0),
+    ("01004c0700", 27, 0),
+    ("01001f0700", 33, -2),
+    ("0100330700", 33, -2),
+    ("0100470700", 33, -2),
+    ("0100200700", 35, -1),
+    ("0100340700", 35, -1),
+    ("0100480700", 35, -1),
+    ("01000e0700", 44, -1),
+    ("0100510701", 8, 0),
+    ("0100510702", 8, 0),
+    ("0100510704", 8, 0),
+    ("010051070f", 8, 0),
+    ("010051071a", 8, 0),
+]
+
+ESCAPE_SEQUENCE = bytes.fromhex("1b1b1b1b")
+DEFAULT_SERVER_ID = bytes.fromhex("0a0153414720014333e3")
+# position of the value in a list entry when the value time is a secIndex list (child block of the parser)
+TIME_LIST_VALUE_INDEX = 4
+
+
+def encodeTypeLength(smlType: int, length: int):
+    """
+    Encode a type-length field, 4 bits of the length per byte with bit 7 set on all but the last byte.
+    """
+    nibbles = []
+    while True:
+        nibbles.insert(0, length & 0x0F)
+        length >>= 4
+        if length == 0:
+            break
+    fields = bytearray()
+    for index, nibble in enumerate(nibbles):
+        more = 0x80 if index < len(nibbles) - 1 else 0x00
+        fields.append(more | (smlType if index == 0 else 0x00) | nibble)
+    return bytes(fields)
+
+
+def encodeOctetString(value: bytes):
+    if value is None:
+        return b"\x01"
+    # the length of an octet string includes the type-length field
+    tlSize = 1
+    while len(encodeTypeLength(0x00, len(value) + tlSize)) != tlSize:
+        tlSize += 1
+    return encodeTypeLength(0x00, len(value) + tlSize) + value
+
+
+def encodeUnsigned(value: int, size: int):
+    return bytes([0x60 | (size + 1)]) + value.to_bytes(size, "big")
+
+
+def encodeInteger(value: int, size: int):
+    return bytes([0x50 | (size + 1)]) + value.to_bytes(size, "big", signed=True)
+
+
+def encodeBoolean(value: bool):
+    return b"\x42" + (b"\x01" if value else b"\x00")
+
+
+def encodeList(items: List[bytes]):
+    return encodeTypeLength(0x70, len(items)) + b"".join(items)
+
+
+def encodeSecIndex(seconds: int):
+    return encodeList([encodeUnsigned(1, 1), encodeUnsigned(seconds, 4)])
+
+
+def encodeValue(value):
+    """
+    Encode a value with the smallest SML type: unsigned or integer of 1 to 8 bytes, boolean or octet string.
+    """
+    if value is None:
+        return encodeOctetString(None)
+    if isinstance(value, bool):
+        return encodeBoolean(value)
+    if isinstance(value, int):
+        if value < 0:
+            return encodeInteger(value, max(1, (value.bit_length() + 8) // 8))
+        return encodeUnsigned(value, max(1, (value.bit_length() + 7) // 8))
+    if isinstance(value, str):
+        return encodeOctetString(bytes.fromhex(value))
+    return encodeOctetString(bytes(value))
+
+
+def encodeMessage(transactionId: int, groupNo: int, body: bytes):
+    message = bytearray(encodeTypeLength(0x70, 6))
+    message += encodeOctetString(transactionId.to_bytes(5, "big"))
+    message += encodeUnsigned(groupNo, 1)
+    message += encodeUnsigned(0, 1)
+    message += body
+    crc = crc16X25(message)
+    # the message checksum is sent low byte first
+    message += b"\x63" + bytes([crc & 0xFF, crc >> 8])
+    message += b"\x00"
+    return bytes(message)
+
+
+def escapePayload(payload: bytes):
+    # only escape sequences at a multiple of 4 from the start sequence are escaped, the payload is padded
+    escaped = bytearray()
+    copyIndex = 0
+    escapeIndex = payload.find(ESCAPE_SEQUENCE)
+    while escapeIndex >= 0:
+        if escapeIndex % 4 == 0:
+            escaped += payload[copyIndex : escapeIndex + 4] + ESCAPE_SEQUENCE
+            copyIndex = escapeIndex + 4
+            escapeIndex = payload.find(ESCAPE_SEQUENCE, copyIndex)
+        else:
+            escapeIndex = payload.find(ESCAPE_SEQUENCE, escapeIndex + 1)
+    escaped += payload[copyIndex:]
+    return bytes(escaped)
+
+
+def encodeFrame(messages: List[bytes]):
+    payload = b"".join(messages)
+    padding = (4 - len(payload) % 4) % 4
+    payload = escapePayload(payload + b"\x00" * padding)
+    frame = ESCAPE_SEQUENCE + b"\x01\x01\x01\x01" + payload + ESCAPE_SEQUENCE + b"\x1a" + bytes([padding])
+    crc = crc16X25(frame)
+    return frame + bytes([crc & 0xFF, crc >> 8])
+
+
+def encodeListEntry(obisKey: str, status, valTime, unit, scaler, value, signature=None):
+    return encodeList(
+        [
+            # the reader stores the OBIS key without the F group
+            encodeOctetString(bytes.fromhex(obisKey + "ff")),
+            encodeValue(status),
+            valTime,
+            encodeValue(unit),
+            encodeValue(scaler) if scaler is None else encodeInteger(scaler, 1),
+            encodeValue(value),
+            encodeValue(signature),
+        ]
+    )
+
+
+def hasTimeList(obisValueIndex: ObisEntryValueIndex):
+    """
+    True when the profile expects the value time as secIndex list, the parser moves it to a child block
+    and the unit, scaler and value are one position in front.
+    """
+    return obisValueIndex.valueIndex == TIME_LIST_VALUE_INDEX
+
+
+class SmlTelegramEncoder:
+    """
+    Build SML frames (open, get list and close response) whose list entries match the value index
+    of the meter properties, so the reader maps them back to the same values.
+    """
+
+    def __init__(
+        self,
+        meterProperties: MeterProperties,
+        obisEntries: List[tuple] = DEFAULT_OBIS_ENTRIES,
+        serverId: bytes = DEFAULT_SERVER_ID,
+    ):
+        super().__init__()
+        self.meterProperties = meterProperties
+        self.obisEntries = obisEntries
+        self.serverId = serverId
+
+    def encodeEntries(self, values: dict, seconds: int):
+        entries = []
+        for obisKey, unit, scaler in self.obisEntries:
+            if obisKey not in values:
+                continue
+            obisValueIndex = self.meterProperties.getObisValueIndexFor(obisKey)
+            valTime = encodeSecIndex(seconds) if hasTimeList(obisValueIndex) else encodeOctetString(None)
+            entries.append(encodeListEntry(obisKey, None, valTime, unit, scaler, values[obisKey]))
+        return entries
+
+    def encode(self, values: dict, transactionId: int = 0, seconds: int = 0):
+        """
+        Frame with the values of the OBIS keys, e.g. {"0100010800": 51843481}.
+        """
+        entries = [
+            encodeListEntry("0100000009", None, encodeOctetString(None), None, None, self.serverId)
+        ] + self.encodeEntries(values, seconds)
+        openResponse = encodeList(
+            [
+                encodeUnsigned(0x0101, 2),
+                encodeList(
+                    [
+                        encodeOctetString(None),
+                        encodeOctetString(None),
+                        encodeOctetString(transactionId.to_bytes(4, "big")),
+                        encodeOctetString(self.serverId),
+                        encodeOctetString(None),
+                        encodeOctetString(None),
+                    ]
+                ),
+            ]
+        )
+        getListResponse = encodeList(
+            [
+                encodeUnsigned(0x0701, 2),
+                encodeList(
+                    [
+                        encodeOctetString(None),
+                        encodeOctetString(self.serverId),
+                        encodeOctetString(bytes.fromhex("0100620affff")),
+                        encodeSecIndex(seconds),
+                        encodeList(entries),
+                        encodeOctetString(None),
+                        encodeOctetString(None),
+                    ]
+                ),
+            ]
+        )
+        closeResponse = encodeList([encodeUnsigned(0x0201, 2), encodeList([encodeOctetString(None)])])
+        return encodeFrame(
+            [
+                encodeMessage(transactionId * 3, 0, openResponse),
+                encodeMessage(transactionId * 3 + 1, 0, getListResponse),
+                encodeMessage(transactionId * 3 + 2, 0, closeResponse),
+            ]
+        )
+
+
+class MeterValueGenerator:
+    """
+    Raw values of a running meter: energy counters (OBIS value group D 8) increase,
+    measurements move randomly around their start value.
+    """
+
+    def __init__(self, obisEntries: List[tuple] = DEFAULT_OBIS_ENTRIES, rng: random.Random = None):
+        super().__init__()
+        self.rng = rng if rng is not None else random.Random()
+        self.values = {obisKey: self.rng.randrange(1000, 1 << 24) for obisKey, unit, scaler in obisEntries}
+
+    def nextValues(self):
+        rng = self.rng
+        for obisKey, value in self.values.items():
+            if isCounterObisKey(obisKey):
+                self.values[obisKey] = value + rng.randrange(0, 100)
+            else:
+                self.values[obisKey] = max(0, value + rng.randrange(-50, 51))
+        return dict(self.values)
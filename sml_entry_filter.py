@@ -0,0 +1,64 @@
+import time
+from typing import List
+from sml_block_maper import SmlEntry
+from write_data import WriteData
+from obis_keys import ObisFilterRule
+from meter_obis_value_index import MeterProperties
+
+
+class SmlEntryFilter:
+    def __init__(self, rules: dict = None, defaultRule: ObisFilterRule = None, clock=time.monotonic):
+        super().__init__()
+        self.rules = dict() if rules is None else rules
+        self.defaultRule = defaultRule
+        self.clock = clock
+        # OBIS key -> [last published value, time of the last publish]
+        self.states = dict()
+
+    def filterEntries(self, data: List[SmlEntry]):
+        now = self.clock()
+        published = []
+        for dataItem in data:
+            rule = self.rules.get(dataItem.obis, self.defaultRule)
+            if rule is None:
+                published.append(dataItem)
+                continue
+
+            value = dataItem.value
+            state = self.states.get(dataItem.obis)
+            if state is None:
+                self.states[dataItem.obis] = [value, now]
+                published.append(dataItem)
+                continue
+
+            elapsed = now - state[1]
+            if (rule.maxSilence is not None and elapsed >= rule.maxSilence) or (
+                elapsed >= rule.minInterval and rule.changed(value, state[0])
+            ):
+                state[0] = value
+                state[1] = now
+                published.append(dataItem)
+        return published
+
+
+def createEntryFilter(meterProperties: MeterProperties):
+    return SmlEntryFilter(meterProperties.filterRules, meterProperties.defaultFilterRule)
+
+
+class FilterDataWriter(WriteData):
+    """
+    Write only the entries which pass the filter with the wrapped writer.
+    """
+
+    def __init__(self, writer: WriteData, entryFilter: SmlEntryFilter):
+        super().__init__()
+        self.writer = writer
+        self.entryFilter = entryFilter
+
+    def writeData(self, data: List[SmlEntry]):
+        published = self.entryFilter.filterEntries(data)
+        if len(published) > 0:
+            self.writer.writeData(published)
+
+    def close(self):
+        self.writer.close()
@@ -0,0 +1,158 @@
+import logging
+from sml_crc import checkFrameCrc
+
+logger = logging.getLogger('general_logger')
+
+# the end escape sequence is followed by the number of padding bytes and the 2 byte checksum
+SML_FRAME_TRAILER_LENGTH = 3
+
+
+class SmlFrame:
+    def __init__(self, raw: bytes, payload: bytes):
+        super().__init__()
+        # complete transport frame from the start escape sequence to the checksum
+        self.raw = raw
+        # sml messages between the start and the end escape sequence without escaping
+        self.payload = payload
+
+
+class SmlReadStats:
+    def __init__(self):
+        super().__init__()
+        self.byteCount = 0
+        self.readTimeoutCount = 0
+        self.frameCount = 0
+        self.droppedFrameCount = 0
+        self.frameCrcErrorCount = 0
+        self.messageCrcErrorCount = 0
+        self.parseErrorCount = 0
+
+
+class SmlFrameDecoder:
+    """
+    Split a byte stream into SML transport frames.
+    The stream can be fed in chunks of any size. Every byte is only searched once for escape sequences,
+    bytes in front of a start sequence are discarded. Inside a frame escape sequences are only recognised
+    at offsets from the start sequence that are a multiple of 4, like the sender escapes them.
+    Frames with a wrong checksum are counted and dropped when the crc check of the sml config is enabled.
+    smlConfig is the SmlConfig of sml_step_reader, which imports this module.
+    """
+
+    def __init__(
+        self,
+        smlConfig,
+        maxFrameSize: int = 16384,
+        stats: SmlReadStats = None,
+    ):
+        super().__init__()
+        # a reloaded meter profile has a new sml config, the readers then create a new decoder
+        self.smlConfig = smlConfig
+        self.crcCheck = smlConfig.crcCheck
+        self.stats = stats if stats is not None else SmlReadStats()
+        self.escapeSequenc = bytes.fromhex(smlConfig.startEscapeSequenz)
+        self.startSequenc = bytes.fromhex(smlConfig.msgBlockStartBlock)
+        self.endSequenc = bytes.fromhex(smlConfig.endEscapeSequenz)
+        self.maxFrameSize = maxFrameSize
+        self._startMarker = self.startSequenc[len(self.escapeSequenc) :]
+        self._endMarker = self.endSequenc[len(self.escapeSequenc) :]
+        self._buffer = bytearray()
+        self._scanIndex = 0
+        self._inFrame = False
+        # buffer indexes of the escape sequences that are the escaped copy of the one in front
+        self._escapedIndexes = []
+
+    def reset(self):
+        self._buffer.clear()
+        self._scanIndex = 0
+        self._inFrame = False
+        # buffer indexes of the escape sequences that are the escaped copy of the one in front
+        self._escapedIndexes = []
+
+    def feed(self, data: bytes):
+        """
+        Add the data to the stream and return a generator of the completed frames.
+        """
+        self._buffer.extend(data)
+        return self.frames()
+
+    def frames(self):
+        buffer = self._buffer
+        escapeLength = len(self.escapeSequenc)
+        while True:
+            if not self._inFrame:
+                startIndex = buffer.find(self.startSequenc, self._scanIndex)
+                if startIndex < 0:
+                    # keep a possible beginning of the start sequence
+                    keepLength = len(self.startSequenc) - 1
+                    if len(buffer) > keepLength:
+                        del buffer[: len(buffer) - keepLength]
+                    self._scanIndex = 0
+                    return
+                if startIndex > 0:
+                    logger.debug("Skip {} bytes in front of the start sequence".format(startIndex))
+                    del buffer[:startIndex]
+                self._inFrame = True
+                self._escapedIndexes = []
+                self._scanIndex = len(self.startSequenc)
+
+            escapeIndex = buffer.find(self.escapeSequenc, self._scanIndex)
+            if escapeIndex < 0:
+                if len(buffer) > self.maxFrameSize:
+                    logger.warning("No end sequence found in {} bytes, frame dropped".format(len(buffer)))
+                    self.stats.droppedFrameCount += 1
+                    self.reset()
+                    return
+                # the last bytes can be the beginning of an escape sequence
+                self._scanIndex = max(len(self.startSequenc), len(buffer) - escapeLength + 1)
+                return
+            if escapeIndex % escapeLength != 0:
+                # an unaligned run of escape bytes is payload, the frame starts at buffer index 0
+                self._scanIndex = escapeIndex + 1
+                continue
+
+            markerIndex = escapeIndex + escapeLength
+            if len(buffer) < markerIndex + escapeLength:
+                # wait for the bytes behind the escape sequence
+                self._scanIndex = escapeIndex
+                return
+
+            if buffer.startswith(self.escapeSequenc, markerIndex):
+                # escaped escape sequence inside the payload
+                self._escapedIndexes.append(markerIndex)
+                self._scanIndex = markerIndex + escapeLength
+            elif buffer.startswith(self._endMarker, markerIndex):
+                frameEnd = escapeIndex + len(self.endSequenc) + SML_FRAME_TRAILER_LENGTH
+                if len(buffer) < frameEnd:
+                    self._scanIndex = escapeIndex
+                    return
+                raw = bytes(buffer[:frameEnd])
+                del buffer[:frameEnd]
+                self._inFrame = False
+                self._scanIndex = 0
+                if self.crcCheck and not checkFrameCrc(raw):
+                    logger.warning("Wrong frame checksum, frame dropped")
+                    self.stats.frameCrcErrorCount += 1
+                    continue
+                self.stats.frameCount += 1
+                yield self.createFrame(raw, escapeIndex)
+            elif buffer.startswith(self._startMarker, markerIndex):
+                logger.warning("Start sequence found before the end sequence, frame dropped")
+                self.stats.droppedFrameCount += 1
+                del buffer[:escapeIndex]
+                self._inFrame = False
+                self._scanIndex = 0
+            else:
+                self._scanIndex = markerIndex
+
+    def createFrame(self, raw: bytes, endIndex: int):
+        if not self._escapedIndexes:
+            return SmlFrame(raw, raw[len(self.startSequenc) : endIndex])
+        # drop the escaped copies, the indexes of the raw frame are the ones of the buffer
+        escapeLength = len(self.escapeSequenc)
+        payload = bytearray()
+        copyIndex = len(self.startSequenc)
+        for escapedIndex in self._escapedIndexes:
+            payload.extend(raw[copyIndex:escapedIndex])
+            copyIndex = escapedIndex + escapeLength
+        payload.extend(raw[copyIndex:endIndex])
+        return SmlFrame(raw, bytes(payload))
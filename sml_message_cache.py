@@ -0,0 +1,422 @@
+import logging
+import threading
+from collections import OrderedDict
+from sml_block_maper import (
+    convertSmlBlockToObisEntry,
+    findSmlBlockObisEntry,
+    mapSmlBlockObisEntry,
+    mapSmlBlocksObisEntry,
+)
+from sml_crc import checkMessageCrc
+from sml_frame_decoder import SmlFrame, SmlReadStats
+from sml_step_reader import (
+    SmlBlock,
+    encodeSmlFrame,
+    parsSmlElement,
+    parsSmlList,
+    parsValueToLazyString,
+    parsValueToString,
+    readTypeLength,
+    SML_MESSAGE_TL,
+    SML_MESSAGE_CRC_POSITION,
+    SML_LIST_ENTRY_LENGTH,
+    SML_OBIS_TL,
+    SML_TYPE_LIST,
+    SML_TYPE_OCTET_STRING,
+    SML_TYPE_BOOLEAN,
+    SML_TYPE_INTEGER,
+    SML_TYPE_UNSIGNED,
+)
+from meter_obis_value_index import MeterProperties
+from sml_metrics import METRIC_TYPE_COUNTER, METRIC_TYPE_GAUGE
+
+logger = logging.getLogger('general_logger')
+
+# SML_Time with the choice secIndex: list of 2, unsigned8 tag 1 and the unsigned seconds index
+SML_SEC_INDEX_LIST_TL = SML_TYPE_LIST | 2
+SML_SEC_INDEX_TAG = b"\x62\x01"
+SML_LIST_ENTRY_TL = SML_TYPE_LIST | SML_LIST_ENTRY_LENGTH
+# cached messages and list entries per meter, a telegram has 3 messages and up to about 20 list entries
+DEFAULT_MESSAGE_CACHE_SIZE = 256
+# below this share of entries taken from the cache, looking up and parsing changed list entries is slower
+# than parsing the whole frame, the frames are parsed without the cache
+MIN_CACHED_ENTRY_RATIO = 0.6
+# while the cache is not used, every PROBE_INTERVAL frame is mapped with it to measure the share again
+PROBE_INTERVAL = 64
+
+
+class SmlMessageCache:
+    """
+    LRU cache of the mapped entries per SML message of one meter. The key is the message without
+    transaction id, CRC and the values of secIndex times, so open and close responses and the list of
+    a meter whose values did not change are neither parsed nor mapped again. The key bytes are the
+    dict key, a hash collision can not return the entries of another message.
+    The layout of the last message at every position of the frame (offsets of the key and of the
+    secIndex values) is kept, so the key of an unchanged message is built without walking its elements.
+    """
+
+    def __init__(self, maxSize: int = DEFAULT_MESSAGE_CACHE_SIZE):
+        super().__init__()
+        self.maxSize = max(1, maxSize)
+        self.entries = OrderedDict()
+        # message layout per position in the frame
+        self.layouts = []
+        self.lock = threading.Lock()
+        self.hitCount = 0
+        self.missCount = 0
+        self.evictionCount = 0
+        # moving average of the share of entries per frame which were taken from the cache
+        self.cachedEntryRatio = 1.0
+        self.bypassedFrameCount = 0
+        self.probeCountdown = PROBE_INTERVAL
+
+    def useCache(self):
+        """
+        False while the values of the meter change too often, then the frame is parsed without the cache.
+        """
+        if self.cachedEntryRatio >= MIN_CACHED_ENTRY_RATIO:
+            return True
+        self.probeCountdown -= 1
+        if self.probeCountdown <= 0:
+            self.probeCountdown = PROBE_INTERVAL
+            return True
+        self.bypassedFrameCount += 1
+        return False
+
+    def addFrame(self, cachedEntryCount: int, entryCount: int):
+        if entryCount > 0:
+            self.cachedEntryRatio = 0.75 * self.cachedEntryRatio + 0.25 * cachedEntryCount / entryCount
+
+    def get(self, key: bytes, layout: tuple, countMiss: bool = True):
+        """
+        Entries of the message key, None if the key is unknown or was cached with another layout.
+        """
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is None or cached[0] != layout:
+                if countMiss:
+                    self.missCount += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hitCount += 1
+            return cached[1]
+
+    def put(self, key: bytes, layout: tuple, entries: list):
+        with self.lock:
+            self.entries[key] = (layout, entries)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.evictionCount += 1
+
+    def findLayout(self, messageIndex: int):
+        layouts = self.layouts
+        return layouts[messageIndex] if messageIndex < len(layouts) else None
+
+    def setLayout(self, messageIndex: int, layout: tuple):
+        layouts = self.layouts
+        if messageIndex < len(layouts):
+            layouts[messageIndex] = layout
+        else:
+            layouts.append(layout)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.layouts = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def stats(self):
+        lookups = self.hitCount + self.missCount
+        return {
+            "size": len(self.entries),
+            "hits": self.hitCount,
+            "misses": self.missCount,
+            "evictions": self.evictionCount,
+            "bypassedFrames": self.bypassedFrameCount,
+            "cachedEntryRatio": round(self.cachedEntryRatio, 3),
+            "hitRatio": self.hitCount / lookups if lookups > 0 else 0.0,
+        }
+
+
+def isSecIndex(view: memoryview, pos: int, end: int):
+    return (
+        view[pos] == SML_SEC_INDEX_LIST_TL
+        and pos + 3 < end
+        and view[pos + 1 : pos + 3] == SML_SEC_INDEX_TAG
+        and view[pos + 3] & 0x70 == SML_TYPE_UNSIGNED
+    )
+
+
+def skipSmlElement(view: memoryview, pos: int, end: int, timeValues: list):
+    """
+    Index of the element behind the element at pos, the same positions as parsSmlElement without
+    converting values. The ranges of secIndex values are appended to timeValues.
+    """
+    tl = view[pos]
+    if tl == 0x00:
+        return pos + 1
+    smlType, length, tlSize = readTypeLength(view, pos, end)
+    if smlType == SML_TYPE_LIST:
+        if isSecIndex(view, pos, end):
+            # the type-length of the value stays in the key, so the positions of the message are unchanged
+            valueStart = pos + 3 + readTypeLength(view, pos + 3, end)[2]
+            nextPos = skipSmlElement(view, pos + 3, end, timeValues)
+            if valueStart < nextPos:
+                timeValues.append((valueStart, nextPos))
+            return nextPos
+        pos += tlSize
+        while pos < end and length != 0:
+            length -= 1
+            pos = skipSmlElement(view, pos, end, timeValues)
+        return pos
+    if smlType in (SML_TYPE_OCTET_STRING, SML_TYPE_INTEGER, SML_TYPE_UNSIGNED, SML_TYPE_BOOLEAN):
+        nextPos = pos + (length if length > tlSize else tlSize)
+        return nextPos if nextPos < end else end
+    # unknown type, skip the type-length byte
+    return pos + 1
+
+
+def skipMessageEnd(view: memoryview, crcIndex: int, end: int):
+    """
+    Index behind the CRC and the end of message.
+    """
+    for _ in range(2):
+        if crcIndex >= end:
+            break
+        crcIndex = skipSmlElement(view, crcIndex, end, [])
+    return crcIndex
+
+
+def elementKey(view: memoryview, start: int, end: int, timeValues: list):
+    """
+    Bytes from start to end without the secIndex value ranges.
+    """
+    if len(timeValues) == 0:
+        return bytes(view[start:end])
+    parts = []
+    for valueStart, valueEnd in timeValues:
+        parts.append(view[start:valueStart])
+        start = valueEnd
+    parts.append(view[start:end])
+    return b"".join(parts)
+
+
+def messageKey(view: memoryview, messageStart: int, layout: tuple):
+    keyStart, keyEnd, timeValues = layout
+    return elementKey(
+        view,
+        messageStart + keyStart,
+        messageStart + keyEnd,
+        [(messageStart + valueStart, messageStart + valueEnd) for valueStart, valueEnd in timeValues],
+    )
+
+
+class CachedMessageMapper:
+    """
+    Parse and map one message like parsSmlMessages and mapSmlBlockObisEntry. The entries of list entries
+    (lists of 7 elements starting with an OBIS key) are taken from the cache, only changed list entries
+    are parsed. The secIndex values are skipped, their positions are collected for the message key.
+    """
+
+    def __init__(
+        self, view: memoryview, meterProperties: MeterProperties, cache: SmlMessageCache, octetString
+    ):
+        super().__init__()
+        self.view = view
+        self.end = len(view)
+        self.meterProperties = meterProperties
+        self.cache = cache
+        self.octetString = octetString
+        self.timeValues = []
+        # list entries parsed from the message, cached after the check sum is verified
+        self.parsedListEntries = []
+        self.cachedEntryCount = 0
+
+    def mapElements(self, pos: int, count: int, smlBlock: SmlBlock, entries: list):
+        """
+        Like parsSmlList, the entries of the lists are appended to entries.
+        """
+        view = self.view
+        end = self.end
+        while pos < end and count != 0:
+            count -= 1
+            tl = view[pos]
+            if tl == 0x00:
+                pos += 1
+            elif tl & 0x70 == SML_TYPE_LIST:
+                pos = self.mapList(pos, entries)
+            else:
+                pos = parsSmlElement(view, pos, end, smlBlock, self.octetString)
+        return pos
+
+    def mapList(self, pos: int, entries: list):
+        view = self.view
+        end = self.end
+        if isSecIndex(view, pos, end):
+            # sensor times are not part of the entries
+            return skipSmlElement(view, pos, end, self.timeValues)
+        if view[pos] == SML_LIST_ENTRY_TL and pos + 1 < end and view[pos + 1] == SML_OBIS_TL:
+            timeValues = []
+            nextPos = skipSmlElement(view, pos, end, timeValues)
+            key = elementKey(view, pos, nextPos, timeValues)
+            listEntries = self.cache.get(key, None)
+            if listEntries is None:
+                smlBlock = SmlBlock()
+                parsSmlElement(view, pos, end, smlBlock, self.octetString)
+                listEntries = mapSmlBlockObisEntry(smlBlock.childList[0], self.meterProperties)
+                self.parsedListEntries.append((key, listEntries))
+            else:
+                self.cachedEntryCount += len(listEntries)
+            self.timeValues.extend(timeValues)
+            entries.extend(listEntries)
+            return nextPos
+
+        smlType, length, tlSize = readTypeLength(view, pos, end)
+        smlBlock = SmlBlock()
+        childEntries = []
+        pos = self.mapElements(pos + tlSize, length, smlBlock, childEntries)
+        obisKey = findSmlBlockObisEntry(smlBlock)
+        if obisKey is not None:
+            entries.append(convertSmlBlockToObisEntry(smlBlock, obisKey, self.meterProperties))
+        entries.extend(childEntries)
+        return pos
+
+    def mapMessage(self, messageStart: int, stats: SmlReadStats):
+        """
+        Returns the entries (None for a wrong check sum), the layout of the message key (None if the
+        transaction id is part of the entries) and the index behind the message.
+        """
+        view = self.view
+        message = SmlBlock()
+        entries = []
+        bodyStart = self.mapElements(messageStart + 1, 1, message, entries)
+        # the transaction id changes with every telegram and is not part of the key
+        self.timeValues = []
+        cacheable = len(entries) == 0
+        crcIndex = self.mapElements(bodyStart, SML_MESSAGE_CRC_POSITION - 1, message, entries)
+        valueCount = len(message.values)
+        messageEnd = parsSmlList(view, crcIndex, self.end, message, 2)
+        if len(message.values) > valueCount:
+            message.checkSum = message.values[valueCount]
+        if self.meterProperties.smlConfig.crcCheck and (
+            not isinstance(message.checkSum, int)
+            or not checkMessageCrc(view[messageStart:crcIndex], message.checkSum)
+        ):
+            logger.warning("Wrong message checksum, message dropped")
+            if stats is not None:
+                stats.messageCrcErrorCount += 1
+            return None, None, messageEnd
+
+        obisKey = findSmlBlockObisEntry(message)
+        if obisKey is not None:
+            cacheable = False
+            entries.insert(0, convertSmlBlockToObisEntry(message, obisKey, self.meterProperties))
+        for key, listEntries in self.parsedListEntries:
+            self.cache.put(key, None, listEntries)
+        if not cacheable:
+            return entries, None, messageEnd
+        layout = (
+            bodyStart - messageStart,
+            crcIndex - messageStart,
+            tuple((start - messageStart, end - messageStart) for start, end in self.timeValues),
+        )
+        return entries, layout, messageEnd
+
+
+def mapSmlFrameCached(
+    frame: SmlFrame, meterProperties: MeterProperties, cache: SmlMessageCache, stats: SmlReadStats = None
+):
+    """
+    Entries of the frame, the entries of known messages and list entries are taken from the cache.
+    The key of a known message was cached after its check sum was verified, so its CRC is not checked
+    again. The transaction id and the secIndex values are not part of the key, on a cache hit these bytes
+    are only protected by the frame CRC. Frames with other elements than messages and padding are mapped without the cache.
+    """
+    view = memoryview(frame.payload)
+    end = len(view)
+    octetString = parsValueToLazyString if meterProperties.smlConfig.lazyHex else parsValueToString
+    frameEntries = []
+    cachedEntryCount = 0
+    pos = 0
+    messageIndex = 0
+    try:
+        while pos < end:
+            if view[pos] == 0x00:
+                # padding
+                pos += 1
+                continue
+            if view[pos] != SML_MESSAGE_TL:
+                return mapSmlBlocksObisEntry(
+                    encodeSmlFrame(frame, meterProperties.smlConfig, stats), meterProperties
+                )
+
+            messageStart = pos
+            # an unchanged message has the layout of the last message at this position
+            layout = cache.findLayout(messageIndex)
+            if (
+                layout is not None
+                and messageStart + layout[1] <= end
+                and skipSmlElement(view, messageStart + 1, end, []) == messageStart + layout[0]
+            ):
+                entries = cache.get(messageKey(view, messageStart, layout), layout)
+                if entries is not None:
+                    frameEntries.extend(entries)
+                    cachedEntryCount += len(entries)
+                    pos = skipMessageEnd(view, messageStart + layout[1], end)
+                    messageIndex += 1
+                    continue
+
+            mapper = CachedMessageMapper(view, meterProperties, cache, octetString)
+            entries, layout, pos = mapper.mapMessage(messageStart, stats)
+            cachedEntryCount += mapper.cachedEntryCount
+            if entries is None:
+                continue
+            if layout is not None:
+                cache.setLayout(messageIndex, layout)
+                cache.put(messageKey(view, messageStart, layout), layout, entries)
+            messageIndex += 1
+            frameEntries.extend(entries)
+    except Exception as e:
+        logger.error(e)
+        if stats is not None:
+            stats.parseErrorCount += 1
+        return []
+    cache.addFrame(cachedEntryCount, len(frameEntries))
+    return frameEntries
+
+
+def mapSmlFrame(frame: SmlFrame, meterProperties: MeterProperties, stats: SmlReadStats = None):
+    """
+    Parse and map a frame, with the message cache of the meter properties if it has one.
+    """
+    cache = meterProperties.messageCache
+    if cache is None or not cache.useCache():
+        smlBlocks = encodeSmlFrame(frame, meterProperties.smlConfig, stats)
+        return mapSmlBlocksObisEntry(smlBlocks, meterProperties)
+    return mapSmlFrameCached(frame, meterProperties, cache, stats)
+
+
+def addMessageCacheMetrics(metrics, cache: SmlMessageCache, labels: dict = None):
+    """
+    Export the hits, misses, evictions and size of the message cache.
+    """
+    for name, help, attribute in (
+        ("sml_message_cache_hits_total", "Messages whose entries were taken from the cache", "hitCount"),
+        ("sml_message_cache_misses_total", "Messages which were parsed and mapped", "missCount"),
+        ("sml_message_cache_evictions_total", "Messages removed from the full cache", "evictionCount"),
+    ):
+        metrics.callback(
+            name, METRIC_TYPE_COUNTER, help, lambda attribute=attribute: getattr(cache, attribute), labels
+        )
+    metrics.callback(
+        "sml_message_cache_bypassed_frames_total",
+        METRIC_TYPE_COUNTER,
+        "Frames parsed without the cache because too many values changed",
+        lambda: cache.bypassedFrameCount,
+        labels,
+    )
+    metrics.callback("sml_message_cache_size", METRIC_TYPE_GAUGE, "Cached messages", cache.__len__, labels)
@@ -0,0 +1,197 @@
+import logging
+import mmap
+import re
+from collections import deque
+from write_data import WriteData
+from sml_block_maper import mapSmlBlocksObisEntry
+from sml_step_reader import encodeSmlFrame
+from sml_frame_decoder import SmlFrameDecoder, SmlReadStats
+from meter_obis_value_index import findMeterConfiguration
+
+logger = logging.getLogger('general_logger')
+
+HEX_WHITESPACE = b" \t\r\n"
+HEX_CHARACTERS = frozenset(b"0123456789abcdefABCDEF" + HEX_WHITESPACE)
+# bytes checked to detect hex capture files
+HEX_DETECT_LENGTH = 4096
+# decoded ranges per process which wait for the writer, more ranges are not started
+RANGES_IN_FLIGHT_PER_PROCESS = 2
+
+
+class CaptureFile:
+    """
+    Memory mapped capture of the serial stream, raw binary or hex text.
+    Only the read chunks are loaded, so files larger than the memory can be replayed.
+    """
+
+    def __init__(self, filePath: str, startSequenc: bytes, escapeSequenc: bytes):
+        super().__init__()
+        self.filePath = filePath
+        self.file = open(filePath, "rb")
+        self.size = self.file.seek(0, 2)
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size > 0 else b""
+        self.hex = all(byte in HEX_CHARACTERS for byte in self.data[:HEX_DETECT_LENGTH])
+        if self.hex:
+            self.startPattern = re.compile(re.escape(startSequenc.hex().encode("ascii")), re.IGNORECASE)
+            self.escapePattern = re.compile(re.escape(escapeSequenc.hex().encode("ascii")), re.IGNORECASE)
+            self.escapeLength = len(escapeSequenc) * 2
+        else:
+            self.startPattern = re.compile(re.escape(startSequenc))
+            self.escapePattern = re.compile(re.escape(escapeSequenc))
+            self.escapeLength = len(escapeSequenc)
+        # position and number of hex digits in front of it of the last digitCount call
+        self.digitCountPosition = (0, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def digitCount(self, position: int):
+        """
+        Number of hex digits in front of position. Counted from the last call, splitRanges asks in file order.
+        """
+        countedPosition, digits = self.digitCountPosition
+        if position < countedPosition:
+            countedPosition, digits = 0, 0
+        digits += len(self.data[countedPosition:position].translate(None, HEX_WHITESPACE))
+        self.digitCountPosition = (position, digits)
+        return digits
+
+    def findStart(self, position: int):
+        """
+        Offset of the next start sequence from position, an escaped start sequence inside a payload is skipped.
+        In hex text a match at an odd digit is the second digit of a byte and the first of the next one.
+        """
+        while True:
+            match = self.startPattern.search(self.data, position)
+            if match is None:
+                return None
+            start = match.start()
+            if self.hex and self.digitCount(start) % 2 == 1:
+                position = start + 1
+                continue
+            if start < self.escapeLength or self.escapePattern.match(self.data, start - self.escapeLength) is None:
+                return start
+            position = start + 1
+
+    def splitRanges(self, chunkSize: int):
+        """
+        Split the file into ranges of about chunkSize bytes, every range starts with a start sequence.
+        """
+        offsets = [0]
+        while offsets[-1] + chunkSize < self.size:
+            start = self.findStart(offsets[-1] + chunkSize)
+            if start is None:
+                break
+            offsets.append(start)
+        offsets.append(self.size)
+        return list(zip(offsets[:-1], offsets[1:]))
+
+    def chunks(self, start: int, end: int, readSize: int = 1 << 20):
+        """
+        Yield the bytes of the range in chunks of readSize, hex text is converted to bytes.
+        """
+        oddDigit = b""
+        for position in range(start, end, readSize):
+            chunk = self.data[position : min(position + readSize, end)]
+            if not self.hex:
+                yield chunk
+                continue
+            digits = oddDigit + chunk.translate(None, HEX_WHITESPACE)
+            evenLength = len(digits) & ~1
+            oddDigit = digits[evenLength:]
+            yield bytes.fromhex(digits[:evenLength].decode("ascii"))
+
+
+# meter properties of the replay worker process
+workerMeterProperties = dict()
+
+
+def findWorkerMeterProperties(meterKey: str, crcCheck: bool):
+    meterProperties = workerMeterProperties.get((meterKey, crcCheck))
+    if meterProperties is None:
+        meterProperties = findMeterConfiguration(meterKey)
+        meterProperties.smlConfig.crcCheck = crcCheck
+        workerMeterProperties[(meterKey, crcCheck)] = meterProperties
+    return meterProperties
+
+
+def decodeCaptureRange(filePath: str, start: int, end: int, meterProperties, stats: SmlReadStats):
+    """
+    Generator of the entries of every frame in the range of the capture file.
+    """
+    smlConfig = meterProperties.smlConfig
+    decoder = SmlFrameDecoder(smlConfig, stats=stats)
+    with CaptureFile(filePath, decoder.startSequenc, decoder.escapeSequenc) as captureFile:
+        for chunk in captureFile.chunks(start, captureFile.size if end is None else end):
+            stats.byteCount += len(chunk)
+            for frame in decoder.feed(chunk):
+                smlEntries = mapSmlBlocksObisEntry(encodeSmlFrame(frame, smlConfig, stats), meterProperties)
+                if len(smlEntries) > 0:
+                    yield smlEntries
+
+
+def decodeCaptureRangeWorker(task: tuple):
+    filePath, start, end, meterKey, crcCheck = task
+    stats = SmlReadStats()
+    meterProperties = findWorkerMeterProperties(meterKey, crcCheck)
+    telegrams = list(decodeCaptureRange(filePath, start, end, meterProperties, stats))
+    return telegrams, stats
+
+
+def addReadStats(total: SmlReadStats, stats: SmlReadStats):
+    for name, value in stats.__dict__.items():
+        setattr(total, name, getattr(total, name) + value)
+
+
+def writeRangeTelegrams(result: tuple, writer: WriteData, stats: SmlReadStats):
+    telegrams, rangeStats = result
+    addReadStats(stats, rangeStats)
+    for smlEntries in telegrams:
+        writer.writeData(smlEntries)
+
+
+def replayCapture(
+    filePath: str,
+    meterKey: str,
+    writer: WriteData,
+    processes: int = 1,
+    chunkSize: int = 256 << 10,
+    crcCheck: bool = True,
+):
+    """
+    Decode a capture file and write the entries of every telegram in the order of the file.
+    With several processes the file is split at start sequences and the ranges are decoded in parallel.
+    At most RANGES_IN_FLIGHT_PER_PROCESS ranges per process are decoded ahead of the writer, so the memory
+    depends on the chunk size and the number of processes, not on the size of the file.
+    """
+    meterProperties = findWorkerMeterProperties(meterKey, crcCheck)
+    stats = SmlReadStats()
+    if processes <= 1:
+        for smlEntries in decodeCaptureRange(filePath, 0, None, meterProperties, stats):
+            writer.writeData(smlEntries)
+        return stats
+
+    decoder = SmlFrameDecoder(meterProperties.smlConfig)
+    with CaptureFile(filePath, decoder.startSequenc, decoder.escapeSequenc) as captureFile:
+        ranges = captureFile.splitRanges(chunkSize)
+    logger.info("Replay {} in {} ranges with {} processes".format(filePath, len(ranges), processes))
+    tasks = [(filePath, start, end, meterKey, crcCheck) for start, end in ranges]
+    from multiprocessing import Pool
+
+    with Pool(processes) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.apply_async(decodeCaptureRangeWorker, (task,)))
+            if len(pending) >= processes * RANGES_IN_FLIGHT_PER_PROCESS:
+                writeRangeTelegrams(pending.popleft().get(), writer, stats)
+        while len(pending) > 0:
+            writeRangeTelegrams(pending.popleft().get(), writer, stats)
+    return stats
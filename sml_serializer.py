@@ -0,0 +1,140 @@
+import json
+import logging
+
+logger = logging.getLogger('general_logger')
+
+SERIALIZER_JSON = "json"
+# orjson when installed, otherwise json
+SERIALIZER_ORJSON = "orjson"
+SERIALIZER_MSGPACK = "msgpack"
+SERIALIZER_CBOR = "cbor"
+SERIALIZER_FORMATS = [SERIALIZER_JSON, SERIALIZER_ORJSON, SERIALIZER_MSGPACK, SERIALIZER_CBOR]
+
+# fields of an entry, the mqtt entry payload has value and unit
+ENTRY_FIELDS = ["obis", "obisName", "status", "time", "unit", "scaler", "value", "signature", "rawValue"]
+
+# placeholder of the value in a payload template, never part of an entry
+TEMPLATE_VALUE_MARKER = "\x00sml-value\x00"
+
+
+def loadSerializerFunctions(serializerFormat: str):
+    """
+    dumps and loads of the format and True for binary payloads.
+    """
+    if serializerFormat == SERIALIZER_ORJSON:
+        try:
+            import orjson
+
+            return orjson.dumps, orjson.loads, False
+        except ImportError:
+            logger.warning("orjson package not found, payloads are serialized with json")
+            return json.dumps, json.loads, False
+    if serializerFormat == SERIALIZER_MSGPACK:
+        try:
+            import msgpack
+        except ImportError:
+            logging.error("msgpack package not found, install it for MessagePack payloads")
+            raise
+        return msgpack.packb, msgpack.unpackb, True
+    if serializerFormat == SERIALIZER_CBOR:
+        try:
+            import cbor2
+        except ImportError:
+            logging.error("cbor2 package not found, install it for CBOR payloads")
+            raise
+        return cbor2.dumps, cbor2.loads, True
+    if serializerFormat != SERIALIZER_JSON:
+        raise ValueError("Unknown payload format {}".format(serializerFormat))
+    return json.dumps, json.loads, False
+
+
+def parseFieldList(fields: str):
+    """
+    Field list of the command line, e.g. "signature,status,obisName". None without fields.
+    """
+    if not fields:
+        return None
+    fieldList = [field.strip() for field in fields.split(",") if field.strip()]
+    for field in fieldList:
+        if field not in ENTRY_FIELDS:
+            logger.warning("Unknown entry field {}".format(field))
+    return fieldList
+
+
+class EntrySerializer:
+    """
+    Payloads of the entries in one format. fields keeps only the given fields, dropFields removes fields,
+    e.g. signature, status and obisName.
+    The mqtt payload of an entry is built from a template per unit: the serialized fields
+    around the value are cached and only the value is serialized for every telegram.
+    """
+
+    def __init__(self, serializerFormat: str = SERIALIZER_JSON, fields: list = None, dropFields: list = None):
+        super().__init__()
+        self.format = serializerFormat
+        self.dumps, self.loads, self.binary = loadSerializerFunctions(serializerFormat)
+        self.fields = None if fields is None else frozenset(fields)
+        self.dropFields = frozenset(dropFields or ())
+        self.selecting = self.fields is not None or len(self.dropFields) > 0
+        self.encodedMarker = self.dumps(TEMPLATE_VALUE_MARKER)
+        self.templates = dict()
+
+    def selectFields(self, entry: dict):
+        if not self.selecting:
+            return entry
+        fields = self.fields
+        dropFields = self.dropFields
+        return {
+            key: value
+            for key, value in entry.items()
+            if (fields is None or key in fields) and key not in dropFields
+        }
+
+    def serializeEntry(self, dataItem):
+        """
+        All fields of the entry, e.g. for the console output.
+        """
+        return self.dumps(self.selectFields(dataItem.__dict__))
+
+    def serializeTelegram(self, payloads: dict):
+        """
+        One payload of all entries of a telegram, payloads maps the OBIS key to the fields of the entry.
+        """
+        return self.dumps({obis: self.selectFields(payload) for obis, payload in payloads.items()})
+
+    def serializePayload(self, payload: dict):
+        return self.dumps(self.selectFields(payload))
+
+    def createTemplate(self, unit: str):
+        payload = self.dumps(self.selectFields({"value": TEMPLATE_VALUE_MARKER, "unit": unit}))
+        parts = payload.split(self.encodedMarker)
+        if len(parts) != 2:
+            # without value field the payload is constant
+            return payload, None
+        return parts[0], parts[1]
+
+    def serializeValue(self, value, unit: str):
+        """
+        Payload {"value": value, "unit": unit} of an entry, built from the cached template of the unit.
+        """
+        template = self.templates.get(unit)
+        if template is None:
+            template = self.createTemplate(unit)
+            self.templates[unit] = template
+        prefix, suffix = template
+        if suffix is None:
+            return prefix
+        return prefix + self.dumps(value) + suffix
+
+    def addTimestamp(self, payload, timestamp: float):
+        """
+        Add the time of the reading to a payload with an object, other payloads are unchanged.
+        """
+        try:
+            message = self.loads(payload)
+        except Exception:
+            return payload
+        if isinstance(message, dict):
+            message["timestamp"] = timestamp
+            return self.dumps(message)
+        return payload
@@ -1,7 +1,5 @@
 #!/usr/bin/python3
 import logging
-import json
-import struct
 
 try:
     # hexlify for micropython
@@ -10,6 +8,9 @@ except ImportError:
     # default to python standard
     from binascii import hexlify
 
+from sml_frame_decoder import SmlFrameDecoder, SmlFrame, SmlReadStats
+from sml_crc import checkMessageCrc
+
 logger = logging.getLogger('general_logger')
 
 
@@ -19,15 +20,22 @@ class SmlConfig:
         startEscapeSequenz: str = "1b1b1b1b",
         endEscapeSequenz: str = "1b1b1b1b1a",
         smlVersion: str = "01010101",
+        crcCheck: bool = True,
+        lazyHex: bool = False,
     ):
         super().__init__()
         self.startEscapeSequenz = startEscapeSequenz
         self.endEscapeSequenz = endEscapeSequenz
         self.smlVersion = smlVersion
         self.msgBlockStartBlock = startEscapeSequenz + smlVersion
+        self.crcCheck = crcCheck
+        # keep long octet strings as SmlOctetString until they are used
+        self.lazyHex = lazyHex
 
 
 class SmlBlock:
+    __slots__ = ("childList", "values", "checkSum")
+
     def __init__(self):
         super().__init__()
         self.childList = []
@@ -35,11 +43,14 @@ class SmlBlock:
         self.checkSum = None
 
     def reprJSON(self):
+        # only used for debug output, json is not loaded by the reader core
+        import json
+
         valuesJson = "[]"
         childListJson = "[]"
 
         if len(self.values) > 0:
-            valuesJson = json.dumps(self.values)
+            valuesJson = json.dumps(self.values, default=str)
 
         if len(self.childList) > 0:
             childListAsStringArray = []
@@ -58,26 +69,17 @@ class SmlBlock:
         )
 
 
-def parsBytesToNumber(data: bytes, sequencHex: str):
-    if sequencHex.startswith("5"):
-        if len(data) == 1:
-            return struct.unpack(">b", data)[0]
-        elif len(data) == 2:
-            return struct.unpack(">h", data)[0]
-        elif len(data) == 4:
-            return struct.unpack(">i", data)[0]
-        elif len(data) == 8:
-            return struct.unpack(">q", data)[0]
-    else:
-        if len(data) == 1:
-            return struct.unpack(">B", data)[0]
-        elif len(data) == 2:
-            return struct.unpack(">H", data)[0]
-        elif len(data) == 4:
-            return struct.unpack(">I", data)[0]
-        elif len(data) == 8:
-            return struct.unpack(">Q", data)[0]
-    return 0
+def parsBytesToNumber(data: bytes, signed: bool):
+    """
+    Big endian integer of any width (SML uses 1 to 8 bytes), None for an empty value.
+    """
+    if len(data) == 0:
+        return None
+    # micropython int.from_bytes has no signed argument
+    value = int.from_bytes(data, "big")
+    if signed and data[0] & 0x80:
+        value -= 1 << (8 * len(data))
+    return value
 
 
 def parsValueToString(value: bytes):
@@ -85,72 +87,209 @@ def parsValueToString(value: bytes):
         return hexlify(value).decode("ascii")
     except Exception as e:
         logger.exception(e)
-        return value.hex()
+        return bytes(value).hex()
 
 
-def parsSmlBlock(data: bytes, smlBlock: SmlBlock, sequenzCount=-1):
-    while len(data) > 0 and sequenzCount != 0:
+# shorter octet strings are always converted, OBIS keys and ids are looked up by their hex string
+SML_LAZY_HEX_MIN_LENGTH = 16
+
+
+class SmlOctetString:
+    """
+    Long octet string like a signature or a public key, converted to hex on first use.
+    Most of them are never published, e.g. the signatures of the open and close response.
+    """
+
+    __slots__ = ("data", "hexValue")
+
+    def __init__(self, data):
+        self.data = bytes(data)
+        self.hexValue = None
+
+    def __str__(self):
+        if self.hexValue is None:
+            self.hexValue = parsValueToString(self.data)
+        return self.hexValue
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __eq__(self, other):
+        if isinstance(other, SmlOctetString):
+            return self.data == other.data
+        return isinstance(other, str) and str(self) == other
+
+    def __hash__(self):
+        return hash(str(self))
+
+
+def parsValueToLazyString(value: bytes):
+    if len(value) < SML_LAZY_HEX_MIN_LENGTH:
+        return parsValueToString(value)
+    return SmlOctetString(value)
+
+
+# SML type field (bits 4-6 of the type-length byte)
+SML_TYPE_OCTET_STRING = 0x00
+SML_TYPE_BOOLEAN = 0x40
+SML_TYPE_INTEGER = 0x50
+SML_TYPE_UNSIGNED = 0x60
+SML_TYPE_LIST = 0x70
+SML_TL_MORE = 0x80
+# SML_ListEntry: list of 7 elements, the first is the OBIS key objName of 6 bytes
+SML_LIST_ENTRY_LENGTH = 7
+# bytes of the objName: type-length byte and 6 bytes of the OBIS key
+SML_OBIS_LENGTH = 7
+# the length of an octet string includes its type-length byte
+SML_OBIS_TL = SML_TYPE_OCTET_STRING | SML_OBIS_LENGTH
+# OBIS keys are stored without the F group, e.g. 0100010800 for 0100010800ff
+SML_OBIS_KEY_LENGTH = 5
+
+
+def readTypeLength(view: memoryview, pos: int, end: int):
+    """
+    Read the type-length field at pos. Returns the type, the length and the size of the type-length field.
+    A set bit 7 announces a following type-length byte with the next 4 bits of the length.
+    """
+    tl = view[pos]
+    smlType = tl & 0x70
+    length = tl & 0x0F
+    tlSize = 1
+    while tl & SML_TL_MORE and pos + tlSize < end:
+        tl = view[pos + tlSize]
+        length = (length << 4) | (tl & 0x0F)
+        tlSize += 1
+    return smlType, length, tlSize
+
+
+def parsSmlElement(
+    view: memoryview, pos: int, end: int, smlBlock: SmlBlock, octetString=parsValueToString
+):
+    """
+    Pars the element at pos into the sml block and return the index of the next element.
+    octetString converts the bytes of an octet string to the value.
+    """
+    tl = view[pos]
+    if tl == 0x00:
+        # end of sml message
+        return pos + 1
+
+    if tl & SML_TL_MORE:
+        smlType, length, tlSize = readTypeLength(view, pos, end)
+    else:
+        smlType = tl & 0x70
+        length = tl & 0x0F
+        tlSize = 1
+    if smlType == SML_TYPE_LIST:
+        newBlock = SmlBlock()
+        pos += tlSize
+        if length == SML_LIST_ENTRY_LENGTH and pos + SML_OBIS_LENGTH <= end and view[pos] == SML_OBIS_TL:
+            # OBIS key of a list entry, the keys of the meter profiles have no F group
+            newBlock.values.append(parsValueToString(view[pos + 1 : pos + 1 + SML_OBIS_KEY_LENGTH]))
+            pos = parsSmlList(view, pos + SML_OBIS_LENGTH, end, newBlock, length - 1, octetString)
+        else:
+            pos = parsSmlList(view, pos, end, newBlock, length, octetString)
+        smlBlock.childList.append(newBlock)
+        return pos
+
+    # the length of a value includes the type-length field
+    nextPos = pos + (length if length > tlSize else tlSize)
+    if nextPos > end:
+        nextPos = end
+    if smlType == SML_TYPE_OCTET_STRING:
+        if length > tlSize:
+            smlBlock.values.append(octetString(view[pos + tlSize : nextPos]))
+        else:
+            smlBlock.values.append(None)
+    elif smlType == SML_TYPE_INTEGER or smlType == SML_TYPE_UNSIGNED:
+        smlBlock.values.append(
+            parsBytesToNumber(view[pos + tlSize : nextPos], smlType == SML_TYPE_INTEGER)
+        )
+    elif smlType == SML_TYPE_BOOLEAN:
+        smlBlock.values.append(view[pos + tlSize] != 0 if pos + tlSize < nextPos else None)
+    else:
+        # unknown type, skip the type-length byte
+        return pos + 1
+    return nextPos
+
+
+def parsSmlList(
+    view: memoryview,
+    pos: int,
+    end: int,
+    smlBlock: SmlBlock,
+    sequenzCount=-1,
+    octetString=parsValueToString,
+):
+    """
+    Pars sequenzCount elements (all elements for -1) into the sml block and return the index behind the last one.
+    """
+    while pos < end and sequenzCount != 0:
         sequenzCount = sequenzCount - 1
-        sequencHex: str = data[0:1].hex()
-        if sequencHex == "00":
-            data = data[1:]
-        elif sequencHex.startswith("0") and sequencHex != "00":
-            dataLenght = int.from_bytes(bytes.fromhex(sequencHex), "big") - 1
-            if dataLenght > 0:
-                dataValue = data[1:dataLenght]
-                smlBlock.values.append(parsValueToString(dataValue))
-            else:
-                smlBlock.values.append(None)
-            data = data[(dataLenght + 1) :]
-        elif sequencHex.startswith("5") or sequencHex.startswith("6"):
-            valueLength= int.from_bytes(bytes.fromhex( ("0"+sequencHex[1])))
-            dataValue = parsBytesToNumber(data[1:valueLength], sequencHex)
-            data = data[valueLength:]
-            smlBlock.values.append(dataValue)
-        elif sequencHex == "42":
-            value = bool.from_bytes(data[1, 2])
-            smlBlock.values.append(value)
-            data = data[2:]
-        elif sequencHex.strip()[0:1] == "7":
-            listLenght = int(sequencHex.strip()[1:])
-            data = data[1:]
-            newBlock = SmlBlock()
-            restData, newBlock = parsSmlBlock(data, newBlock, listLenght)
-            data = restData
-            smlBlock.childList.append(newBlock)
+        if view[pos] == 0x00:
+            # end of sml message or padding
+            pos += 1
         else:
-            data = data[1:]
-    return data, smlBlock
+            pos = parsSmlElement(view, pos, end, smlBlock, octetString)
+    return pos
+
+
+def parsSmlBlock(data: bytes, smlBlock: SmlBlock, sequenzCount=-1):
+    view = memoryview(data)
+    pos = parsSmlList(view, 0, len(view), smlBlock, sequenzCount)
+    return bytes(view[pos:]), smlBlock
+
+
+# an sml message is a list of 6 elements: transactionId, groupNo, abortOnError, messageBody, crc16, endOfSmlMsg
+SML_MESSAGE_TL = SML_TYPE_LIST | 6
+SML_MESSAGE_CRC_POSITION = 4
+
+
+def parsSmlMessages(
+    view: memoryview,
+    smlBlock: SmlBlock,
+    crcCheck: bool = True,
+    stats: SmlReadStats = None,
+    octetString=parsValueToString,
+):
+    """
+    Pars the sml messages of a frame payload into the sml block.
+    The crc16 of every message is stored as check sum of the message block. Messages with a wrong check sum are dropped.
+    """
+    pos = 0
+    end = len(view)
+    while pos < end:
+        if view[pos] != SML_MESSAGE_TL:
+            pos = parsSmlElement(view, pos, end, smlBlock, octetString)
+            continue
+
+        messageStart = pos
+        message = SmlBlock()
+        pos += 1
+        pos = parsSmlList(view, pos, end, message, SML_MESSAGE_CRC_POSITION, octetString)
+        crcIndex = pos
+        valueCount = len(message.values)
+        pos = parsSmlList(view, pos, end, message, 2)
+        if len(message.values) > valueCount:
+            message.checkSum = message.values[valueCount]
+        if crcCheck and (
+            not isinstance(message.checkSum, int)
+            or not checkMessageCrc(view[messageStart:crcIndex], message.checkSum)
+        ):
+            logger.warning("Wrong message checksum, message dropped")
+            if stats is not None:
+                stats.messageCrcErrorCount += 1
+            continue
+        smlBlock.childList.append(message)
+    return pos
 
 
 def findMessageWithEscapeSequenc(data: bytes, smlConfig: SmlConfig):
-    msgBlocks = []
-    startMsgBlockIndex = 0
-    endEscapeSequenzBytes = bytes.fromhex(smlConfig.endEscapeSequenz)
-    msgBlockStartBlockBytes = bytes.fromhex(smlConfig.msgBlockStartBlock)
-    while data.find(msgBlockStartBlockBytes) >= 0:
-        startMsgBlockIndex = data.find(msgBlockStartBlockBytes, startMsgBlockIndex)
-        logger.debug("Message block start index: {}".format(startMsgBlockIndex))
-        if startMsgBlockIndex >= 0:
-            firstBlockValueIndex = startMsgBlockIndex + len(msgBlockStartBlockBytes)
-            endEscapeSequenzIndex = data.find(
-                endEscapeSequenzBytes, firstBlockValueIndex
-            )
-            logger.debug("Message block end index: {}".format(endEscapeSequenzIndex))
-            if endEscapeSequenzIndex - firstBlockValueIndex > 0:
-                newMsgBlock = data[firstBlockValueIndex:endEscapeSequenzIndex]
-                logger.debug("Message block found: {}".format(newMsgBlock.hex()))
-                startMsgBlockIndex = 0
-                data = data[(endEscapeSequenzIndex + len(endEscapeSequenzBytes) + 4) :]
-                # todo check msg block check sum last 1a xx YY ZZ
-                msgBlocks.append(newMsgBlock)
-            else:
-                return msgBlocks
-        elif startMsgBlockIndex < 0:
-            return msgBlocks
-        else:
-            data = data[(len(msgBlockStartBlockBytes) + startMsgBlockIndex) :]
-    return msgBlocks
+    decoder = SmlFrameDecoder(smlConfig, maxFrameSize=max(len(data), 16384))
+    return [frame.payload for frame in decoder.feed(data)]
 
 
 def trimSmlBlock(smlBlock: SmlBlock):
@@ -159,21 +298,35 @@ def trimSmlBlock(smlBlock: SmlBlock):
     return smlBlock
 
 
-def encodeSml(data: bytes, smlConfig: SmlConfig):
+def encodeSmlFrame(frame: SmlFrame, smlConfig: SmlConfig, stats: SmlReadStats = None):
+    try:
+        smlBlock = SmlBlock()
+        parsSmlMessages(
+            memoryview(frame.payload),
+            smlBlock,
+            smlConfig.crcCheck,
+            stats,
+            parsValueToLazyString if smlConfig.lazyHex else parsValueToString,
+        )
+        newSmlBlock = trimSmlBlock(smlBlock)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Find sml block: \n{}".format(newSmlBlock.reprJSON()))
+        return [newSmlBlock]
+    except Exception as e:
+        logger.error(e)
+        if stats is not None:
+            stats.parseErrorCount += 1
+        return []
+
+
+def encodeSml(data: bytes, smlConfig: SmlConfig, stats: SmlReadStats = None):
     logger.debug("encode sml data (bytes)")
-    msgBlocks = findMessageWithEscapeSequenc(data, smlConfig)
-    if len(msgBlocks) == 0:
+    decoder = SmlFrameDecoder(smlConfig, maxFrameSize=max(len(data), 16384), stats=stats)
+    frames = list(decoder.feed(data))
+    if len(frames) == 0:
         logger.warning("Non message block found in the data.")
 
-    smlBlock = SmlBlock()
     findSmlBlock = []
-    for msgBlock in msgBlocks:
-        try:
-            data, changedBlock = parsSmlBlock(msgBlock, smlBlock)
-            newSmlBlock = trimSmlBlock(changedBlock)
-            findSmlBlock.append(newSmlBlock)
-            logger.debug("Find sml block: \n{}".format(newSmlBlock.reprJSON()))
-        except Exception as e:
-            logging.error(e)
-
+    for frame in frames:
+        findSmlBlock.extend(encodeSmlFrame(frame, smlConfig, decoder.stats))
     return findSmlBlock
@@ -0,0 +1,318 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import List
+from sml_block_maper import SmlEntry
+from write_data import WriteData
+
+logger = logging.getLogger('general_logger')
+
+# window seconds of the rollup tables
+ROLLUP_WINDOWS = (60, 900, 3600)
+# resolution of the raw samples in the retention and query settings
+RAW_RESOLUTION = 0
+# seconds to keep per resolution, None keeps the rows
+DEFAULT_RETENTION = {
+    RAW_RESOLUTION: 7 * 86400,
+    60: 90 * 86400,
+    900: 730 * 86400,
+    3600: None,
+}
+# limit of the write-ahead log file after a checkpoint
+JOURNAL_SIZE_LIMIT = 4 << 20
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS series (
+        id INTEGER PRIMARY KEY,
+        meter TEXT NOT NULL,
+        obis TEXT NOT NULL,
+        name TEXT,
+        unit TEXT,
+        UNIQUE (meter, obis)
+    )""",
+    # time of the raw samples in milliseconds
+    """CREATE TABLE IF NOT EXISTS sample (
+        seriesId INTEGER NOT NULL,
+        time INTEGER NOT NULL,
+        value REAL,
+        PRIMARY KEY (seriesId, time)
+    ) WITHOUT ROWID""",
+] + [
+    """CREATE TABLE IF NOT EXISTS rollup{} (
+        seriesId INTEGER NOT NULL,
+        windowStart INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        valueSum REAL NOT NULL,
+        minValue REAL NOT NULL,
+        maxValue REAL NOT NULL,
+        firstValue REAL NOT NULL,
+        lastValue REAL NOT NULL,
+        PRIMARY KEY (seriesId, windowStart)
+    ) WITHOUT ROWID""".format(window)
+    for window in ROLLUP_WINDOWS
+]
+
+ROLLUP_UPSERT = """INSERT INTO rollup{}
+        (seriesId, windowStart, count, valueSum, minValue, maxValue, firstValue, lastValue)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (seriesId, windowStart) DO UPDATE SET
+        count = count + excluded.count,
+        valueSum = valueSum + excluded.valueSum,
+        minValue = min(minValue, excluded.minValue),
+        maxValue = max(maxValue, excluded.maxValue),
+        lastValue = excluded.lastValue"""
+
+
+def openSqliteDatabase(databasePath: str):
+    connection = sqlite3.connect(databasePath, check_same_thread=False)
+    # free pages of deleted rows are returned to the file system by incremental_vacuum, only for new databases
+    connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    connection.execute("PRAGMA journal_mode = WAL")
+    # in WAL mode a power loss can only lose the last transactions, not corrupt the database
+    connection.execute("PRAGMA synchronous = NORMAL")
+    connection.execute("PRAGMA journal_size_limit = {}".format(JOURNAL_SIZE_LIMIT))
+    with connection:
+        for statement in SCHEMA:
+            connection.execute(statement)
+    return connection
+
+
+class SqliteTimeSeriesQuery:
+    """
+    Time ranges of an OBIS key from the raw samples or the rollup table of the resolution.
+    Every query is a range of the primary key (seriesId, time), the other series are not read.
+    """
+
+    def __init__(
+        self, connection: sqlite3.Connection, retention: dict = DEFAULT_RETENTION, clock=time.time
+    ):
+        super().__init__()
+        self.connection = connection
+        self.retention = retention
+        self.clock = clock
+
+    def findSeriesId(self, obisKey: str, meter: str = ""):
+        row = self.connection.execute(
+            "SELECT id FROM series WHERE meter = ? AND obis = ?", (meter, obisKey)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def findResolution(self, start: float, end: float, maxPoints: int):
+        """
+        The finest resolution with at most maxPoints rows whose rows are kept since start.
+        Raw samples are counted as one per second.
+        """
+        now = self.clock()
+        for resolution in (RAW_RESOLUTION,) + ROLLUP_WINDOWS:
+            keep = self.retention.get(resolution)
+            if keep is not None and start < now - keep:
+                continue
+            if (end - start) / max(resolution, 1) <= maxPoints:
+                return resolution
+        return ROLLUP_WINDOWS[-1]
+
+    def queryRange(
+        self,
+        obisKey: str,
+        start: float,
+        end: float,
+        resolution: int = None,
+        meter: str = "",
+        maxPoints: int = 1000,
+    ):
+        """
+        Rows (time, mean, min, max, first, last, count) of the OBIS key from start to end (excluded).
+        Without resolution the finest resolution with at most maxPoints rows is used.
+        The time of raw samples has milliseconds, the time of rollups is the window start.
+        """
+        seriesId = self.findSeriesId(obisKey, meter)
+        if seriesId is None:
+            return []
+        if resolution is None:
+            resolution = self.findResolution(start, end, maxPoints)
+        if resolution == RAW_RESOLUTION:
+            rows = self.connection.execute(
+                "SELECT time, value FROM sample WHERE seriesId = ? AND time >= ? AND time < ? ORDER BY time",
+                (seriesId, int(start * 1000), int(end * 1000)),
+            ).fetchall()
+            return [(sampleTime / 1000, value, value, value, value, value, 1) for sampleTime, value in rows]
+        if resolution not in ROLLUP_WINDOWS:
+            raise ValueError("No rollup table for the resolution {}".format(resolution))
+        return self.connection.execute(
+            "SELECT windowStart, valueSum / count, minValue, maxValue, firstValue, lastValue, count "
+            "FROM rollup{} WHERE seriesId = ? AND windowStart >= ? AND windowStart < ? "
+            "ORDER BY windowStart".format(resolution),
+            (seriesId, int(start - start % resolution), int(end)),
+        ).fetchall()
+
+
+class SqliteDataWriter(WriteData):
+    """
+    Store the numeric entries in a local SQLite database in WAL mode. The rows are buffered and written
+    with one transaction every flushInterval seconds or batchSize rows, together with the rollups
+    of 1 minute, 15 minutes and 1 hour. Rows older than the retention of their resolution are deleted
+    once per retentionInterval. The raw samples are keyed by milliseconds which increase per writer,
+    so every stored sample is counted once in the rollups.
+    """
+
+    def __init__(
+        self,
+        databasePath: str,
+        meter: str = "",
+        batchSize: int = 1000,
+        flushInterval: float = 10.0,
+        retention: dict = None,
+        retentionInterval: float = 3600.0,
+        clock=time.time,
+    ):
+        super().__init__()
+        self.meter = meter or ""
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.retention = dict(DEFAULT_RETENTION)
+        self.retention.update(retention or dict())
+        self.retentionInterval = retentionInterval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.connection = openSqliteDatabase(databasePath)
+        self.query = SqliteTimeSeriesQuery(self.connection, self.retention, clock)
+        self.seriesIds = {
+            (meter, obis): seriesId
+            for seriesId, meter, obis in self.connection.execute("SELECT id, meter, obis FROM series")
+        }
+        self.pendingRows = []
+        self.lastFlush = clock()
+        self.lastRetention = 0.0
+        self.lastSampleTime = findLastSampleTime(self.connection, self.seriesIds.values())
+
+    def findSeriesId(self, meter: str, dataItem: SmlEntry):
+        seriesId = self.seriesIds.get((meter, dataItem.obis))
+        if seriesId is None:
+            with self.connection:
+                seriesId = self.connection.execute(
+                    "INSERT INTO series (meter, obis, name, unit) VALUES (?, ?, ?, ?)",
+                    (meter, dataItem.obis, dataItem.obisName, dataItem.unit),
+                ).lastrowid
+            self.seriesIds[(meter, dataItem.obis)] = seriesId
+        return seriesId
+
+    def writeData(self, data: List[SmlEntry], meter: str = None):
+        now = self.clock()
+        meter = self.meter if meter is None else meter
+        with self.lock:
+            # telegrams in the same millisecond or after a clock step back get the next free time
+            sampleTime = max(int(now * 1000), self.lastSampleTime + 1)
+            self.lastSampleTime = sampleTime
+            for dataItem in data:
+                value = dataItem.value
+                if not isinstance(value, (int, float)) or isinstance(value, bool):
+                    # octet strings like the device id are not stored
+                    continue
+                self.pendingRows.append((self.findSeriesId(meter, dataItem), sampleTime, value))
+            if len(self.pendingRows) >= self.batchSize or now - self.lastFlush >= self.flushInterval:
+                self.flushRows(now)
+
+    def flushRows(self, now: float):
+        rows = self.pendingRows
+        self.pendingRows = []
+        self.lastFlush = now
+        if len(rows) > 0:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT INTO sample (seriesId, time, value) VALUES (?, ?, ?)", rows
+                )
+                for window in ROLLUP_WINDOWS:
+                    self.connection.executemany(ROLLUP_UPSERT.format(window), rollupRows(rows, window))
+        if now - self.lastRetention >= self.retentionInterval:
+            self.deleteExpiredRows(now)
+
+    def deleteExpiredRows(self, now: float):
+        self.lastRetention = now
+        seriesIds = [(seriesId,) for seriesId in self.seriesIds.values()]
+        with self.connection:
+            for resolution, keep in self.retention.items():
+                if keep is None:
+                    continue
+                if resolution == RAW_RESOLUTION:
+                    table, column, limit = "sample", "time", int((now - keep) * 1000)
+                else:
+                    table, column, limit = "rollup{}".format(resolution), "windowStart", int(now - keep)
+                self.connection.executemany(
+                    "DELETE FROM {} WHERE seriesId = ? AND {} < {}".format(table, column, limit), seriesIds
+                )
+        # execute steps the pragma once and frees a single page, executescript runs it to the end
+        self.connection.executescript("PRAGMA incremental_vacuum;")
+
+    def flush(self):
+        with self.lock:
+            self.flushRows(self.clock())
+
+    def queryRange(
+        self,
+        obisKey: str,
+        start: float,
+        end: float,
+        resolution: int = None,
+        meter: str = None,
+        maxPoints: int = 1000,
+    ):
+        self.flush()
+        with self.lock:
+            return self.query.queryRange(
+                obisKey, start, end, resolution, self.meter if meter is None else meter, maxPoints
+            )
+
+    def close(self):
+        with self.lock:
+            self.flushRows(self.clock())
+            self.connection.close()
+
+
+def findLastSampleTime(connection: sqlite3.Connection, seriesIds):
+    """
+    The newest sample time of the series, one lookup of the primary key per series.
+    """
+    lastSampleTime = 0
+    for seriesId in seriesIds:
+        row = connection.execute("SELECT max(time) FROM sample WHERE seriesId = ?", (seriesId,)).fetchone()
+        if row[0] is not None and row[0] > lastSampleTime:
+            lastSampleTime = row[0]
+    return lastSampleTime
+
+
+def rollupRows(rows: list, window: int):
+    """
+    Aggregate the rows of a batch per series and window, the upsert merges them with the stored window.
+    The sample times are milliseconds, the window start is in seconds.
+    """
+    windows = dict()
+    for seriesId, sampleTime, value in rows:
+        seconds = sampleTime // 1000
+        key = (seriesId, seconds - seconds % window)
+        aggregate = windows.get(key)
+        if aggregate is None:
+            windows[key] = [1, value, value, value, value, value]
+        else:
+            aggregate[0] += 1
+            aggregate[1] += value
+            if value < aggregate[2]:
+                aggregate[2] = value
+            elif value > aggregate[3]:
+                aggregate[3] = value
+            aggregate[5] = value
+    return [key + tuple(aggregate) for key, aggregate in windows.items()]
+
+
+class SqliteMeterWriter(WriteData):
+    """
+    Store with a shared sqlite writer under an own meter name, e.g. for several meters in one process.
+    """
+
+    def __init__(self, sqliteWriter: SqliteDataWriter, meter: str):
+        super().__init__()
+        self.sqliteWriter = sqliteWriter
+        self.meter = meter
+
+    def writeData(self, data: List[SmlEntry]):
+        self.sqliteWriter.writeData(data, self.meter)
@@ -0,0 +1,230 @@
+"""
+Benchmark of the read stages with a synthetic telegram corpus.
+
+python -m testing.benchmark --count 2000 --save testing/benchmark-baseline.json
+python -m testing.benchmark --count 2000 --compare testing/benchmark-baseline.json
+"""
+import argparse
+import json
+import logging
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import List
+from sml_frame_decoder import SmlFrameDecoder, SmlReadStats
+from sml_step_reader import encodeSmlFrame
+from sml_block_maper import mapSmlBlocksObisEntry
+from meter_obis_value_index import findMeterConfiguration
+from sml_message_cache import SmlMessageCache, mapSmlFrame
+from sml_encoder import SmlTelegramEncoder, MeterValueGenerator
+from testing.telegram_generator import generateCorpus, LAYOUTS
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+STAGES = ["frame", "parse", "map"]
+
+
+def peakRssKb():
+    if resource is None:
+        return None
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return maxRss // 1024 if sys.platform == "darwin" else maxRss
+
+
+def runStages(corpus: List[tuple], meterProperties: dict):
+    """
+    Run every telegram through frame decoding, parsing and mapping.
+    Returns the nanoseconds per stage, the count of frames and entries and the read stats.
+    """
+    stageTimes = dict.fromkeys(STAGES, 0)
+    stats = SmlReadStats()
+    decoders = {
+        layout: SmlFrameDecoder(properties.smlConfig, stats=stats)
+        for layout, properties in meterProperties.items()
+    }
+    frameCount = 0
+    entryCount = 0
+    clock = time.perf_counter_ns
+    for layout, telegram, _ in corpus:
+        properties = meterProperties[layout]
+        start = clock()
+        frames = list(decoders[layout].feed(telegram))
+        parsed = clock()
+        stageTimes["frame"] += parsed - start
+        for frame in frames:
+            start = clock()
+            smlBlocks = encodeSmlFrame(frame, properties.smlConfig, stats)
+            parsed = clock()
+            smlEntries = mapSmlBlocksObisEntry(smlBlocks, properties)
+            mapped = clock()
+            stageTimes["parse"] += parsed - start
+            stageTimes["map"] += mapped - parsed
+            frameCount += 1
+            entryCount += len(smlEntries)
+    return stageTimes, frameCount, entryCount, stats
+
+
+def runCached(corpus: List[tuple], meterProperties: dict, caches: dict):
+    """
+    Parse and map the frames with the message cache of every layout, frames of meters whose values change
+    too often are parsed without the cache. Returns the nanoseconds.
+    """
+    stats = SmlReadStats()
+    frames = [
+        (layout, frame)
+        for layout, telegram, _ in corpus
+        for frame in SmlFrameDecoder(meterProperties[layout].smlConfig, stats=stats).feed(telegram)
+    ]
+    for layout, cache in caches.items():
+        meterProperties[layout].messageCache = cache
+    try:
+        start = time.perf_counter_ns()
+        for layout, frame in frames:
+            mapSmlFrame(frame, meterProperties[layout], stats)
+        return time.perf_counter_ns() - start
+    finally:
+        for layout in caches:
+            meterProperties[layout].messageCache = None
+
+
+def quietMeterCorpus(count: int, layouts: List[str], seed: int):
+    """
+    Telegrams of meters whose values do not change, only transaction ids and sensor times differ.
+    """
+    corpus = []
+    for layout in layouts:
+        encoder = SmlTelegramEncoder(findMeterConfiguration(layout))
+        values = MeterValueGenerator(rng=random.Random(seed)).nextValues()
+        for index in range(count // len(layouts)):
+            corpus.append((layout, encoder.encode(values, index, index), True))
+    return corpus
+
+
+def measureCache(corpus: List[tuple], meterProperties: dict, repeat: int):
+    """
+    Microseconds per telegram of parsing and mapping with the message cache and its hit ratio.
+    """
+    best = None
+    for _ in range(repeat):
+        caches = {layout: SmlMessageCache() for layout in meterProperties}
+        total = runCached(corpus, meterProperties, caches)
+        if best is None or total < best[0]:
+            best = (total, caches)
+    total, caches = best
+    hits = sum(cache.hitCount for cache in caches.values())
+    lookups = hits + sum(cache.missCount for cache in caches.values())
+    return round(total / len(corpus) / 1000, 2), round(hits / lookups, 3) if lookups > 0 else 0.0
+
+
+def measureAllocations(corpus: List[tuple], meterProperties: dict):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    runStages(corpus, meterProperties)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    allocated = [stat for stat in after.compare_to(before, "filename") if stat.size_diff > 0]
+    return {
+        "peakBytes": peak,
+        "retainedBytes": sum(stat.size_diff for stat in allocated),
+        "retainedBlocks": sum(stat.count_diff for stat in allocated),
+    }
+
+
+def runBenchmark(count: int, repeat: int, layouts: List[str], seed: int):
+    corpus = generateCorpus(count, layouts=layouts, seed=seed)
+    meterProperties = {layout: findMeterConfiguration(layout) for layout in layouts}
+    # warm up, the first run compiles the extraction plans
+    runStages(corpus, meterProperties)
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        stageTimes, frameCount, entryCount, stats = runStages(corpus, meterProperties)
+        total = time.perf_counter_ns() - start
+        if best is None or total < best[0]:
+            best = (total, stageTimes, frameCount, entryCount, stats)
+    total, stageTimes, frameCount, entryCount, stats = best
+
+    result = {
+        "python": platform.python_implementation() + " " + platform.python_version(),
+        "telegrams": count,
+        "frames": frameCount,
+        "entries": entryCount,
+        "telegramsPerSecond": round(count / (total / 1e9), 1),
+        "usPerTelegram": {stage: round(stageTimes[stage] / count / 1000, 2) for stage in STAGES},
+        "stats": stats.__dict__,
+    }
+    result["usPerTelegram"]["total"] = round(total / count / 1000, 2)
+    result["usPerTelegram"]["cached"], result["cacheHitRatio"] = measureCache(corpus, meterProperties, repeat)
+    quietCorpus = quietMeterCorpus(count, layouts, seed)
+    quietTimes, _, _, _ = runStages(quietCorpus, meterProperties)
+    quietTime = quietTimes["parse"] + quietTimes["map"]
+    result["usPerTelegram"]["quiet"] = round(quietTime / len(quietCorpus) / 1000, 2)
+    result["usPerTelegram"]["quietCached"], result["quietCacheHitRatio"] = measureCache(
+        quietCorpus, meterProperties, repeat
+    )
+    allocations = measureAllocations(corpus, meterProperties)
+    allocations["peakRssKb"] = peakRssKb()
+    result["memory"] = allocations
+    return result
+
+
+def compareBaseline(result: dict, baseline: dict, tolerance: float):
+    """
+    Print the change per stage against the baseline. Returns False if a stage is slower than the tolerance.
+    """
+    passed = True
+    for stage, value in result["usPerTelegram"].items():
+        baseValue = baseline["usPerTelegram"].get(stage)
+        if not baseValue:
+            continue
+        ratio = value / baseValue
+        slower = ratio > 1 + tolerance
+        passed = passed and not slower
+        print(
+            "{:<6} {:>9.2f} us  baseline {:>9.2f} us  {:+.1%}{}".format(
+                stage, value, baseValue, ratio - 1, "  REGRESSION" if slower else ""
+            )
+        )
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of frame decoding, parsing and mapping.")
+    parser.add_argument("--count", type=int, default=2000, help="Count of telegrams in the corpus.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of the corpus, the fastest is reported.")
+    parser.add_argument(
+        "--layout", action="append", choices=LAYOUTS, help="Meter layouts of the corpus, default all."
+    )
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the corpus.")
+    parser.add_argument("--save", type=str, help="Save the result as baseline json file.")
+    parser.add_argument("--compare", type=str, help="Compare the result with a baseline json file.")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="Allowed slow down against the baseline, 0.1 = 10%%."
+    )
+    args = parser.parse_args()
+    # the corrupted telegrams of the corpus would log a warning each
+    logging.getLogger("general_logger").setLevel(logging.ERROR)
+
+    result = runBenchmark(args.count, args.repeat, args.layout or LAYOUTS, args.seed)
+    print(json.dumps(result, indent=2))
+    if args.save:
+        with open(args.save, "w") as baselineFile:
+            json.dump(result, baselineFile, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as baselineFile:
+            baseline = json.load(baselineFile)
+        if not compareBaseline(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+In-process stand-in of paho.mqtt.client for the tests of the mqtt writer. The broker keeps the delivered
+messages, the client simulates the connection of the network loop and its outbound queue limit.
+"""
+import threading
+import types
+
+MQTT_ERR_SUCCESS = 0
+MQTT_ERR_NO_CONN = 4
+MQTT_ERR_QUEUE_SIZE = 15
+
+
+class FakeMessageInfo:
+    def __init__(self, rc: int, published: bool):
+        super().__init__()
+        self.rc = rc
+        self.published = published
+
+    def is_published(self):
+        return self.published
+
+
+class FakeBroker:
+    def __init__(self):
+        super().__init__()
+        # topic, payload and qos of every delivered message
+        self.messages = []
+        self.reachable = True
+        self.clients = []
+
+    def payloads(self, topic: str = None):
+        return [payload for messageTopic, payload, _ in self.messages if topic is None or messageTopic == topic]
+
+
+class FakeMqttClient:
+    """
+    Connects when the loop is started and the broker is reachable. Messages published without connection
+    are queued up to the limit of max_queued_messages_set and delivered after the connect.
+    """
+
+    def __init__(self, broker: FakeBroker):
+        super().__init__()
+        self.broker = broker
+        self.lock = threading.Lock()
+        self.connected = False
+        self.loopRunning = False
+        self.connectCount = 0
+        self.address = None
+        self.maxQueuedMessages = 0
+        self.reconnectDelay = None
+        self.queue = []
+        self.on_connect = None
+        self.on_disconnect = None
+        broker.clients.append(self)
+
+    def max_queued_messages_set(self, maxQueuedMessages: int):
+        self.maxQueuedMessages = maxQueuedMessages
+
+    def reconnect_delay_set(self, minDelay: int, maxDelay: int):
+        self.reconnectDelay = (minDelay, maxDelay)
+
+    def connect_async(self, host: str, port: int):
+        self.address = (host, port)
+
+    def loop_start(self):
+        self.loopRunning = True
+        self.reconnect()
+
+    def loop_stop(self):
+        self.loopRunning = False
+
+    def reconnect(self):
+        """
+        Connect like the network loop does after its reconnect delay.
+        """
+        with self.lock:
+            if not self.loopRunning or not self.broker.reachable or self.connected:
+                return
+            self.connected = True
+            self.connectCount += 1
+            for topic, payload, qos, info in self.queue:
+                self.broker.messages.append((topic, payload, qos))
+                info.published = True
+            self.queue = []
+        self.on_connect(self, None, {}, 0)
+
+    def dropConnection(self):
+        """
+        The broker is lost, e.g. network outage.
+        """
+        self.broker.reachable = False
+        with self.lock:
+            self.connected = False
+        self.on_disconnect(self, None, 1)
+
+    def disconnect(self):
+        with self.lock:
+            self.connected = False
+        self.on_disconnect(self, None, 0)
+
+    def publish(self, topic: str, payload, qos: int = 0):
+        with self.lock:
+            if self.connected:
+                self.broker.messages.append((topic, payload, qos))
+                return FakeMessageInfo(MQTT_ERR_SUCCESS, True)
+            if self.maxQueuedMessages > 0 and len(self.queue) >= self.maxQueuedMessages:
+                return FakeMessageInfo(MQTT_ERR_QUEUE_SIZE, False)
+            info = FakeMessageInfo(MQTT_ERR_SUCCESS, False)
+            self.queue.append((topic, payload, qos, info))
+            return info
+
+
+def createFakeMqttModule(broker: FakeBroker):
+    """
+    Replacement of the paho.mqtt.client module, e.g. for write_data.mqtt.
+    """
+    return types.SimpleNamespace(
+        Client=lambda *args, **kwargs: FakeMqttClient(broker),
+        MQTT_ERR_SUCCESS=MQTT_ERR_SUCCESS,
+        MQTT_ERR_NO_CONN=MQTT_ERR_NO_CONN,
+        MQTT_ERR_QUEUE_SIZE=MQTT_ERR_QUEUE_SIZE,
+    )
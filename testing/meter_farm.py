@@ -0,0 +1,317 @@
+"""
+Virtual meter farm: every meter writes encoded SML telegrams to its own pseudo terminal at the baud rate
+of a real serial line (or faster), the multi meter daemon reads all of them.
+Jitter, bit errors and frames split by pauses can be added. The sequence number of a telegram is sent
+in the counter 0100010800, so the receive side measures throughput, latency and loss.
+
+python -m testing.meter_farm --meters 16 --baudrate 9600 --interval 1 --duration 30
+python -m testing.meter_farm --meters 64 --speedup 0 --interval 0.05 --bit-errors 0.01 --split 0.2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import pty
+import random
+import threading
+import time
+import tty
+from typing import List
+from sml_block_maper import SmlEntry
+from sml_encoder import SmlTelegramEncoder, MeterValueGenerator
+from meter_obis_value_index import findMeterConfiguration
+from multi_meter_daemon import createMeterPorts, runMeterPorts
+from write_data import WriteData
+from meter_serial import SERIAL_BACKENDS, SERIAL_BACKEND_AUTO
+
+logger = logging.getLogger('general_logger')
+
+# counter which carries the sequence number, the meter number is sent in front of the sequence
+SEQUENCE_OBIS_KEY = "0100010800"
+SEQUENCE_RANGE = 10**9
+# bytes are written in chunks of this duration at the baud rate
+PACING_SECONDS = 0.01
+# seconds for the daemon to open the ports
+OPEN_DELAY = 0.2
+
+
+class VirtualMeter:
+    """
+    A pseudo terminal with a thread that writes a telegram every interval seconds.
+    """
+
+    def __init__(
+        self,
+        number: int,
+        encoder: SmlTelegramEncoder,
+        baudrate: int = 9600,
+        interval: float = 1.0,
+        jitter: float = 0.0,
+        bitErrorRate: float = 0.0,
+        splitRatio: float = 0.0,
+        speedup: float = 1.0,
+        seed: int = None,
+    ):
+        super().__init__()
+        self.number = number
+        self.encoder = encoder
+        self.interval = interval
+        self.jitter = jitter
+        self.bitErrorRate = bitErrorRate
+        self.splitRatio = splitRatio
+        # 10 bits per byte with start and stop bit, 0 writes without pacing
+        self.bytesPerSecond = baudrate / 10 * speedup
+        self.rng = random.Random(seed)
+        self.valueGenerator = MeterValueGenerator(encoder.obisEntries, self.rng)
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.devicePath = os.ttyname(self.slave)
+        self.sentTimes = dict()
+        self.sentCount = 0
+        self.corruptedCount = 0
+        self.overrunCount = 0
+        self.byteCount = 0
+        self.thread = None
+
+    def encodeTelegram(self, sequence: int):
+        values = self.valueGenerator.nextValues()
+        values[SEQUENCE_OBIS_KEY] = self.number * SEQUENCE_RANGE + sequence
+        telegram = self.encoder.encode(values, sequence, sequence)
+        if self.bitErrorRate > 0 and self.rng.random() < self.bitErrorRate:
+            # one flipped bit, the frame or message checksum drops the telegram
+            corrupted = bytearray(telegram)
+            corrupted[self.rng.randrange(len(corrupted))] ^= 1 << self.rng.randrange(8)
+            self.corruptedCount += 1
+            return bytes(corrupted)
+        return telegram
+
+    def writeChunk(self, chunk: bytes):
+        try:
+            written = os.write(self.master, chunk)
+        except BlockingIOError:
+            written = 0
+        self.byteCount += written
+        if written < len(chunk):
+            # the reader is too slow, the rest of the frame is lost like on a serial line
+            self.overrunCount += 1
+            return False
+        return True
+
+    def writeTelegram(self, sequence: int, telegram: bytes):
+        splitPosition = len(telegram) // 2 if self.rng.random() < self.splitRatio else -1
+        if self.bytesPerSecond <= 0:
+            chunkSize = len(telegram)
+        else:
+            chunkSize = max(1, int(self.bytesPerSecond * PACING_SECONDS))
+        pos = 0
+        while pos < len(telegram):
+            end = min(pos + chunkSize, len(telegram))
+            if pos < splitPosition < end:
+                end = splitPosition
+            if end == len(telegram):
+                # latency is measured from the last byte on the line, stored before the reader can get it
+                self.sentTimes[sequence] = time.perf_counter()
+            if not self.writeChunk(telegram[pos:end]):
+                self.sentTimes.pop(sequence, None)
+                return
+            if end == splitPosition:
+                # a pause in the frame, the reader gets it in two reads
+                time.sleep(self.rng.uniform(0.005, 0.05))
+            elif self.bytesPerSecond > 0:
+                time.sleep((end - pos) / self.bytesPerSecond)
+            pos = end
+
+    def run(self, stopEvent: threading.Event):
+        nextTime = time.perf_counter()
+        sequence = 0
+        while not stopEvent.is_set():
+            delay = nextTime - time.perf_counter()
+            if delay > 0:
+                stopEvent.wait(delay)
+            telegram = self.encodeTelegram(sequence)
+            self.writeTelegram(sequence, telegram)
+            self.sentCount += 1
+            sequence += 1
+            nextTime += self.interval
+            if self.jitter > 0:
+                nextTime += self.rng.uniform(-self.jitter, self.jitter)
+
+    def start(self, stopEvent: threading.Event):
+        self.thread = threading.Thread(target=self.run, args=(stopEvent,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        if self.thread is not None:
+            self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class FarmCollector(WriteData):
+    """
+    Receive side of the farm, matches the sequence number of every telegram with its send time.
+    """
+
+    def __init__(self, meters: List[VirtualMeter]):
+        super().__init__()
+        self.meters = {meter.number: meter for meter in meters}
+        self.latencies = []
+        self.receivedCount = 0
+        self.entryCount = 0
+
+    def writeData(self, data: List[SmlEntry]):
+        now = time.perf_counter()
+        self.entryCount += len(data)
+        for dataItem in data:
+            if dataItem.obis != SEQUENCE_OBIS_KEY:
+                continue
+            number, sequence = divmod(dataItem.baseValue, SEQUENCE_RANGE)
+            meter = self.meters.get(number)
+            sentTime = None if meter is None else meter.sentTimes.pop(sequence, None)
+            if sentTime is not None:
+                self.receivedCount += 1
+                self.latencies.append(now - sentTime)
+
+
+def percentile(values: List[float], fraction: float):
+    if len(values) == 0:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def runFarm(
+    meterKey: str = "BZPlus3",
+    meterCount: int = 4,
+    baudrate: int = 9600,
+    interval: float = 1.0,
+    duration: float = 10.0,
+    jitter: float = 0.0,
+    bitErrorRate: float = 0.0,
+    splitRatio: float = 0.0,
+    speedup: float = 1.0,
+    seed: int = 1,
+    serialBackend: str = SERIAL_BACKEND_AUTO,
+):
+    encoder = SmlTelegramEncoder(findMeterConfiguration(meterKey))
+    meters = [
+        VirtualMeter(
+            number + 1,
+            encoder,
+            baudrate,
+            interval,
+            jitter,
+            bitErrorRate,
+            splitRatio,
+            speedup,
+            seed=seed * 1000 + number,
+        )
+        for number in range(meterCount)
+    ]
+    collector = FarmCollector(meters)
+    config = {
+        "reconnectDelay": 1,
+        "meters": [
+            {
+                "device": meter.devicePath,
+                "meter": meterKey,
+                "baudrate": baudrate,
+                "backend": serialBackend,
+                "name": "farm{}".format(meter.number),
+            }
+            for meter in meters
+        ],
+    }
+    meterPorts, writer = createMeterPorts(config, collector)
+    senderStop = threading.Event()
+
+    async def run():
+        stopEvent = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        # the daemon opens the ports before the meters start to send
+        loop.call_later(OPEN_DELAY, lambda: [meter.start(senderStop) for meter in meters])
+        loop.call_later(OPEN_DELAY + duration, senderStop.set)
+        # telegrams on the line are received after the senders stopped
+        loop.call_later(OPEN_DELAY + duration + interval + 1.0, stopEvent.set)
+        await runMeterPorts(meterPorts, stopEvent)
+
+    startTime = time.perf_counter()
+    try:
+        asyncio.run(run())
+    finally:
+        senderStop.set()
+        for meter in meters:
+            meter.close()
+        writer.close()
+    elapsed = time.perf_counter() - startTime
+
+    latencies = sorted(collector.latencies)
+    sentCount = sum(meter.sentCount for meter in meters)
+    return {
+        "meter": meterKey,
+        "meters": meterCount,
+        "baudrate": baudrate,
+        "speedup": speedup,
+        "serialBackend": serialBackend,
+        "seconds": round(elapsed, 3),
+        "sent": sentCount,
+        "corrupted": sum(meter.corruptedCount for meter in meters),
+        "overruns": sum(meter.overrunCount for meter in meters),
+        "received": collector.receivedCount,
+        "lost": sentCount - collector.receivedCount,
+        "entries": collector.entryCount,
+        "telegramsPerSecond": round(collector.receivedCount / duration, 1),
+        "bytesPerSecond": round(sum(meter.byteCount for meter in meters) / duration, 1),
+        "latencyMs": {
+            "p50": None if len(latencies) == 0 else round(percentile(latencies, 0.5) * 1000, 3),
+            "p95": None if len(latencies) == 0 else round(percentile(latencies, 0.95) * 1000, 3),
+            "max": None if len(latencies) == 0 else round(latencies[-1] * 1000, 3),
+        },
+        "frameCrcErrors": sum(meterPort.stats.frameCrcErrorCount for meterPort in meterPorts),
+        "messageCrcErrors": sum(meterPort.stats.messageCrcErrorCount for meterPort in meterPorts),
+        "droppedFrames": sum(meterPort.stats.droppedFrameCount for meterPort in meterPorts),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the multi meter daemon with ptys.")
+    parser.add_argument("--meters", type=int, default=4, help="Count of virtual meters.")
+    parser.add_argument("--meter", default="BZPlus3", help="Meter profile of the encoded telegrams.")
+    parser.add_argument("--baudrate", type=int, default=9600, help="Baud rate of the simulated line.")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between two telegrams.")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to send.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random send time shift (s).")
+    parser.add_argument("--bit-errors", type=float, default=0.0, help="Ratio of flipped bits.")
+    parser.add_argument("--split", type=float, default=0.0, help="Ratio of split frames.")
+    parser.add_argument(
+        "--speedup", type=float, default=1.0, help="Factor of the baud rate, 0 writes without pacing."
+    )
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the values and errors.")
+    parser.add_argument(
+        "--serial-backend",
+        choices=SERIAL_BACKENDS,
+        default=SERIAL_BACKEND_AUTO,
+        help="Serial backend of the daemon.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    result = runFarm(
+        args.meter,
+        args.meters,
+        args.baudrate,
+        args.interval,
+        args.duration,
+        args.jitter,
+        args.bit_errors,
+        args.split,
+        args.speedup,
+        args.seed,
+        args.serial_backend,
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Random corpus of SML elements to check the type decoder: integers of 1 to 8 bytes, booleans,
+octet strings, OBIS list entries and nested lists, with short and extended type-length fields.
+Every element is encoded, parsed and compared with the expected value, truncated elements must not raise.
+
+python -m testing.sml_type_corpus --count 20000 --seed 1
+"""
+import argparse
+import random
+import sys
+from sml_step_reader import (
+    SmlBlock,
+    SmlOctetString,
+    parsSmlList,
+    parsValueToString,
+    parsValueToLazyString,
+    SML_LIST_ENTRY_LENGTH,
+    SML_OBIS_KEY_LENGTH,
+    SML_OBIS_TL,
+)
+from sml_encoder import encodeTypeLength, encodeOctetString
+
+
+class ExpectedBlock:
+    def __init__(self):
+        super().__init__()
+        self.values = []
+        self.childList = []
+
+
+def encodeNumber(smlType: int, data: bytes, extended: bool):
+    # the length of a value includes the type-length field, the extended form has 2 bytes
+    if extended:
+        return bytes([0x80 | smlType, len(data) + 2]) + data
+    return bytes([smlType | (len(data) + 1)]) + data
+
+
+def randomNumber(rng: random.Random):
+    signed = rng.random() < 0.5
+    size = rng.randint(0, 8)
+    if size == 0:
+        value = None
+    elif signed:
+        value = rng.randint(-(1 << (8 * size - 1)), (1 << (8 * size - 1)) - 1)
+    else:
+        value = rng.randint(0, (1 << (8 * size)) - 1)
+    data = b"" if value is None else value.to_bytes(size, "big", signed=signed)
+    return encodeNumber(0x50 if signed else 0x60, data, rng.random() < 0.1), value
+
+
+def randomBoolean(rng: random.Random):
+    value = rng.random() < 0.5
+    return encodeNumber(0x40, bytes([rng.randint(1, 255) if value else 0]), rng.random() < 0.1), value
+
+
+def randomOctetString(rng: random.Random):
+    size = rng.choice([0, 1, 2, 6, 10, 14, 15, 16, 17, 48, 255, 300])
+    value = bytes(rng.getrandbits(8) for _ in range(size))
+    return encodeOctetString(value), value.hex() if size > 0 else None
+
+
+def randomObisKey(rng: random.Random):
+    value = bytes(rng.getrandbits(8) for _ in range(SML_OBIS_KEY_LENGTH)) + b"\xff"
+    # the OBIS key of a list entry is decoded without the F group
+    return encodeOctetString(value), value[:SML_OBIS_KEY_LENGTH].hex()
+
+
+def randomList(rng: random.Random, depth: int):
+    expected = ExpectedBlock()
+    items = []
+    # more than 15 elements need an extended type-length field
+    count = rng.choice([0, 1, 2, 5, 7, 16, 20]) if depth < 3 else rng.randint(0, 4)
+    listEntry = count == SML_LIST_ENTRY_LENGTH and rng.random() < 0.5
+    for index in range(count):
+        data, value = randomObisKey(rng) if listEntry and index == 0 else randomElement(rng, depth + 1)
+        if index == 0 and count == SML_LIST_ENTRY_LENGTH and data[0] == SML_OBIS_TL:
+            # a 6 byte octet string at the start of a list of 7 elements is an OBIS key
+            value = value[: 2 * SML_OBIS_KEY_LENGTH]
+        items.append(data)
+        if isinstance(value, ExpectedBlock):
+            expected.childList.append(value)
+        else:
+            expected.values.append(value)
+    return encodeTypeLength(0x70, len(items)) + b"".join(items), expected
+
+
+def randomElement(rng: random.Random, depth: int = 0):
+    choice = rng.random()
+    if choice < 0.4:
+        return randomNumber(rng)
+    if choice < 0.5:
+        return randomBoolean(rng)
+    if choice < 0.8 or depth >= 4:
+        return randomOctetString(rng)
+    return randomList(rng, depth)
+
+
+def normalizeValue(value):
+    return str(value) if isinstance(value, SmlOctetString) else value
+
+
+def compareBlock(smlBlock: SmlBlock, expected: ExpectedBlock):
+    if [normalizeValue(value) for value in smlBlock.values] != expected.values:
+        return False
+    if len(smlBlock.childList) != len(expected.childList):
+        return False
+    return all(compareBlock(child, childExpected) for child, childExpected in zip(smlBlock.childList, expected.childList))
+
+
+def checkElement(data: bytes, expected, octetString):
+    smlBlock = SmlBlock()
+    end = parsSmlList(memoryview(data), 0, len(data), smlBlock, 1, octetString)
+    if end != len(data):
+        return False
+    if isinstance(expected, ExpectedBlock):
+        return len(smlBlock.values) == 0 and len(smlBlock.childList) == 1 and compareBlock(smlBlock.childList[0], expected)
+    return len(smlBlock.childList) == 0 and [normalizeValue(value) for value in smlBlock.values] == [expected]
+
+
+def runCorpus(count: int, seed: int):
+    rng = random.Random(seed)
+    failures = []
+    for index in range(count):
+        data, expected = randomElement(rng)
+        for octetString in (parsValueToString, parsValueToLazyString):
+            if not checkElement(data, expected, octetString):
+                failures.append((index, data.hex()))
+                break
+        # a truncated element is decoded as far as possible
+        cut = rng.randint(0, len(data))
+        try:
+            parsSmlList(memoryview(data[:cut]), 0, cut, SmlBlock(), 1)
+        except Exception as e:
+            failures.append((index, "truncated {}: {}".format(data[:cut].hex(), e)))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the SML type decoder with a random element corpus.")
+    parser.add_argument("--count", type=int, default=20000, help="Count of random elements.")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the corpus.")
+    args = parser.parse_args()
+
+    failures = runCorpus(args.count, args.seed)
+    for index, detail in failures[:20]:
+        print("element {} failed: {}".format(index, detail))
+    print("{} elements, {} failures".format(args.count, len(failures)))
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Startup benchmark: import time, peak RSS and loaded modules of the reader core (frame decoding, parsing,
+OBIS mapping) and of the command line, each measured in a new interpreter. The core must not load the
+modules of the writers and the daemon, the command line only loads them with their option.
+
+python -m testing.startup_benchmark --save startup-baseline.json
+python -m testing.startup_benchmark --compare startup-baseline.json --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CORE_MODULES = [
+    "sml_crc",
+    "sml_frame_decoder",
+    "sml_step_reader",
+    "sml_block_maper",
+    "meter_obis_value_index",
+    "obis_keys",
+    "sml_units",
+]
+CLI_MODULES = ["read_meter_values"]
+# modules which are never loaded by the core
+CORE_EXCLUDED_MODULES = [
+    "json",
+    "typing",
+    "argparse",
+    "asyncio",
+    "sqlite3",
+    "http.server",
+    "multiprocessing",
+    "mmap",
+    "zlib",
+    "serial",
+    "paho",
+    "numpy",
+]
+# modules which are only loaded with their command line option
+CLI_EXCLUDED_MODULES = [
+    "asyncio",
+    "sqlite3",
+    "http.server",
+    "multiprocessing",
+    "mmap",
+    "paho",
+    "numpy",
+    "multi_meter_daemon",
+    "meter_probe",
+    "sml_replay",
+    "sqlite_data_writer",
+    "testing.init_test",
+]
+# target name, imported modules and excluded modules, "python" is the interpreter without imports
+TARGETS = [
+    ("python", [], []),
+    ("core", CORE_MODULES, CORE_EXCLUDED_MODULES),
+    ("cli", CLI_MODULES, CLI_EXCLUDED_MODULES),
+]
+
+MEASURE_SCRIPT = """
+import sys
+import time
+start = time.perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+elapsed = time.perf_counter() - start
+modules = sorted(sys.modules)
+import json
+try:
+    import resource
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    maxRss = maxRss // 1024 if sys.platform == "darwin" else maxRss
+except ImportError:
+    maxRss = None
+print(json.dumps({"importMs": elapsed * 1000, "rssKb": maxRss, "modules": modules}))
+"""
+
+
+def measureImports(modules: list, repeat: int):
+    """
+    Import the modules in repeat new interpreters, the fastest run is reported.
+    """
+    results = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", MEASURE_SCRIPT] + modules,
+            cwd=REPOSITORY_DIRECTORY,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    return min(results, key=lambda result: result["importMs"])
+
+
+def isLoaded(module: str, loadedModules: list):
+    return any(name == module or name.startswith(module + ".") for name in loadedModules)
+
+
+def runStartupBenchmark(repeat: int):
+    result = dict()
+    for target, modules, excludedModules in TARGETS:
+        measurement = measureImports(modules, repeat)
+        result[target] = {
+            "importMs": round(measurement["importMs"], 3),
+            "rssKb": measurement["rssKb"],
+            "modules": len(measurement["modules"]),
+            "excludedLoaded": [
+                module for module in excludedModules if isLoaded(module, measurement["modules"])
+            ],
+        }
+    baseRss = result["python"]["rssKb"]
+    for target, modules, excludedModules in TARGETS[1:]:
+        if baseRss is not None and result[target]["rssKb"] is not None:
+            result[target]["rssDeltaKb"] = result[target]["rssKb"] - baseRss
+    return result
+
+
+def compareBaseline(result: dict, baseline: dict, tolerance: float):
+    """
+    Print the change per target against the baseline. Returns False if a target is slower or larger
+    than the tolerance.
+    """
+    passed = True
+    for target, modules, excludedModules in TARGETS[1:]:
+        for key, unit in (("importMs", "ms"), ("rssKb", "KB")):
+            value = result[target].get(key)
+            baseValue = baseline.get(target, dict()).get(key)
+            if value is None or not baseValue:
+                continue
+            ratio = value / baseValue
+            worse = ratio > 1 + tolerance
+            passed = passed and not worse
+            print(
+                "{:<5} {:<11} {:>9.2f} {}  baseline {:>9.2f} {}  {:+.1%}{}".format(
+                    target, key, value, unit, baseValue, unit, ratio - 1, "  REGRESSION" if worse else ""
+                )
+            )
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time and memory of the reader core and the CLI.")
+    parser.add_argument("--repeat", type=int, default=5, help="Starts per target, the fastest is reported.")
+    parser.add_argument("--save", type=str, help="Save the result as baseline json file.")
+    parser.add_argument("--compare", type=str, help="Compare the result with a baseline json file.")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="Allowed growth against the baseline, 0.2 = 20%%."
+    )
+    args = parser.parse_args()
+
+    result = runStartupBenchmark(args.repeat)
+    print(json.dumps(result, indent=2))
+    passed = True
+    for target, modules, excludedModules in TARGETS[1:]:
+        if len(result[target]["excludedLoaded"]) > 0:
+            print("{} loads {}".format(target, ", ".join(result[target]["excludedLoaded"])))
+            passed = False
+    if args.save:
+        with open(args.save, "w") as baselineFile:
+            json.dump(result, baselineFile, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as baselineFile:
+            baseline = json.load(baselineFile)
+        passed = compareBaseline(result, baseline, args.tolerance) and passed
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
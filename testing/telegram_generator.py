@@ -0,0 +1,181 @@
+import random
+from typing import List
+from sml_encoder import (
+    DEFAULT_OBIS_ENTRIES,
+    DEFAULT_SERVER_ID,
+    encodeOctetString,
+    encodeUnsigned,
+    encodeInteger,
+    encodeList,
+    encodeSecIndex,
+    encodeMessage,
+    encodeFrame,
+)
+
+# known OBIS keys with unit code and scaler, the F group is added as ff
+GENERATOR_OBIS_ENTRIES = DEFAULT_OBIS_ENTRIES
+
+LAYOUT_BZ_PLUS_3 = "BZPlus3"
+LAYOUT_EBZ_DD3 = "eBZ_DD3_DD3BZ06DTA_SMZ1"
+LAYOUTS = [LAYOUT_BZ_PLUS_3, LAYOUT_EBZ_DD3]
+
+SERVER_ID = DEFAULT_SERVER_ID
+
+
+def encodeValListEntry(layout: str, obisKey: str, unit: int, scaler: int, value: int, seconds: int, first: bool):
+    objName = encodeOctetString(bytes.fromhex(obisKey + "ff"))
+    if layout == LAYOUT_BZ_PLUS_3:
+        if obisKey == "0100100700":
+            # current power without time, see the additional value index of the BZPlus3 profile
+            status = encodeOctetString(None)
+            valTime = encodeOctetString(None)
+        else:
+            status = encodeUnsigned(0x001C2104, 4) if first else encodeOctetString(None)
+            valTime = encodeSecIndex(seconds)
+    else:
+        status = encodeOctetString(None)
+        valTime = encodeOctetString(None)
+    return encodeList(
+        [
+            objName,
+            status,
+            valTime,
+            encodeUnsigned(unit, 1),
+            encodeInteger(scaler, 1),
+            encodeInteger(value, 8) if scaler == 0 else encodeUnsigned(value, 8),
+            encodeOctetString(None),
+        ]
+    )
+
+
+def generateTelegram(
+    layout: str = LAYOUT_BZ_PLUS_3,
+    obisCount: int = 7,
+    transactionId: int = 0,
+    seconds: int = 0,
+    publicKey: bytes = None,
+    rng: random.Random = None,
+):
+    """
+    Build a complete SML frame with open, get list and close response messages.
+    publicKey adds the long octet string entry 8181c78205.
+    """
+    rng = rng if rng is not None else random.Random(transactionId)
+    entries = [
+        encodeValListEntry(layout, obisKey, unit, scaler, rng.randrange(0, 1 << 31), seconds, index == 0)
+        for index, (obisKey, unit, scaler) in enumerate(GENERATOR_OBIS_ENTRIES[:obisCount])
+    ]
+    entries.insert(
+        0,
+        encodeList(
+            [
+                encodeOctetString(bytes.fromhex("0100000009ff")),
+                encodeOctetString(None),
+                encodeOctetString(None),
+                encodeOctetString(None),
+                encodeOctetString(None),
+                encodeOctetString(SERVER_ID),
+                encodeOctetString(None),
+            ]
+        ),
+    )
+    if publicKey is not None:
+        entries.append(
+            encodeList(
+                [
+                    encodeOctetString(bytes.fromhex("8181c78205ff")),
+                    encodeOctetString(None),
+                    encodeOctetString(None),
+                    encodeOctetString(None),
+                    encodeOctetString(None),
+                    encodeOctetString(publicKey),
+                    encodeOctetString(None),
+                ]
+            )
+        )
+
+    openResponse = encodeList(
+        [
+            encodeUnsigned(0x0101, 2),
+            encodeList(
+                [
+                    encodeOctetString(None),
+                    encodeOctetString(None),
+                    encodeOctetString(transactionId.to_bytes(4, "big")),
+                    encodeOctetString(SERVER_ID),
+                    encodeOctetString(None),
+                    encodeOctetString(None),
+                ]
+            ),
+        ]
+    )
+    getListResponse = encodeList(
+        [
+            encodeUnsigned(0x0701, 2),
+            encodeList(
+                [
+                    encodeOctetString(None),
+                    encodeOctetString(SERVER_ID),
+                    encodeOctetString(bytes.fromhex("0100620affff")),
+                    encodeSecIndex(seconds),
+                    encodeList(entries),
+                    encodeOctetString(None),
+                    encodeOctetString(None),
+                ]
+            ),
+        ]
+    )
+    closeResponse = encodeList([encodeUnsigned(0x0201, 2), encodeList([encodeOctetString(None)])])
+    return encodeFrame(
+        [
+            encodeMessage(transactionId * 3, 0, openResponse),
+            encodeMessage(transactionId * 3 + 1, 0, getListResponse),
+            encodeMessage(transactionId * 3 + 2, 0, closeResponse),
+        ]
+    )
+
+
+def corruptTelegram(telegram: bytes, rng: random.Random, bitErrors: int = 1):
+    corrupted = bytearray(telegram)
+    for _ in range(bitErrors):
+        corrupted[rng.randrange(len(corrupted))] ^= 1 << rng.randrange(8)
+    return bytes(corrupted)
+
+
+def truncateTelegram(telegram: bytes, rng: random.Random):
+    return telegram[: rng.randrange(1, len(telegram))]
+
+
+def generateCorpus(
+    count: int,
+    layouts: List[str] = LAYOUTS,
+    obisCounts: List[int] = [7, 12, len(GENERATOR_OBIS_ENTRIES)],
+    publicKeyRatio: float = 0.5,
+    corruptRatio: float = 0.05,
+    truncateRatio: float = 0.02,
+    seed: int = 1,
+):
+    """
+    Generate a list of (layout, telegram bytes, valid) of several meters.
+    """
+    rng = random.Random(seed)
+    publicKey = bytes(rng.randrange(256) for _ in range(48))
+    corpus = []
+    for index in range(count):
+        layout = layouts[index % len(layouts)]
+        telegram = generateTelegram(
+            layout,
+            obisCounts[(index // len(layouts)) % len(obisCounts)],
+            transactionId=index,
+            seconds=index * 2,
+            publicKey=publicKey if rng.random() < publicKeyRatio else None,
+            rng=rng,
+        )
+        chance = rng.random()
+        if chance < corruptRatio:
+            corpus.append((layout, corruptTelegram(telegram, rng), False))
+        elif chance < corruptRatio + truncateRatio:
+            corpus.append((layout, truncateTelegram(telegram, rng), False))
+        else:
+            corpus.append((layout, telegram, True))
+    return corpus
@@ -0,0 +1,127 @@
+import copy
+import pytest
+import queue
+import threading
+from meter_obis_value_index import findMeterConfiguration
+from meter_pipeline import MeterPipeline, QUEUE_POLICY_BLOCK
+from sml_encoder import SmlTelegramEncoder
+from sml_message_cache import SmlMessageCache
+from sml_metrics import MetricsRegistry
+from write_data import WriteData
+
+
+class FakeSerial:
+    """
+    Serial device which returns the queued chunks, an empty read is a timeout.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.port = "fake"
+        self.chunks = queue.Queue()
+        self.in_waiting = 0
+
+    def read(self, size: int = 1):
+        try:
+            return self.chunks.get(timeout=0.05)
+        except queue.Empty:
+            return b""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class CollectingWriter(WriteData):
+    def __init__(self):
+        super().__init__()
+        self.telegrams = []
+        self.changed = threading.Condition()
+
+    def writeData(self, data):
+        with self.changed:
+            self.telegrams.append(data)
+            self.changed.notify_all()
+
+    def waitFor(self, count: int):
+        with self.changed:
+            return self.changed.wait_for(lambda: len(self.telegrams) >= count, timeout=10)
+
+
+def energyValues(writer: CollectingWriter):
+    return [entry.baseValue for telegram in writer.telegrams for entry in telegram if entry.obis == "0100010800"]
+
+
+def startPipeline(meterProperties):
+    serialDevice = FakeSerial()
+    writer = CollectingWriter()
+    pipeline = MeterPipeline(
+        lambda: serialDevice, writer, meterProperties, queuePolicy=QUEUE_POLICY_BLOCK, reconnectDelay=0
+    )
+    pipeline.start()
+    return pipeline, serialDevice, writer
+
+
+def test_telegrams_are_written_in_order():
+    meterProperties = findMeterConfiguration("BZPlus3")
+    encoder = SmlTelegramEncoder(meterProperties)
+    pipeline, serialDevice, writer = startPipeline(meterProperties)
+    stream = b"".join(encoder.encode({"0100010800": 1000 + index}, index) for index in range(100))
+    # split the telegrams across chunks like the bursts of the serial port
+    for start in range(0, len(stream), 97):
+        serialDevice.chunks.put(stream[start : start + 97])
+
+    assert writer.waitFor(100)
+    pipeline.stop()
+    pipeline.join()
+    assert energyValues(writer) == list(range(1000, 1100))
+
+
+def test_reloaded_sml_config_reaches_the_frame_decoder():
+    meterProperties = findMeterConfiguration("BZPlus3")
+    meterProperties.smlConfig.crcCheck = False
+    encoder = SmlTelegramEncoder(meterProperties)
+    pipeline, serialDevice, writer = startPipeline(meterProperties)
+    serialDevice.chunks.put(encoder.encode({"0100010800": 1000}, 1))
+    assert writer.waitFor(1)
+
+    # reload with the crc check enabled, a frame with a wrong frame checksum is dropped
+    reloadedConfig = copy.copy(meterProperties.smlConfig)
+    reloadedConfig.crcCheck = True
+    meterProperties.smlConfig = reloadedConfig
+    telegram = bytearray(encoder.encode({"0100010800": 1001}, 2))
+    telegram[-1] ^= 0xFF
+    serialDevice.chunks.put(bytes(telegram))
+    serialDevice.chunks.put(encoder.encode({"0100010800": 1002}, 3))
+
+    assert writer.waitFor(2)
+    pipeline.stop()
+    pipeline.join()
+    assert energyValues(writer) == [1000, 1002]
+    assert pipeline.stats.frameCrcErrorCount == 1
+
+
+@pytest.mark.parametrize("messageCache", [False, True])
+def test_decode_time_is_measured_with_and_without_message_cache(messageCache):
+    meterProperties = findMeterConfiguration("BZPlus3")
+    if messageCache:
+        meterProperties.messageCache = SmlMessageCache()
+    encoder = SmlTelegramEncoder(meterProperties)
+    serialDevice = FakeSerial()
+    writer = CollectingWriter()
+    metrics = MetricsRegistry()
+    pipeline = MeterPipeline(
+        lambda: serialDevice, writer, meterProperties, queuePolicy=QUEUE_POLICY_BLOCK, metrics=metrics
+    )
+    pipeline.start()
+    for index in range(3):
+        serialDevice.chunks.put(encoder.encode({"0100010800": 1000}, index))
+    assert writer.waitFor(3)
+    pipeline.stop()
+    pipeline.join()
+
+    assert pipeline.decodeSeconds.count == 3
+    assert pipeline.mapSeconds.count == (0 if messageCache else 3)
+    assert "sml_decode_seconds_count 3" in metrics.render()
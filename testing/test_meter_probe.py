@@ -0,0 +1,70 @@
+import json
+import random
+from meter_obis_value_index import findMeterConfiguration
+from meter_probe import probeData
+from meter_profile import compileMeterProfile
+from sml_block_maper import mapSmlBlocksObisEntry
+from sml_encoder import SmlTelegramEncoder, MeterValueGenerator, DEFAULT_SERVER_ID
+from sml_frame_decoder import SmlFrameDecoder
+from sml_step_reader import encodeSmlFrame
+
+
+def createCapture(meterProperties, count: int = 5):
+    encoder = SmlTelegramEncoder(meterProperties)
+    generator = MeterValueGenerator(rng=random.Random(2))
+    # the capture starts in the middle of a telegram
+    telegrams = [encoder.encode(generator.nextValues(), index, seconds=index) for index in range(count)]
+    return telegrams[0][37:] + b"".join(telegrams[1:])
+
+
+def mapCapture(capture: bytes, meterProperties):
+    entries = []
+    for frame in SmlFrameDecoder(meterProperties.smlConfig).feed(capture):
+        smlBlocks = encodeSmlFrame(frame, meterProperties.smlConfig)
+        for entry in mapSmlBlocksObisEntry(smlBlocks, meterProperties):
+            entries.append((entry.obis, entry.value, entry.unit))
+    return entries
+
+
+def test_probed_profile_maps_like_the_meter_profile():
+    meterProperties = findMeterConfiguration("BZPlus3")
+    capture = createCapture(meterProperties)
+    profile = probeData(capture, "BZPlus3")
+
+    assert profile["name"] == "BZPlus3"
+    assert profile["sml"]["startEscapeSequence"] == "1b1b1b1b"
+    defaultIndex = meterProperties.defaultValueIndex
+    assert (profile["index"]["obis"], profile["index"]["unit"]) == (
+        defaultIndex.obisIndex,
+        defaultIndex.unitIndex,
+    )
+    assert (profile["index"]["scaler"], profile["index"]["value"]) == (
+        defaultIndex.scalerIndex,
+        defaultIndex.valueIndex,
+    )
+    # the other entries are sent with a secIndex time as child block, the power and the server id
+    # have the time in the list, only their different positions are in the overrides
+    powerIndex = meterProperties.getObisValueIndexFor("0100100700")
+    assert profile["obis"]["0100100700"]["index"]["value"] == powerIndex.valueIndex
+    assert profile["obis"]["0100100700"]["index"]["time"] == 2
+    assert set(profile["obis"]) == {"0100100700", "0100000009"}
+
+    # the profile is written as JSON and maps the capture to the same values
+    probedProperties = compileMeterProfile(json.loads(json.dumps(profile)))
+    entries = mapCapture(capture, probedProperties)
+    assert len(entries) == 4 * 23
+    # the shipped profile reads the server id at the position of the other entries
+    assert [entry for entry in entries if entry[0] != "0100000009"] == [
+        entry for entry in mapCapture(capture, meterProperties) if entry[0] != "0100000009"
+    ]
+    assert {entry[1] for entry in entries if entry[0] == "0100000009"} == {DEFAULT_SERVER_ID.hex()}
+
+
+def test_capture_without_frames():
+    assert probeData(b"\x00\x01\x02" * 100) is None
+    meterProperties = findMeterConfiguration("BZPlus3")
+    capture = bytearray(SmlTelegramEncoder(meterProperties).encode({"0100010800": 1}))
+    capture[-1] ^= 0xFF
+    # the frame checksum is wrong, without crc check the frame is used
+    assert probeData(bytes(capture)) is None
+    assert probeData(bytes(capture), crcCheck=False) is not None
@@ -0,0 +1,129 @@
+import json
+import os
+import pytest
+import meter_profile
+from meter_profile import compileMeterProfile, loadMeterProfile, profileCachePath
+from sml_entry_filter import createEntryFilter
+from sml_message_cache import SmlMessageCache
+
+PROFILE = {
+    "sml": {"lazyHex": True},
+    "index": {"obis": 0, "unit": 2, "scaler": 3, "value": 4},
+    "filter": {"maxSilence": 300},
+    "obis": {
+        "0100100700": {
+            "index": {"unit": 3, "scaler": 4, "value": 5},
+            "filter": {"absoluteDeadband": 5, "minInterval": 1},
+        },
+        "0100010800": {"scaler": 0.1, "unit": "Wh", "name": "energy", "exact": True},
+        # only a filter rule, the default index is used
+        "0100020800": {"filter": {"relativeDeadband": 0.01}},
+    },
+}
+
+
+def test_compile_profile():
+    meterProperties = compileMeterProfile(PROFILE)
+    assert meterProperties.smlConfig.lazyHex
+
+    defaultIndex = meterProperties.getObisValueIndexFor("0100000009")
+    assert (defaultIndex.obisIndex, defaultIndex.unitIndex, defaultIndex.scalerIndex) == (0, 2, 3)
+    assert defaultIndex.valueIndex == 4
+    assert defaultIndex.manualScaler is None and defaultIndex.statusIndex == -1
+
+    # the override is merged with the default index
+    powerIndex = meterProperties.getObisValueIndexFor("0100100700")
+    assert (powerIndex.obisIndex, powerIndex.unitIndex, powerIndex.scalerIndex) == (0, 3, 4)
+    assert powerIndex.valueIndex == 5
+
+    # the factor of older profiles is the power of ten, the unit name is the SML unit code
+    energyIndex = meterProperties.getObisValueIndexFor("0100010800")
+    assert (energyIndex.manualScaler, energyIndex.manualUnit) == (-1, 30)
+    assert energyIndex.publishName == "energy" and energyIndex.exactValue
+
+    assert meterProperties.getObisValueIndexFor("0100020800") is meterProperties.defaultValueIndex
+    assert meterProperties.defaultFilterRule.maxSilence == 300
+    assert meterProperties.filterRules["0100100700"].absoluteDeadband == 5
+    assert meterProperties.filterRules["0100020800"].relativeDeadband == 0.01
+
+
+@pytest.mark.parametrize(
+    "profile",
+    [
+        {"index": {"values": 4}},
+        {"unit": "furlong"},
+        {"scaler": 0.3},
+        {"obis": {"0100010800": {"scaler": "x"}}},
+    ],
+)
+def test_invalid_profile(profile):
+    with pytest.raises(ValueError):
+        compileMeterProfile(profile)
+
+
+def writeProfile(profilePath, profile: dict):
+    with open(profilePath, "w", encoding="utf-8") as profileFile:
+        json.dump(profile, profileFile)
+
+
+def test_compiled_profile_is_cached(tmp_path, monkeypatch):
+    compiledProfiles = []
+
+    def compileProfile(profile):
+        compiledProfiles.append(profile)
+        return compileMeterProfile(profile)
+
+    monkeypatch.setattr(meter_profile, "compileMeterProfile", compileProfile)
+    profilePath = str(tmp_path / "meter.json")
+    writeProfile(profilePath, dict(PROFILE, scaler=-1))
+
+    assert loadMeterProfile(profilePath).defaultValueIndex.manualScaler == -1
+    assert os.path.isfile(profileCachePath(profilePath))
+    assert loadMeterProfile(profilePath).defaultValueIndex.manualScaler == -1
+    assert len(compiledProfiles) == 1
+
+    # same size, new modification time
+    writeProfile(profilePath, dict(PROFILE, scaler=-2))
+    fileStat = os.stat(profilePath)
+    os.utime(profilePath, ns=(fileStat.st_atime_ns, fileStat.st_mtime_ns + 1000000000))
+    assert loadMeterProfile(profilePath).defaultValueIndex.manualScaler == -2
+    assert len(compiledProfiles) == 2
+
+    # same modification time, new size
+    fileStat = os.stat(profilePath)
+    writeProfile(profilePath, dict(PROFILE, scaler=-10))
+    os.utime(profilePath, ns=(fileStat.st_atime_ns, fileStat.st_mtime_ns))
+    assert loadMeterProfile(profilePath).defaultValueIndex.manualScaler == -10
+    assert len(compiledProfiles) == 3
+
+    # a broken cache file is compiled again
+    with open(profileCachePath(profilePath), "wb") as cacheFile:
+        cacheFile.write(b"broken")
+    assert loadMeterProfile(profilePath).defaultValueIndex.manualScaler == -10
+    assert len(compiledProfiles) == 4
+    assert loadMeterProfile(profilePath, useCache=False).defaultValueIndex.manualScaler == -10
+    assert len(compiledProfiles) == 5
+
+
+def test_update_from_reloaded_profile():
+    meterProperties = compileMeterProfile(PROFILE)
+    meterProperties.smlConfig.crcCheck = False
+    meterProperties.messageCache = SmlMessageCache()
+    meterProperties.messageCache.put(b"key", None, [])
+    meterProperties.extractionPlans[(1,)] = [object()]
+    entryFilter = createEntryFilter(meterProperties)
+    defaultRule = meterProperties.defaultFilterRule
+
+    reloaded = dict(PROFILE, filter={"maxSilence": 60}, obis={"0100100700": {"scaler": -2}})
+    meterProperties.updateFrom(compileMeterProfile(reloaded))
+
+    # the crc setting of the command line is kept, the readers see the new profile
+    assert meterProperties.smlConfig.crcCheck is False
+    assert meterProperties.getObisValueIndexFor("0100100700").manualScaler == -2
+    # the filter keeps its references to the rules
+    assert meterProperties.defaultFilterRule is defaultRule
+    assert entryFilter.defaultRule.maxSilence == 60
+    assert entryFilter.rules is meterProperties.filterRules
+    assert entryFilter.rules == dict()
+    assert meterProperties.extractionPlans == dict()
+    assert len(meterProperties.messageCache) == 0
@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+import pytest
+from meter_serial import TERMIOS_VMIN, RawSerial, SerialProperties, termios
+
+pty = pytest.importorskip("pty")
+tty = pytest.importorskip("tty")
+pytestmark = pytest.mark.skipif(termios is None, reason="termios not available")
+
+
+@pytest.fixture
+def ptyPair():
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    yield master, os.ttyname(slave)
+    os.close(master)
+    os.close(slave)
+
+
+def writeParts(master: int, data: bytes, parts: int, pause: float):
+    size = len(data) // parts + 1
+    for start in range(0, len(data), size):
+        os.write(master, data[start : start + size])
+        time.sleep(pause)
+
+
+def test_burst_of_several_writes_is_one_read(ptyPair):
+    master, device = ptyPair
+    burst = bytes(range(TERMIOS_VMIN - 4))
+    with RawSerial(SerialProperties(devicePath=device, timeout=2.0, burstGap=0.3)) as rawSerial:
+        # the pauses between the writes are shorter than the burst gap (VTIME)
+        sender = threading.Thread(target=writeParts, args=(master, burst, 4, 0.03))
+        sender.start()
+        assert rawSerial.read() == burst
+        sender.join()
+
+
+def test_long_burst_is_read_in_few_reads(ptyPair):
+    master, device = ptyPair
+    burst = bytes(range(256)) * 4
+    with RawSerial(SerialProperties(devicePath=device, timeout=2.0, burstGap=0.2)) as rawSerial:
+        sender = threading.Thread(target=writeParts, args=(master, burst, 4, 0.03))
+        sender.start()
+        chunks = []
+        while sum(len(chunk) for chunk in chunks) < len(burst):
+            chunk = rawSerial.read()
+            assert len(chunk) > 0
+            chunks.append(chunk)
+        sender.join()
+    assert b"".join(chunks) == burst
+    # at least VMIN bytes per read, not single bytes
+    assert len(chunks) <= len(burst) // TERMIOS_VMIN
+
+
+def test_read_returns_after_timeout_without_data(ptyPair):
+    _, device = ptyPair
+    with RawSerial(SerialProperties(devicePath=device, timeout=0.3)) as rawSerial:
+        start = time.monotonic()
+        assert rawSerial.read() == b""
+        elapsed = time.monotonic() - start
+    assert 0.25 <= elapsed < 1.0
+
+
+def test_timeout_zero_reads_without_blocking(ptyPair):
+    master, device = ptyPair
+    with RawSerial(SerialProperties(devicePath=device, timeout=0)) as rawSerial:
+        start = time.monotonic()
+        assert rawSerial.read() == b""
+        assert time.monotonic() - start < 0.1
+        os.write(master, b"\x1b\x1b\x1b\x1b")
+        deadline = time.monotonic() + 1
+        while rawSerial.in_waiting < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert rawSerial.read() == b"\x1b\x1b\x1b\x1b"
+
+
+def test_readable_port_without_data_raises(ptyPair, monkeypatch):
+    master, device = ptyPair
+    with RawSerial(SerialProperties(devicePath=device, timeout=1.0)) as rawSerial:
+        os.write(master, b"\x1b")
+        # a hung up tty is readable and returns no data
+        monkeypatch.setattr(os, "read", lambda fd, size: b"")
+        with pytest.raises(OSError):
+            rawSerial.read()
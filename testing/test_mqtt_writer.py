@@ -0,0 +1,111 @@
+import json
+import pytest
+import write_data
+from sml_block_maper import SmlEntry
+from write_data import MqttDataWriter, MQTT_MODE_CHANGED, MQTT_MODE_TELEGRAM
+from testing.fake_mqtt import FakeBroker, createFakeMqttModule
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = FakeBroker()
+    monkeypatch.setattr(write_data, "mqtt", createFakeMqttModule(broker))
+    return broker
+
+
+def createTelegram(energy: int = 51843481, power: int = 230):
+    return [
+        SmlEntry("0100010800", None, None, 30, -1, energy, None),
+        SmlEntry("0100100700", None, None, 27, 0, power, None),
+    ]
+
+
+def test_connects_once_for_all_telegrams(broker):
+    writer = MqttDataWriter("localhost", 1883, "meter/grid/", 0)
+    for _ in range(3):
+        writer.writeData(createTelegram())
+
+    client = broker.clients[0]
+    assert len(broker.clients) == 1
+    assert client.address == ("localhost", 1883)
+    assert client.loopRunning
+    assert client.connectCount == 1
+    assert len(broker.messages) == 6
+    assert json.loads(broker.payloads("meter/grid/0100010800")[0]) == {"value": 5184348.1, "unit": "Wh"}
+    assert json.loads(broker.payloads("meter/grid/0100100700")[0]) == {"value": 230, "unit": "W"}
+
+    writer.close()
+    assert not client.loopRunning
+    assert not writer.connected
+
+
+def test_reconnect_delivers_queued_messages(broker):
+    writer = MqttDataWriter("localhost", 1883, "meter/grid/", 1, minReconnectDelay=2, maxReconnectDelay=60)
+    writer.writeData(createTelegram())
+    client = broker.clients[0]
+    assert client.reconnectDelay == (2, 60)
+
+    client.dropConnection()
+    assert not writer.connected
+    writer.writeData(createTelegram(power=250))
+    assert len(broker.messages) == 2
+
+    broker.reachable = True
+    client.reconnect()
+    assert writer.connected
+    assert client.connectCount == 2
+    assert len(broker.messages) == 4
+    assert json.loads(broker.payloads("meter/grid/0100100700")[-1])["value"] == 250
+    writer.close()
+
+
+def test_queue_limit_drops_messages(broker):
+    broker.reachable = False
+    writer = MqttDataWriter("localhost", 1883, "meter/grid/", 0, maxQueuedMessages=3)
+    writer.writeData(createTelegram())
+    writer.writeData(createTelegram())
+    writer.writeData(createTelegram())
+
+    client = broker.clients[0]
+    assert client.maxQueuedMessages == 3
+    assert len(client.queue) == 3
+    assert writer.droppedMessages == 3
+
+    broker.reachable = True
+    client.reconnect()
+    assert len(broker.messages) == 3
+    writer.close()
+
+
+def test_telegram_mode_publishes_one_document(broker):
+    writer = MqttDataWriter("localhost", 1883, "meter/grid/", 0, mode=MQTT_MODE_TELEGRAM)
+    writer.writeData(createTelegram())
+
+    assert len(broker.messages) == 1
+    topic, payload, _ = broker.messages[0]
+    assert topic == "meter/grid"
+    assert json.loads(payload) == {
+        "0100010800": {"value": 5184348.1, "unit": "Wh"},
+        "0100100700": {"value": 230, "unit": "W"},
+    }
+    writer.close()
+
+
+def test_changed_mode_publishes_changed_entries(broker):
+    writer = MqttDataWriter("localhost", 1883, "meter/grid/", 0, mode=MQTT_MODE_CHANGED)
+    writer.writeData(createTelegram())
+    writer.writeData(createTelegram())
+    assert len(broker.messages) == 2
+
+    writer.writeData(createTelegram(power=240))
+    assert len(broker.messages) == 3
+    assert broker.messages[-1][0] == "meter/grid/0100100700"
+    writer.close()
+
+
+def test_entry_mode_publishes_every_telegram(broker):
+    writer = MqttDataWriter("localhost", 1883, "meter/grid/", 0)
+    writer.writeData(createTelegram())
+    writer.writeData(createTelegram())
+    assert len(broker.payloads("meter/grid/0100100700")) == 2
+    writer.close()
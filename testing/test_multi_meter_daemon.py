@@ -0,0 +1,224 @@
+import asyncio
+import os
+import pytest
+import sqlite3
+import threading
+import time
+from meter_obis_value_index import findMeterConfiguration
+from meter_serial import SERIAL_BACKEND_PYSERIAL, SERIAL_BACKEND_TERMIOS, termios
+from multi_meter_daemon import closeMeterPorts, createMeterPorts, runMeterPorts
+from sml_block_maper import SmlEntry
+from sml_encoder import SmlTelegramEncoder
+from sml_frame_decoder import SmlFrameDecoder
+from sml_metrics import MetricsRegistry
+from write_data import WriteData
+
+pty = pytest.importorskip("pty")
+tty = pytest.importorskip("tty")
+
+
+class CollectingWriter(WriteData):
+    def __init__(self):
+        super().__init__()
+        self.telegrams = []
+
+    def writeData(self, data):
+        self.telegrams.append(data)
+
+
+def openPty():
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    return master, slave, os.ttyname(slave)
+
+
+def writeSplit(master: int, telegram: bytes, parts: int):
+    """
+    Write the telegram in several parts with pauses, like a meter which sends in bursts.
+    """
+    size = len(telegram) // parts + 1
+    for start in range(0, len(telegram), size):
+        os.write(master, telegram[start : start + size])
+        time.sleep(0.02)
+
+
+@pytest.mark.parametrize("backend", [SERIAL_BACKEND_PYSERIAL, SERIAL_BACKEND_TERMIOS])
+def test_reads_telegrams_split_across_writes(backend):
+    if backend == SERIAL_BACKEND_PYSERIAL:
+        pytest.importorskip("serial")
+    elif termios is None:
+        pytest.skip("termios not available")
+    meters = [openPty() for _ in range(2)]
+    encoder = SmlTelegramEncoder(findMeterConfiguration("BZPlus3"))
+    writer = CollectingWriter()
+    config = {"meters": [{"device": device, "meter": "BZPlus3", "backend": backend} for _, _, device in meters]}
+    meterPorts, _ = createMeterPorts(config, writer)
+
+    def sendTelegrams():
+        for index in range(3):
+            for meterIndex, (master, _, _) in enumerate(meters):
+                writeSplit(master, encoder.encode({"0100010800": 1000 * meterIndex + index}, index), 4)
+
+    async def readUntilComplete():
+        stopEvent = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        async def stopWhenComplete():
+            deadline = time.monotonic() + 10
+            while len(writer.telegrams) < 6 and time.monotonic() < deadline:
+                await asyncio.sleep(0.02)
+            stopEvent.set()
+
+        async def sendWhenOpen():
+            # pyserial flushes the input of the port when it is opened
+            while any(meterPort.serialDevice is None for meterPort in meterPorts):
+                await asyncio.sleep(0.01)
+            await loop.run_in_executor(None, sendTelegrams)
+
+        await asyncio.gather(runMeterPorts(meterPorts, stopEvent), stopWhenComplete(), sendWhenOpen())
+
+    try:
+        asyncio.run(readUntilComplete())
+    finally:
+        for master, slave, _ in meters:
+            os.close(master)
+            os.close(slave)
+
+    energyValues = sorted(
+        entry.baseValue for telegram in writer.telegrams for entry in telegram if entry.obis == "0100010800"
+    )
+    assert energyValues == [0, 1, 2, 1000, 1001, 1002]
+    for meterPort in meterPorts:
+        assert meterPort.stats.frameCount == 3
+        assert meterPort.stats.droppedFrameCount == 0
+
+
+class ClosingWriter(CollectingWriter):
+    def __init__(self):
+        super().__init__()
+        self.closeCount = 0
+
+    def close(self):
+        self.closeCount += 1
+
+
+def test_open_windows_are_written_on_close():
+    writer = ClosingWriter()
+    config = {
+        "meters": [
+            {"device": "/dev/null", "meter": "BZPlus3", "name": "grid", "aggregate": 60},
+            {"device": "/dev/null", "meter": "BZPlus3", "name": "heat", "aggregate": 60, "filter": True},
+        ]
+    }
+    meterPorts, sharedWriter = createMeterPorts(config, writer)
+    for meterPort in meterPorts:
+        meterPort.writer.writeData([SmlEntry("0100100700", None, None, 27, 0, 230, None)])
+    assert writer.telegrams == []
+
+    closeMeterPorts(meterPorts, sharedWriter)
+    assert [[entry.count for entry in telegram] for telegram in writer.telegrams] == [[1], [1]]
+    assert writer.closeCount == 1
+
+
+class FailingWriter(WriteData):
+    def writeData(self, data):
+        raise OSError("No space left on device")
+
+
+class ChunkSerial:
+    def __init__(self, chunk: bytes):
+        self.chunk = chunk
+        self.in_waiting = len(chunk)
+
+    def read(self, size: int = 1):
+        return self.chunk
+
+
+def test_failed_write_keeps_the_port_open():
+    metrics = MetricsRegistry()
+    config = {"meters": [{"device": "/dev/null", "meter": "BZPlus3"}]}
+    meterPorts, _ = createMeterPorts(config, FailingWriter(), metrics)
+    meterPort = meterPorts[0]
+    encoder = SmlTelegramEncoder(meterPort.meterProperties)
+    loop = asyncio.new_event_loop()
+    try:
+        meterPort.failed = loop.create_future()
+        meterPort.decoder = SmlFrameDecoder(meterPort.meterProperties.smlConfig, stats=meterPort.stats)
+        for index in range(2):
+            meterPort.serialDevice = ChunkSerial(encoder.encode({"0100010800": index}, index))
+            meterPort.onReadable()
+        assert not meterPort.failed.done()
+        assert meterPort.stats.frameCount == 2
+        assert meterPort.publishErrors.value == 2
+
+        # a read error still fails the port
+        meterPort.serialDevice = None
+        meterPort.onReadable()
+        assert isinstance(meterPort.failed.exception(), AttributeError)
+    finally:
+        loop.close()
+
+
+def test_empty_read_of_a_readable_port_fails_the_port():
+    meterPorts, _ = createMeterPorts({"meters": [{"device": "/dev/null", "meter": "BZPlus3"}]}, WriteData())
+    meterPort = meterPorts[0]
+    loop = asyncio.new_event_loop()
+    try:
+        meterPort.failed = loop.create_future()
+        meterPort.decoder = SmlFrameDecoder(meterPort.meterProperties.smlConfig, stats=meterPort.stats)
+        meterPort.serialDevice = ChunkSerial(b"")
+        meterPort.onReadable()
+        assert isinstance(meterPort.failed.exception(), OSError)
+    finally:
+        loop.close()
+
+
+class ThreadRecordingWriter(WriteData):
+    def __init__(self, writer: WriteData):
+        super().__init__()
+        self.writer = writer
+        self.threads = []
+
+    def writeData(self, data):
+        self.threads.append(threading.current_thread())
+        self.writer.writeData(data)
+
+    def close(self):
+        self.writer.close()
+
+
+def test_sqlite_writes_are_not_run_on_the_event_loop(tmp_path):
+    databasePath = str(tmp_path / "meter.db")
+    config = {
+        "meters": [{"device": "/dev/null", "meter": "BZPlus3", "name": "grid"}],
+        "sqlite": {"path": databasePath},
+    }
+    meterPorts, sharedWriter = createMeterPorts(config)
+    meterPort = meterPorts[0]
+    recordingWriter = ThreadRecordingWriter(meterPort.writer)
+    meterPort.writer = recordingWriter
+    encoder = SmlTelegramEncoder(meterPort.meterProperties)
+    loop = asyncio.new_event_loop()
+    try:
+        meterPort.failed = loop.create_future()
+        meterPort.decoder = SmlFrameDecoder(meterPort.meterProperties.smlConfig, stats=meterPort.stats)
+        for index in range(3):
+            meterPort.serialDevice = ChunkSerial(encoder.encode({"0100010800": index}, index))
+            meterPort.onReadable()
+        assert not meterPort.failed.done()
+    finally:
+        loop.close()
+    # the queued writes are finished before the writers are closed
+    closeMeterPorts(meterPorts, sharedWriter)
+
+    assert len(recordingWriter.threads) == 3
+    assert threading.main_thread() not in recordingWriter.threads
+    connection = sqlite3.connect(databasePath)
+    try:
+        values = connection.execute(
+            "SELECT value FROM sample JOIN series ON series.id = sample.seriesId"
+            " WHERE series.meter = 'grid' AND series.obis = '0100010800' ORDER BY time"
+        ).fetchall()
+    finally:
+        connection.close()
+    assert [value for value, in values] == [0, 0.1, 0.2]
@@ -0,0 +1,100 @@
+from multi_meter_daemon import createMeterPorts
+from sml_aggregator import AggregateDataWriter, SmlAggregator
+from sml_block_maper import SmlEntry
+from sml_entry_filter import FilterDataWriter
+from write_data import WriteData
+
+
+class CollectingWriter(WriteData):
+    def __init__(self):
+        super().__init__()
+        self.entries = []
+
+    def writeData(self, data):
+        self.entries.extend(data)
+
+
+def test_aggregate_gets_every_telegram_with_filter():
+    writer = CollectingWriter()
+    config = {"meters": [{"device": "/dev/null", "meter": "BZPlus3", "aggregate": 60, "filter": True}]}
+    meterPorts, _ = createMeterPorts(config, writer)
+    meterWriter = meterPorts[0].writer
+    assert isinstance(meterWriter, AggregateDataWriter)
+    assert isinstance(meterWriter.writer, FilterDataWriter)
+
+    now = [600.0]
+    meterWriter.aggregator.clock = lambda: now[0]
+    # small changes of the power which the deadband filter would drop
+    powers = [230, 231, 230, 232, 231, 230, 229, 230, 231, 230]
+    for power in powers:
+        meterWriter.writeData([SmlEntry("0100100700", None, None, 27, 0, power, None)])
+        now[0] += 1
+    now[0] = 660.0
+    meterWriter.writeData([SmlEntry("0100100700", None, None, 27, 0, 230, None)])
+
+    assert len(writer.entries) == 1
+    summary = writer.entries[0]
+    assert summary.count == len(powers)
+    assert summary.value == sum(powers) / len(powers)
+    assert (summary.min, summary.max) == (229, 232)
+
+
+class Clock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def energy(baseValue: int):
+    return SmlEntry("0100010800", None, None, 30, -1, baseValue, None)
+
+
+def test_counter_delta_includes_the_step_between_windows():
+    clock = Clock(600.0)
+    aggregator = SmlAggregator(60, clock=clock)
+    for baseValue in (1000, 1003, 1007):
+        assert aggregator.addEntries([energy(baseValue)]) == []
+        clock.now += 10
+
+    clock.now = 660.0
+    summaries = aggregator.addEntries([energy(1010)])
+    # computed from the unscaled values, 100.7 - 100.0 of the scaled values is not 0.7
+    assert [summary.value for summary in summaries] == [0.7]
+    assert summaries[0].last == 100.7
+    aggregator.addEntries([energy(1012)])
+
+    clock.now = 720.0
+    summaries = aggregator.addEntries([energy(1013)])
+    # from the last value of the previous window 1007 to 1012
+    assert [summary.value for summary in summaries] == [0.5]
+
+
+def test_windows_are_aligned_to_the_clock():
+    clock = Clock(605.0)
+    aggregator = SmlAggregator(60, clock=clock)
+    aggregator.addEntries([SmlEntry("0100100700", None, None, 27, 0, 230, None)])
+    clock.now = 659.9
+    assert aggregator.addEntries([SmlEntry("0100100700", None, None, 27, 0, 232, None)]) == []
+
+    clock.now = 845.0
+    summaries = aggregator.addEntries([SmlEntry("0100100700", None, None, 27, 0, 240, None)])
+    assert [(summary.windowStart, summary.count, summary.value) for summary in summaries] == [(600.0, 2, 231)]
+    assert aggregator.windowStart == 840.0
+
+
+def test_open_window_is_flushed_on_close():
+    writer = CollectingWriter()
+    closed = []
+    writer.close = lambda: closed.append(True)
+    clock = Clock(600.0)
+    aggregateWriter = AggregateDataWriter(writer, SmlAggregator(60, clock=clock))
+    aggregateWriter.writeData([energy(1000), SmlEntry("0100100700", None, None, 27, 0, 230, None)])
+    clock.now = 630.0
+    aggregateWriter.writeData([energy(1004), SmlEntry("0100100700", None, None, 27, 0, 234, None)])
+    assert writer.entries == []
+
+    aggregateWriter.close()
+    assert [(summary.obis, summary.value) for summary in writer.entries] == [("0100010800", 0.4), ("0100100700", 232)]
+    assert closed == [True]
@@ -0,0 +1,71 @@
+import random
+import pytest
+from meter_obis_value_index import findMeterConfiguration
+import sml_batch_mapper
+from sml_batch_mapper import TelegramBatchMapper
+from sml_block_maper import compileObisExtractionPlan, mapSmlBlocksObisEntry
+from sml_encoder import SmlTelegramEncoder, MeterValueGenerator, DEFAULT_OBIS_ENTRIES
+from sml_frame_decoder import SmlFrameDecoder
+from sml_step_reader import encodeSmlFrame
+
+numpy = pytest.importorskip("numpy")
+
+
+def createTelegrams(meterProperties):
+    generator = MeterValueGenerator(rng=random.Random(11))
+    encoder = SmlTelegramEncoder(meterProperties)
+    telegrams = [encoder.encode(generator.nextValues(), index, seconds=index) for index in range(8)]
+    # fewer list entries, the telegram does not match the plan of the others
+    telegrams.insert(3, encoder.encode({"0100010800": 123, "0100100700": -45}, 100))
+    # the same shape with the OBIS keys in another order
+    reordered = SmlTelegramEncoder(meterProperties, list(reversed(DEFAULT_OBIS_ENTRIES)))
+    telegrams.insert(6, reordered.encode(generator.nextValues(), 101))
+    return telegrams
+
+
+def mapEntries(meterProperties, telegram: bytes):
+    """
+    SmlEntry values of the telegram with the generic mapping, the reference of the columns.
+    """
+    entries = []
+    for frame in SmlFrameDecoder(meterProperties.smlConfig).feed(telegram):
+        smlBlocks = encodeSmlFrame(frame, meterProperties.smlConfig)
+        entries.extend(mapSmlBlocksObisEntry(smlBlocks, meterProperties))
+    return entries
+
+
+def test_columns_match_the_entries(monkeypatch):
+    compiledPlans = []
+
+    def compilePlan(smlBlocks, meterProperties):
+        compiledPlans.append(compileObisExtractionPlan(smlBlocks, meterProperties))
+        return compiledPlans[-1]
+
+    monkeypatch.setattr(sml_batch_mapper, "compileObisExtractionPlan", compilePlan)
+    meterProperties = findMeterConfiguration("BZPlus3")
+    telegrams = createTelegrams(meterProperties)
+    timestamps = [1000.0 + index for index in range(len(telegrams))]
+    batchMapper = TelegramBatchMapper(meterProperties)
+    for telegram, timestamp in zip(telegrams, timestamps):
+        batchMapper.addTelegram(telegram, timestamp)
+    columns = batchMapper.finish()
+    # compiled for the first telegram, the two other layouts and the telegrams behind them
+    assert len(compiledPlans) == 5
+
+    expected = dict()
+    for telegramIndex, telegram in enumerate(telegrams):
+        for entry in mapEntries(meterProperties, telegram):
+            if isinstance(entry.baseValue, int):
+                expected.setdefault(entry.obis, []).append((telegramIndex, entry))
+    assert set(columns) == set(expected)
+    for obisKey, rows in expected.items():
+        obisColumns = columns[obisKey]
+        assert obisColumns.telegramIndexes.tolist() == [telegramIndex for telegramIndex, _ in rows]
+        assert obisColumns.timestamps.tolist() == [timestamps[telegramIndex] for telegramIndex, _ in rows]
+        assert obisColumns.rawValues.tolist() == [entry.baseValue for _, entry in rows]
+        assert obisColumns.scalers.tolist() == [entry.scaler for _, entry in rows]
+        assert obisColumns.units.tolist() == [entry.unitCode for _, entry in rows]
+        assert obisColumns.values.tolist() == [entry.value for _, entry in rows]
+    # the telegram with fewer entries only has rows of its keys
+    assert 3 in columns["0100010800"].telegramIndexes.tolist()
+    assert 3 not in columns["0100020800"].telegramIndexes.tolist()
@@ -0,0 +1,181 @@
+import json
+import pickle
+import pytest
+import random
+from decimal import Decimal
+from meter_obis_value_index import findMeterConfiguration
+from sml_block_maper import (
+    SCALER_POWERS,
+    SmlEntry,
+    applyObisExtractionPlan,
+    mapSmlBlockObisEntry,
+    mapSmlBlocksObisEntry,
+    scaleValue,
+    telegramShape,
+)
+import sml_block_maper
+from sml_encoder import SmlTelegramEncoder, MeterValueGenerator, DEFAULT_OBIS_ENTRIES
+from sml_frame_decoder import SmlFrameDecoder
+from sml_step_reader import SmlOctetString, encodeSmlFrame
+
+
+@pytest.mark.parametrize(
+    "baseValue, scaler, value",
+    [
+        (51843481, -1, 5184348.1),
+        (12345, -2, 123.45),
+        (7, -128, 7e-128),
+        (230, 0, 230.0),
+        (-230, 0, -230.0),
+        (23, 2, 2300.0),
+        (3, 127, 3e127),
+        # outside of the signed 8 bit range of SML
+        (5, 200, 5e200),
+        (5, -200, 5e-200),
+    ],
+)
+def test_scale_value(baseValue, scaler, value):
+    assert scaleValue(baseValue, scaler) == pytest.approx(value, rel=1e-15)
+
+
+def test_negative_scaler_divides_exactly():
+    # 51843481 * 0.1 is 5184348.100000001
+    assert scaleValue(51843481, -1) == 5184348.1
+    assert scaleValue(12345, -2) == 123.45
+    assert scaleValue(-1234, -3) == -1.234
+
+
+def test_scaler_powers_table():
+    assert len(SCALER_POWERS) == 256
+    assert SCALER_POWERS[128] == 1.0
+    assert SCALER_POWERS[0] == 1e128
+    assert SCALER_POWERS[255] == 1e127
+
+
+@pytest.mark.parametrize("scaler", [None, "ff", 0.1, b"\x01"])
+def test_non_int_scaler_is_zero(scaler):
+    entry = SmlEntry("0100100700", None, None, 27, scaler, 230, None)
+    assert entry.scaler == 0
+    assert entry.value == 230
+    assert entry.exactValue == Decimal(230)
+
+
+def test_exact_value():
+    assert SmlEntry("0100010800", None, None, 30, -1, 51843481, None).exactValue == Decimal("5184348.1")
+    assert SmlEntry("0100010800", None, None, 30, 3, 12, None).exactValue == Decimal("12000")
+    assert SmlEntry("0100010800", None, None, 30, -3, -1234, None).exactValue == Decimal("-1.234")
+    # octet strings are not scaled
+    assert SmlEntry("0100000009", None, None, None, -1, "0a01", None).exactValue == "0a01"
+    assert SmlEntry("0100000009", None, None, None, -1, "0a01", None).value == "0a01"
+
+
+def parseTelegram(meterProperties, telegram: bytes):
+    frames = list(SmlFrameDecoder(meterProperties.smlConfig).feed(telegram))
+    assert len(frames) == 1
+    return encodeSmlFrame(frames[0], meterProperties.smlConfig)
+
+
+def mapGeneric(smlBlocks, meterProperties):
+    return [
+        entry.__dict__ for smlBlock in smlBlocks for entry in mapSmlBlockObisEntry(smlBlock, meterProperties)
+    ]
+
+
+@pytest.mark.parametrize("meterKey", ["BZPlus3", "eBZ_DD3_DD3BZ06DTA_SMZ1"])
+def test_plan_maps_like_the_tree_search(meterKey):
+    meterProperties = findMeterConfiguration(meterKey)
+    encoder = SmlTelegramEncoder(meterProperties)
+    generator = MeterValueGenerator(rng=random.Random(1))
+    assert meterProperties.extractionPlans == dict()
+    for index in range(5):
+        telegram = encoder.encode(generator.nextValues(), index, seconds=index)
+        smlBlocks = parseTelegram(meterProperties, telegram)
+        entries = mapSmlBlocksObisEntry(smlBlocks, meterProperties)
+        [plan] = meterProperties.extractionPlans[telegramShape(smlBlocks)]
+        assert [entry.__dict__ for entry in entries] == mapGeneric(smlBlocks, meterProperties)
+        assert [entry.__dict__ for entry in applyObisExtractionPlan(plan, smlBlocks)] == [
+            entry.__dict__ for entry in entries
+        ]
+
+
+def test_plan_falls_back_when_the_shape_changes():
+    meterProperties = findMeterConfiguration("BZPlus3")
+    encoder = SmlTelegramEncoder(meterProperties)
+    values = {obisKey: 1000 + index for index, (obisKey, unit, scaler) in enumerate(DEFAULT_OBIS_ENTRIES)}
+    smlBlocks = parseTelegram(meterProperties, encoder.encode(values, 1))
+    mapSmlBlocksObisEntry(smlBlocks, meterProperties)
+    [plan] = meterProperties.extractionPlans[telegramShape(smlBlocks)]
+
+    # fewer list entries and the OBIS keys in another order
+    for telegram in [
+        encoder.encode({"0100010800": 5, "0100100700": 7}, 2),
+        SmlTelegramEncoder(meterProperties, list(reversed(DEFAULT_OBIS_ENTRIES))).encode(values, 3),
+    ]:
+        smlBlocks = parseTelegram(meterProperties, telegram)
+        assert applyObisExtractionPlan(plan, smlBlocks) is None
+        entries = mapSmlBlocksObisEntry(smlBlocks, meterProperties)
+        assert [entry.__dict__ for entry in entries] == mapGeneric(smlBlocks, meterProperties)
+        # the plan of the new layout is compiled
+        assert meterProperties.extractionPlans[telegramShape(smlBlocks)][-1] is not plan
+        plan = meterProperties.extractionPlans[telegramShape(smlBlocks)][-1]
+        assert [entry.__dict__ for entry in applyObisExtractionPlan(plan, smlBlocks)] == [
+            entry.__dict__ for entry in entries
+        ]
+
+
+def test_alternating_shapes_keep_their_plans(monkeypatch):
+    compiledShapes = []
+    compilePlan = sml_block_maper.compileObisExtractionPlan
+
+    def countingCompilePlan(smlBlocks, meterProperties):
+        compiledShapes.append(telegramShape(smlBlocks))
+        return compilePlan(smlBlocks, meterProperties)
+
+    monkeypatch.setattr(sml_block_maper, "compileObisExtractionPlan", countingCompilePlan)
+    meterProperties = findMeterConfiguration("BZPlus3")
+    encoder = SmlTelegramEncoder(meterProperties)
+    values = {obisKey: 1000 + index for index, (obisKey, unit, scaler) in enumerate(DEFAULT_OBIS_ENTRIES)}
+    telegrams = [encoder.encode(values, 1), encoder.encode({"0100010800": 5, "0100100700": 7}, 2)]
+    for index in range(6):
+        smlBlocks = parseTelegram(meterProperties, telegrams[index % 2])
+        entries = mapSmlBlocksObisEntry(smlBlocks, meterProperties)
+        assert [entry.__dict__ for entry in entries] == mapGeneric(smlBlocks, meterProperties)
+    # the telegrams have the same shape, both plans are kept and the layouts are not compiled again
+    assert len(compiledShapes) == 2
+    assert [len(plans) for plans in meterProperties.extractionPlans.values()] == [2]
+
+
+def test_entry_dict_json_output():
+    entry = SmlEntry("0100010800", None, None, 30, -1, 51843481, None)
+    assert list(json.loads(json.dumps(entry.__dict__)).items()) == [
+        ("obis", "0100010800"),
+        ("obisName", "Zählerstand Total"),
+        ("status", None),
+        ("time", None),
+        ("unit", "Wh"),
+        ("scaler", -1),
+        ("value", 5184348.1),
+        ("signature", None),
+    ]
+    # publish name of the profile and the unscaled value of exact entries
+    entry = SmlEntry("0100010800", None, None, 30, -1, 51843481, None, name="energy", exact=True)
+    payload = json.loads(json.dumps(entry.__dict__))
+    assert payload["obisName"] == "energy"
+    assert payload["rawValue"] == 51843481
+    # unknown unit codes have an empty unit
+    assert SmlEntry("0100100700", None, None, 250, 0, 5, None).__dict__["unit"] == ""
+
+
+def test_entry_pickle_round_trip():
+    entries = [
+        SmlEntry("0100100700", 1, 2, 27, 0, -230, None),
+        SmlEntry("0100010800", None, None, 30, -1, 51843481, "ff00", name="energy", exact=True),
+        SmlEntry("0100000009", None, None, None, None, SmlOctetString(b"\x0a\x01\x53"), None),
+    ]
+    for entry in entries:
+        copied = pickle.loads(pickle.dumps(entry))
+        assert type(copied) is SmlEntry
+        assert copied.__dict__ == entry.__dict__
+        for slot in SmlEntry.__slots__:
+            assert getattr(copied, slot) == getattr(entry, slot)
+    assert entries[2].baseValue == "0a0153"
@@ -0,0 +1,72 @@
+import random
+import pytest
+from meter_obis_value_index import findMeterConfiguration
+from sml_crc import checkFrameCrc, checkMessageCrc, crc16X25Batch, crc16X25Table, crc_hqx
+from sml_encoder import SmlTelegramEncoder, encodeFrame, encodeList, encodeMessage, encodeOctetString
+from sml_frame_decoder import SmlFrameDecoder, SmlReadStats
+from sml_step_reader import encodeSmlFrame
+
+CRC_FUNCTIONS = [crc16X25Table] + ([crc16X25Batch] if crc_hqx is not None else [])
+
+
+@pytest.mark.parametrize("crc16X25", CRC_FUNCTIONS)
+@pytest.mark.parametrize(
+    "data, crc",
+    [
+        (b"", 0x0000),
+        (b"123456789", 0x906E),
+        (b"\x00", 0xF078),
+        (b"\xff" * 4, 0x0F47),
+    ],
+)
+def test_known_answers(crc16X25, data, crc):
+    assert crc16X25(data) == crc
+
+
+def test_table_and_batch_agree():
+    if crc_hqx is None:
+        pytest.skip("binascii.crc_hqx not available")
+    rng = random.Random(7)
+    for size in list(range(64)) + [255, 256, 1024, 4099]:
+        data = bytes(rng.randrange(256) for _ in range(size))
+        assert crc16X25Batch(data) == crc16X25Table(data)
+        assert crc16X25Batch(memoryview(data)) == crc16X25Table(data)
+
+
+def decodeFrames(telegram: bytes, stats: SmlReadStats):
+    smlConfig = findMeterConfiguration("BZPlus3").smlConfig
+    smlConfig.crcCheck = True
+    return smlConfig, list(SmlFrameDecoder(smlConfig, stats=stats).feed(telegram))
+
+
+def test_frame_crc():
+    telegram = SmlTelegramEncoder(findMeterConfiguration("BZPlus3")).encode({"0100010800": 1234}, 1)
+    assert checkFrameCrc(telegram)
+    assert not checkFrameCrc(telegram[:1])
+
+    flipped = bytearray(telegram)
+    flipped[len(telegram) // 2] ^= 0x01
+    assert not checkFrameCrc(bytes(flipped))
+
+    stats = SmlReadStats()
+    _, frames = decodeFrames(bytes(flipped) + telegram, stats)
+    assert len(frames) == 1
+    assert stats.frameCrcErrorCount == 1
+
+
+def test_message_crc():
+    message = encodeMessage(7, 0, encodeList([encodeOctetString(b"\x01\x02")]))
+    # the checksum element is 0x63 with the CRC low byte first, followed by the end of message
+    checkSum = int.from_bytes(message[-3:-1], "big")
+    assert checkMessageCrc(message[:-4], checkSum)
+
+    flipped = bytearray(message)
+    flipped[-5] ^= 0x01
+    assert not checkMessageCrc(bytes(flipped[:-4]), checkSum)
+
+    # the frame checksum is valid, only the message is dropped
+    stats = SmlReadStats()
+    smlConfig, frames = decodeFrames(encodeFrame([message, bytes(flipped)]), stats)
+    assert stats.frameCrcErrorCount == 0
+    encodeSmlFrame(frames[0], smlConfig, stats)
+    assert stats.messageCrcErrorCount == 1
@@ -0,0 +1,69 @@
+from obis_keys import ObisFilterRule
+from sml_block_maper import SmlEntry
+from sml_entry_filter import SmlEntryFilter
+
+
+class FakeClock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def powerEntry(power):
+    return SmlEntry("0100100700", None, None, 27, 0, power, None)
+
+
+def publishedValues(entryFilter: SmlEntryFilter, clock: FakeClock, values: list, step: float = 1):
+    published = []
+    for value in values:
+        published.extend(entry.value for entry in entryFilter.filterEntries([powerEntry(value)]))
+        clock.now += step
+    return published
+
+
+def test_absolute_deadband():
+    clock = FakeClock(0.0)
+    entryFilter = SmlEntryFilter({"0100100700": ObisFilterRule(absoluteDeadband=5)}, clock=clock)
+    # the change is measured against the last published value, not the last reading
+    assert publishedValues(entryFilter, clock, [230, 233, 235, 236, 240, 241, 229]) == [230, 236, 229]
+
+
+def test_relative_deadband():
+    clock = FakeClock(0.0)
+    entryFilter = SmlEntryFilter({"0100100700": ObisFilterRule(relativeDeadband=0.1)}, clock=clock)
+    assert publishedValues(entryFilter, clock, [1000, 1090, 1101, 1200, 1210, 1400]) == [1000, 1101, 1400]
+
+
+def test_min_interval():
+    clock = FakeClock(0.0)
+    entryFilter = SmlEntryFilter({"0100100700": ObisFilterRule(minInterval=3)}, clock=clock)
+    assert publishedValues(entryFilter, clock, [1, 2, 3, 4, 5, 6, 7]) == [1, 4, 7]
+
+
+def test_heartbeat_publishes_unchanged_values():
+    clock = FakeClock(0.0)
+    entryFilter = SmlEntryFilter(
+        {"0100100700": ObisFilterRule(absoluteDeadband=10, maxSilence=4)}, clock=clock
+    )
+    assert publishedValues(entryFilter, clock, [230] * 10) == [230, 230, 230]
+    # without maxSilence an unchanged value is published once
+    entryFilter = SmlEntryFilter({"0100100700": ObisFilterRule(absoluteDeadband=10)}, clock=clock)
+    assert publishedValues(entryFilter, clock, [230] * 10) == [230]
+
+
+def test_entries_without_rule_and_octet_strings():
+    clock = FakeClock(0.0)
+    entryFilter = SmlEntryFilter(defaultRule=ObisFilterRule(absoluteDeadband=100), clock=clock)
+    serverId = SmlEntry("0100000009", None, None, None, None, "0a01", None)
+    power = powerEntry(230)
+    assert entryFilter.filterEntries([serverId, power]) == [serverId, power]
+    # octet strings are published when they change
+    assert entryFilter.filterEntries([serverId]) == []
+    changedId = SmlEntry("0100000009", None, None, None, None, "0a02", None)
+    assert entryFilter.filterEntries([changedId]) == [changedId]
+
+    # only the keys of the rules are filtered without default rule
+    entryFilter = SmlEntryFilter({"0100010800": ObisFilterRule(absoluteDeadband=100)}, clock=clock)
+    assert len(entryFilter.filterEntries([powerEntry(230), powerEntry(230)])) == 2
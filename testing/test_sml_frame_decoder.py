@@ -0,0 +1,107 @@
+from sml_crc import checkFrameCrc, crc16X25Table
+from sml_encoder import encodeFrame
+from sml_frame_decoder import SmlFrameDecoder
+from sml_step_reader import SmlConfig, encodeSmlFrame
+
+ESCAPE = b"\x1b\x1b\x1b\x1b"
+START = ESCAPE + b"\x01\x01\x01\x01"
+
+# message with an octet string of 8 escape bytes at message offset 18, only the bytes at 20 are aligned
+ESCAPE_MESSAGE = bytes.fromhex("7606000000000762006200726301010c00001b1b1b1b1b1b1b1b016308d800")
+# frame of the message built by hand: the aligned escape sequence is doubled, 1 padding byte
+ESCAPE_TELEGRAM = bytes.fromhex(
+    "1b1b1b1b01010101"
+    "7606000000000762006200726301010c0000"
+    "1b1b"
+    "1b1b1b1b1b1b1b1b"
+    "1b1b"
+    "016308d800"
+    "00"
+    "1b1b1b1b1a01"
+    "9f1e"
+)
+
+
+def buildFrame(escapedPayload: bytes, padding: int = 0):
+    """
+    Transport frame around an already escaped payload, built by hand and not with sml_encoder.
+    """
+    frame = START + escapedPayload + ESCAPE + b"\x1a" + bytes([padding])
+    crc = crc16X25Table(frame)
+    return frame + bytes([crc & 0xFF, crc >> 8])
+
+
+def feedChunks(decoder: SmlFrameDecoder, data: bytes, size: int):
+    frames = []
+    for start in range(0, len(data), size):
+        frames.extend(decoder.feed(data[start : start + size]))
+    return frames
+
+
+def test_aligned_escaped_escape_is_collapsed():
+    frame = buildFrame(b"\x01\x02\x03\x04" + ESCAPE + ESCAPE + b"\x05\x06\x07\x08")
+    frames = list(SmlFrameDecoder(SmlConfig()).feed(frame))
+    assert [f.payload for f in frames] == [b"\x01\x02\x03\x04" + ESCAPE + b"\x05\x06\x07\x08"]
+    assert frames[0].raw == frame
+
+
+def test_unaligned_escape_bytes_are_payload():
+    # an unaligned run of 8 escape bytes is not an escaped escape and is kept
+    unaligned = b"\x01\x02" + ESCAPE + ESCAPE + b"\x03\x04"
+    # an unaligned end sequence does not end the frame
+    unalignedEnd = b"\x01" + ESCAPE + b"\x1a\x00\x00"
+    frames = list(SmlFrameDecoder(SmlConfig()).feed(buildFrame(unaligned + unalignedEnd)))
+    assert [f.payload for f in frames] == [unaligned + unalignedEnd]
+
+
+def test_escape_and_end_sequences_split_across_chunks():
+    payloads = [
+        b"\x01\x02\x03\x04" + ESCAPE + b"\x05\x06\x07\x08",
+        b"\x0a\x0b" + ESCAPE + b"\x1a\x0c",
+    ]
+    escapedPayloads = [payloads[0].replace(ESCAPE, ESCAPE + ESCAPE), payloads[1]]
+    capture = b"".join(buildFrame(payload) for payload in escapedPayloads)
+    for size in range(1, 12):
+        decoder = SmlFrameDecoder(SmlConfig())
+        assert [f.payload for f in feedChunks(decoder, capture, size)] == payloads
+        assert decoder.stats.frameCount == 2
+
+
+def test_start_sequence_before_end_drops_the_frame():
+    complete = buildFrame(b"\x01\x02\x03\x04")
+    capture = START + b"\x09\x09\x09\x09" + complete
+    decoder = SmlFrameDecoder(SmlConfig())
+    assert [f.payload for f in decoder.feed(capture)] == [b"\x01\x02\x03\x04"]
+    assert decoder.stats.droppedFrameCount == 1
+
+
+def test_frame_larger_than_max_frame_size_is_dropped():
+    decoder = SmlFrameDecoder(SmlConfig(), maxFrameSize=64)
+    assert feedChunks(decoder, START + bytes(128), 16) == []
+    assert decoder.stats.droppedFrameCount == 1
+    # the decoder recovers with the next frame
+    assert [f.payload for f in decoder.feed(buildFrame(b"\x01\x02\x03\x04"))] == [b"\x01\x02\x03\x04"]
+
+
+def test_garbage_between_frames_is_skipped():
+    frame = buildFrame(b"\x01\x02\x03\x04")
+    # the garbage shifts the second frame to an unaligned stream offset
+    capture = b"\x00\x1b\x1b" + frame + b"\x1b\x1b\x1b\x1b\x1a\x07" + frame + b"\x1b"
+    for size in (1, 5, len(capture)):
+        decoder = SmlFrameDecoder(SmlConfig())
+        assert len(feedChunks(decoder, capture, size)) == 2
+        assert decoder.stats.droppedFrameCount == 0
+        assert decoder.stats.frameCrcErrorCount == 0
+
+
+def test_hand_built_telegram_with_aligned_escape():
+    assert checkFrameCrc(ESCAPE_TELEGRAM)
+    smlConfig = SmlConfig()
+    frames = list(SmlFrameDecoder(smlConfig).feed(ESCAPE_TELEGRAM))
+    assert [f.payload for f in frames] == [ESCAPE_MESSAGE + b"\x00"]
+    # the message checksum covers the unescaped bytes
+    assert len(encodeSmlFrame(frames[0], smlConfig)) == 1
+
+
+def test_encoder_escapes_only_aligned_escape_sequences():
+    assert encodeFrame([ESCAPE_MESSAGE]) == ESCAPE_TELEGRAM
@@ -0,0 +1,90 @@
+import random
+from meter_obis_value_index import findMeterConfiguration
+from sml_block_maper import mapSmlBlocksObisEntry
+from sml_encoder import SmlTelegramEncoder, MeterValueGenerator, DEFAULT_OBIS_ENTRIES
+from sml_frame_decoder import SmlFrameDecoder
+from sml_message_cache import SmlMessageCache, mapSmlFrame, mapSmlFrameCached, PROBE_INTERVAL
+from sml_step_reader import encodeSmlFrame
+
+
+def decodeFrame(meterProperties, telegram: bytes):
+    frames = list(SmlFrameDecoder(meterProperties.smlConfig).feed(telegram))
+    assert len(frames) == 1
+    return frames[0]
+
+
+def mapUncached(frame, meterProperties):
+    smlBlocks = encodeSmlFrame(frame, meterProperties.smlConfig)
+    return [entry.__dict__ for entry in mapSmlBlocksObisEntry(smlBlocks, meterProperties)]
+
+
+def test_cached_entries_match_the_parsed_entries():
+    meterProperties = findMeterConfiguration("BZPlus3")
+    cache = SmlMessageCache()
+    encoder = SmlTelegramEncoder(meterProperties)
+    generator = MeterValueGenerator(rng=random.Random(3))
+    values = generator.nextValues()
+    for index in range(20):
+        if index % 4 == 3:
+            # a few values change, the other list entries come from the cache
+            values = dict(values, **{"0100100700": values["0100100700"] + index, "0100010800": 5000 + index})
+        frame = decodeFrame(meterProperties, encoder.encode(values, index, seconds=1000 + index))
+        entries = mapSmlFrameCached(frame, meterProperties, cache)
+        assert len(entries) == len(values) + 1
+        assert [entry.__dict__ for entry in entries] == mapUncached(frame, meterProperties)
+    assert cache.hitCount > 0
+    assert cache.evictionCount == 0
+
+
+def test_evicted_messages_are_parsed_again():
+    meterProperties = findMeterConfiguration("BZPlus3")
+    cache = SmlMessageCache(4)
+    encoder = SmlTelegramEncoder(meterProperties)
+    telegrams = [
+        encoder.encode({"0100010800": 1000 + index, "0100100700": index}, index) for index in range(6)
+    ]
+    for telegram in telegrams + telegrams:
+        frame = decodeFrame(meterProperties, telegram)
+        entries = mapSmlFrameCached(frame, meterProperties, cache)
+        assert [entry.__dict__ for entry in entries] == mapUncached(frame, meterProperties)
+    assert len(cache) == 4
+    assert cache.evictionCount > 0
+
+
+def test_busy_meter_is_parsed_without_the_cache():
+    meterProperties = findMeterConfiguration("BZPlus3")
+    meterProperties.messageCache = SmlMessageCache()
+    encoder = SmlTelegramEncoder(meterProperties)
+    generator = MeterValueGenerator(rng=random.Random(5))
+    frameCount = 3 * PROBE_INTERVAL
+    for index in range(frameCount):
+        # every value changes in every telegram
+        frame = decodeFrame(meterProperties, encoder.encode(generator.nextValues(), index, seconds=index))
+        entries = mapSmlFrame(frame, meterProperties)
+        assert [entry.__dict__ for entry in entries] == mapUncached(frame, meterProperties)
+    cache = meterProperties.messageCache
+    assert cache.cachedEntryRatio < 0.6
+    # a probe with the cache every PROBE_INTERVAL frames
+    assert frameCount - 2 * PROBE_INTERVAL < cache.bypassedFrameCount < frameCount
+    assert cache.missCount > 0
+
+
+def test_unchanged_list_entries_share_their_entries():
+    meterProperties = findMeterConfiguration("BZPlus3")
+    cache = SmlMessageCache()
+    encoder = SmlTelegramEncoder(meterProperties)
+    values = {obisKey: 1000 for obisKey, unit, scaler in DEFAULT_OBIS_ENTRIES}
+    first = mapSmlFrameCached(decodeFrame(meterProperties, encoder.encode(values, 1)), meterProperties, cache)
+    changed = dict(values, **{"0100100700": 2000})
+    secondFrame = decodeFrame(meterProperties, encoder.encode(changed, 2))
+    second = mapSmlFrameCached(secondFrame, meterProperties, cache)
+
+    firstByObis = {entry.obis: entry for entry in first}
+    for entry in second:
+        if entry.obis == "0100100700":
+            assert entry is not firstByObis[entry.obis]
+            assert entry.value == 2000
+        else:
+            assert entry is firstByObis[entry.obis]
+    # the entries of the first telegram keep their values
+    assert firstByObis["0100100700"].value == 1000
@@ -0,0 +1,73 @@
+import urllib.request
+from sml_frame_decoder import SmlReadStats
+from sml_metrics import METRIC_TYPE_GAUGE, METRICS_DISABLED, MetricsRegistry, MetricsServer
+
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry()
+    frames = registry.counter("sml_test_frames_total", "Frames", {"meter": "grid"})
+    frames.inc()
+    frames.inc(2)
+    # the same name and labels return the same metric
+    assert registry.counter("sml_test_frames_total", "Frames", {"meter": "grid"}) is frames
+    registry.counter("sml_test_frames_total", "Frames", {"meter": 'he"at'}).inc()
+    queueSize = [4]
+    registry.callback("sml_test_queue_depth", METRIC_TYPE_GAUGE, "Queued items", lambda: queueSize[0])
+    histogram = registry.histogram("sml_test_seconds", "Time", {"meter": "grid"}, buckets=(0.001, 0.01))
+    for value in (0.0005, 0.001, 0.005, 0.5):
+        histogram.observe(value)
+    queueSize[0] = 7
+
+    assert registry.render().splitlines() == [
+        "# HELP sml_test_frames_total Frames",
+        "# TYPE sml_test_frames_total counter",
+        'sml_test_frames_total{meter="grid"} 3',
+        'sml_test_frames_total{meter="he\\"at"} 1',
+        "# HELP sml_test_queue_depth Queued items",
+        "# TYPE sml_test_queue_depth gauge",
+        "sml_test_queue_depth 7",
+        "# HELP sml_test_seconds Time",
+        "# TYPE sml_test_seconds histogram",
+        'sml_test_seconds_bucket{meter="grid",le="0.001"} 2',
+        'sml_test_seconds_bucket{meter="grid",le="0.01"} 3',
+        'sml_test_seconds_bucket{meter="grid",le="+Inf"} 4',
+        'sml_test_seconds_sum{meter="grid"} 0.5065',
+        'sml_test_seconds_count{meter="grid"} 4',
+    ]
+
+
+def test_read_stats_are_exported():
+    registry = MetricsRegistry()
+    stats = SmlReadStats()
+    registry.addReadStats(stats, {"meter": "grid"})
+    stats.byteCount = 1024
+    stats.frameCrcErrorCount = 2
+    stats.messageCrcErrorCount = 3
+    lines = registry.render().splitlines()
+    assert 'sml_read_bytes_total{meter="grid"} 1024' in lines
+    assert 'sml_frames_dropped_total{meter="grid",reason="frame_crc"} 2' in lines
+    assert 'sml_frames_dropped_total{meter="grid",reason="parse_error"} 0' in lines
+    # a message with a wrong checksum does not drop its frame
+    assert 'sml_messages_dropped_total{meter="grid"} 3' in lines
+    assert not any('reason="message_crc"' in line for line in lines)
+
+
+def test_disabled_metrics():
+    METRICS_DISABLED.counter("sml_test_total", "Test").inc()
+    METRICS_DISABLED.histogram("sml_test_seconds", "Test").observe(1.0)
+    METRICS_DISABLED.addReadStats(SmlReadStats())
+    assert METRICS_DISABLED.render() == ""
+
+
+def test_metrics_server():
+    registry = MetricsRegistry()
+    registry.counter("sml_test_total", "Test").inc()
+    server = MetricsServer(registry, 0)
+    server.start()
+    try:
+        host, port = server.server.server_address[:2]
+        with urllib.request.urlopen("http://{}:{}/metrics".format(host, port), timeout=5) as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert "sml_test_total 1" in response.read().decode("utf-8")
+    finally:
+        server.close()
@@ -0,0 +1,53 @@
+import pytest
+from meter_obis_value_index import findMeterConfiguration
+from sml_encoder import SmlTelegramEncoder
+from sml_replay import CaptureFile, replayCapture
+from write_data import WriteData
+
+
+class CollectingWriter(WriteData):
+    def __init__(self):
+        super().__init__()
+        self.energyValues = []
+
+    def writeData(self, data):
+        self.energyValues.extend(entry.baseValue for entry in data if entry.obis == "0100010800")
+
+
+@pytest.fixture
+def capture(tmp_path):
+    encoder = SmlTelegramEncoder(findMeterConfiguration("BZPlus3"))
+    capturePath = tmp_path / "capture.bin"
+    capturePath.write_bytes(b"".join(encoder.encode({"0100010800": index}, index) for index in range(300)))
+    return str(capturePath)
+
+
+@pytest.mark.parametrize("processes", [1, 3])
+def test_replay_writes_telegrams_in_file_order(capture, processes):
+    writer = CollectingWriter()
+    # ranges of 4 KB, many more ranges than processes are in flight
+    stats = replayCapture(capture, "BZPlus3", writer, processes=processes, chunkSize=4 << 10)
+    assert writer.energyValues == list(range(300))
+    assert stats.frameCount == 300
+    assert stats.droppedFrameCount == 0
+
+
+def test_replay_of_hex_capture(capture, tmp_path):
+    hexPath = tmp_path / "capture.hex"
+    with open(capture, "rb") as captureFile:
+        hexPath.write_text(captureFile.read().hex())
+    writer = CollectingWriter()
+    replayCapture(str(hexPath), "BZPlus3", writer, processes=2, chunkSize=8 << 10)
+    assert writer.energyValues == list(range(300))
+
+
+def test_hex_start_sequence_at_an_odd_digit_is_skipped(tmp_path):
+    hexPath = tmp_path / "capture.hex"
+    # bytes 01 b1 b1 b1 b1 b0 10 10 10 10 contain the start sequence digits from the second digit on,
+    # the newline in front makes the character offset of that match even
+    hexPath.write_text("\n01b1b1b1b1b010101010" + "1b1b1b1b01010101" + "00")
+    escapeSequenc = bytes.fromhex("1b1b1b1b")
+    with CaptureFile(str(hexPath), escapeSequenc + bytes.fromhex("01010101"), escapeSequenc) as captureFile:
+        assert captureFile.hex
+        assert captureFile.findStart(0) == 21
+        assert captureFile.findStart(22) is None
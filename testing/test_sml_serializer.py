@@ -0,0 +1,92 @@
+import json
+import pytest
+from sml_block_maper import SmlEntry
+from sml_serializer import (
+    EntrySerializer,
+    parseFieldList,
+    SERIALIZER_CBOR,
+    SERIALIZER_JSON,
+    SERIALIZER_MSGPACK,
+    SERIALIZER_ORJSON,
+)
+from write_data import MqttValue
+
+# format and the package it needs
+FORMATS = [
+    (SERIALIZER_JSON, None),
+    (SERIALIZER_ORJSON, "orjson"),
+    (SERIALIZER_MSGPACK, "msgpack"),
+    (SERIALIZER_CBOR, "cbor2"),
+]
+VALUES = [0, 230, -17, 5184348.1, 1 << 40, "0a0153414720014333e3", None]
+
+
+def createSerializer(serializerFormat: str, package: str, **kwargs):
+    if package is not None:
+        pytest.importorskip(package)
+    return EntrySerializer(serializerFormat, **kwargs)
+
+
+@pytest.mark.parametrize("serializerFormat, package", FORMATS)
+def test_template_payload_matches_the_encoded_payload(serializerFormat, package):
+    serializer = createSerializer(serializerFormat, package)
+    for unit in ["W", "Wh", ""]:
+        for value in VALUES:
+            payload = serializer.serializeValue(value, unit)
+            assert serializer.loads(payload) == {"value": value, "unit": unit}
+            assert payload == serializer.serializePayload({"value": value, "unit": unit})
+    assert set(serializer.templates) == {"W", "Wh", ""}
+
+
+def test_spliced_json_payload():
+    serializer = EntrySerializer(SERIALIZER_JSON)
+    entry = SmlEntry("0100010800", None, None, 30, -1, 51843481, None)
+    payload = serializer.serializeValue(entry.value, entry.unit)
+    assert json.loads(payload) == MqttValue(entry).__dict__ == {"value": 5184348.1, "unit": "Wh"}
+    # the template of the unit is shared by all OBIS keys
+    other = SmlEntry("0100020800", None, None, 30, -1, 12, None)
+    assert json.loads(serializer.serializeValue(other.value, other.unit)) == {"value": 1.2, "unit": "Wh"}
+    assert len(serializer.templates) == 1
+
+
+@pytest.mark.parametrize("serializerFormat, package", FORMATS)
+def test_fields_and_drop_fields(serializerFormat, package):
+    entry = SmlEntry("0100100700", None, None, 27, 0, 230, "ff00")
+    serializer = createSerializer(serializerFormat, package, dropFields=["unit"])
+    assert serializer.loads(serializer.serializeValue(230, "W")) == {"value": 230}
+    assert serializer.loads(serializer.serializeEntry(entry)) == {
+        key: value for key, value in entry.__dict__.items() if key != "unit"
+    }
+
+    serializer = createSerializer(serializerFormat, package, fields=["obis", "value"])
+    assert serializer.loads(serializer.serializeValue(230, "W")) == {"value": 230}
+    assert serializer.loads(serializer.serializeEntry(entry)) == {"obis": "0100100700", "value": 230}
+    assert serializer.loads(serializer.serializeTelegram({"0100100700": {"value": 230, "unit": "W"}})) == {
+        "0100100700": {"value": 230}
+    }
+
+    # without the value field the payload does not change with the value
+    serializer = createSerializer(serializerFormat, package, dropFields=["value"])
+    assert serializer.serializeValue(230, "W") == serializer.serializeValue(231, "W")
+    assert serializer.loads(serializer.serializeValue(230, "W")) == {"unit": "W"}
+
+
+def test_parse_field_list():
+    assert parseFieldList(None) is None
+    assert parseFieldList("") is None
+    assert parseFieldList("signature, status,,obisName") == ["signature", "status", "obisName"]
+
+
+@pytest.mark.parametrize("serializerFormat, package", FORMATS)
+def test_timestamp_of_buffered_payloads(serializerFormat, package):
+    serializer = createSerializer(serializerFormat, package)
+    payload = serializer.serializeValue(230, "W")
+    timestamped = serializer.addTimestamp(payload, 1700000000.5)
+    assert serializer.loads(timestamped) == {"value": 230, "unit": "W", "timestamp": 1700000000.5}
+
+    telegram = serializer.serializeTelegram({"0100100700": {"value": 230, "unit": "W"}})
+    assert serializer.loads(serializer.addTimestamp(telegram, 12.0))["timestamp"] == 12.0
+    # payloads without an object and payloads of another format are unchanged
+    scalar = serializer.dumps(230)
+    assert serializer.addTimestamp(scalar, 12.0) == scalar
+    assert serializer.addTimestamp(b"\xff\xfe", 12.0) == b"\xff\xfe"
@@ -0,0 +1,77 @@
+import pytest
+from meter_obis_value_index import findMeterConfiguration
+from sml_block_maper import mapSmlBlocksObisEntry
+from sml_encoder import DEFAULT_SERVER_ID, SmlTelegramEncoder, encodeListEntry, encodeOctetString
+from sml_step_reader import (
+    SmlBlock,
+    SmlOctetString,
+    encodeSml,
+    parsSmlList,
+    parsValueToLazyString,
+    parsValueToString,
+)
+from testing.sml_type_corpus import runCorpus
+
+OCTET_STRING_FUNCTIONS = [parsValueToString, parsValueToLazyString]
+
+
+def parseElement(data: bytes, octetString=parsValueToString):
+    smlBlock = SmlBlock()
+    end = parsSmlList(memoryview(data), 0, len(data), smlBlock, 1, octetString)
+    assert end == len(data)
+    return smlBlock
+
+
+@pytest.mark.parametrize("octetString", OCTET_STRING_FUNCTIONS)
+@pytest.mark.parametrize("size", [1, 2, 6, 9, 15, 16, 17, 96, 300])
+def test_octet_string_keeps_every_byte(octetString, size):
+    value = bytes(range(256))[:size] if size <= 256 else bytes(size)
+    smlBlock = parseElement(encodeOctetString(value), octetString)
+    values = [str(item) if isinstance(item, SmlOctetString) else item for item in smlBlock.values]
+    assert values == [value.hex()]
+
+
+def test_obis_key_of_list_entry_has_no_f_group():
+    smlBlock = parseElement(encodeListEntry("0100010800", None, encodeOctetString(None), 30, -1, 42))
+    listEntry = smlBlock.childList[0]
+    assert listEntry.values == ["0100010800", None, None, 30, -1, 42, None]
+
+
+def test_other_octet_strings_of_6_bytes_are_complete():
+    serverId = b"\x01" * 6
+    smlBlock = parseElement(encodeListEntry("0100000009", None, encodeOctetString(None), None, None, serverId))
+    assert smlBlock.childList[0].values[5] == "010101010101"
+
+
+@pytest.mark.parametrize("size", range(1, 9))
+@pytest.mark.parametrize("signed", [False, True])
+def test_integers_of_every_width(size, signed):
+    limits = [-1, -(1 << (8 * size - 1))] if signed else [(1 << 8 * size) - 1]
+    for value in [0, 1, (1 << (8 * size - 1)) - 1] + limits:
+        data = bytes([(0x50 if signed else 0x60) | (size + 1)]) + value.to_bytes(size, "big", signed=signed)
+        assert parseElement(data).values == [value]
+
+
+def test_booleans():
+    assert parseElement(b"\x42\x00").values == [False]
+    assert parseElement(b"\x42\x01").values == [True]
+
+
+def test_list_with_extended_length():
+    data = b"\xf1\x04" + b"\x62\x07" * 20
+    smlBlock = parseElement(data)
+    assert smlBlock.childList[0].values == [7] * 20
+
+
+def test_server_id_is_published_complete():
+    meterProperties = findMeterConfiguration("eBZ_DD3_DD3BZ06DTA_SMZ1")
+    telegram = SmlTelegramEncoder(meterProperties).encode({"0100010800": 51843481}, 1)
+    entries = mapSmlBlocksObisEntry(encodeSml(telegram, meterProperties.smlConfig), meterProperties)
+    serverIds = [entry.value for entry in entries if entry.obis == "0100000009"]
+    assert serverIds == [DEFAULT_SERVER_ID.hex()]
+    assert [entry.baseValue for entry in entries if entry.obis == "0100010800"] == [51843481]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_element_corpus(seed):
+    assert runCorpus(2000, seed) == []
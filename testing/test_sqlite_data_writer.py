@@ -0,0 +1,64 @@
+from sml_block_maper import SmlEntry
+from sqlite_data_writer import RAW_RESOLUTION, SqliteDataWriter
+
+
+class FakeClock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def createTelegram(power: int):
+    return [SmlEntry("0100100700", None, None, 27, 0, power, None)]
+
+
+def test_telegrams_in_the_same_second_are_kept(tmp_path):
+    clock = FakeClock(1200.0)
+    writer = SqliteDataWriter(str(tmp_path / "meter.db"), "grid", clock=clock)
+    powers = [230, 240, 250, 260]
+    for power in powers:
+        writer.writeData(createTelegram(power))
+        clock.now += 0.25
+    # two telegrams with the same clock time
+    writer.writeData(createTelegram(270))
+    writer.writeData(createTelegram(280))
+    powers += [270, 280]
+
+    rawRows = writer.queryRange("0100100700", 1200, 1260, RAW_RESOLUTION)
+    assert [row[1] for row in rawRows] == powers
+    assert len(set(row[0] for row in rawRows)) == len(powers)
+    for window in (60, 900, 3600):
+        rollupRows = writer.queryRange("0100100700", 0, 3600, window)
+        assert sum(row[6] for row in rollupRows) == len(powers)
+        assert rollupRows[-1][1] == sum(powers) / len(powers)
+    writer.close()
+
+    # after a restart with the clock behind the stored samples the times are still unique
+    clock.now = 1100.0
+    writer = SqliteDataWriter(str(tmp_path / "meter.db"), "grid", clock=clock)
+    writer.writeData(createTelegram(290))
+    assert writer.queryRange("0100100700", 0, 3600, 3600)[0][6] == len(powers) + 1
+    writer.close()
+
+
+
+def test_retention_releases_the_deleted_pages(tmp_path):
+    clock = FakeClock(1200.0)
+    writer = SqliteDataWriter(
+        str(tmp_path / "meter.db"), "grid", clock=clock, retention={RAW_RESOLUTION: 60}, batchSize=100000
+    )
+    for index in range(20000):
+        writer.writeData([SmlEntry("0100100700", None, None, 27, 0, index, None)])
+        clock.now += 0.001
+    writer.flush()
+    pageCount = writer.connection.execute("PRAGMA page_count").fetchone()[0]
+
+    # all raw samples are older than the retention
+    clock.now += 3600
+    writer.deleteExpiredRows(clock.now)
+    assert writer.connection.execute("SELECT count(*) FROM sample").fetchone()[0] == 0
+    assert writer.connection.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    assert writer.connection.execute("PRAGMA page_count").fetchone()[0] < pageCount / 2
+    writer.close()
@@ -0,0 +1,76 @@
+import json
+import time
+import pytest
+import write_data
+from sml_block_maper import SmlEntry
+from write_ahead_buffer import WriteAheadBuffer, FSYNC_NEVER
+from write_data import MqttDataWriter
+from testing.fake_mqtt import FakeBroker, createFakeMqttModule
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = FakeBroker()
+    monkeypatch.setattr(write_data, "mqtt", createFakeMqttModule(broker))
+    return broker
+
+
+def createTelegram(power: int):
+    return [SmlEntry("0100100700", None, None, 27, 0, power, None)]
+
+
+def publishedValues(broker: FakeBroker):
+    return [json.loads(payload)["value"] for payload in broker.payloads("meter/grid/0100100700")]
+
+
+def test_buffer_round_trip(tmp_path):
+    writeAheadBuffer = WriteAheadBuffer(str(tmp_path), fsyncPolicy=FSYNC_NEVER)
+    writeAheadBuffer.append("meter/a", '{"value": 1}', 100.0)
+    writeAheadBuffer.append("meter/b", b"\x81\xa5value\x02", 101.0)
+    records, cursor = writeAheadBuffer.readBatch(10)
+    assert records == [(100.0, "meter/a", '{"value": 1}'), (101.0, "meter/b", b"\x81\xa5value\x02")]
+    writeAheadBuffer.commit(cursor)
+    assert writeAheadBuffer.isEmpty()
+    writeAheadBuffer.close()
+
+    # the cursor survives a restart, delivered records are not read again
+    restartedBuffer = WriteAheadBuffer(str(tmp_path), fsyncPolicy=FSYNC_NEVER)
+    records, cursor = restartedBuffer.readBatch(10)
+    assert records == []
+    restartedBuffer.close()
+
+
+def test_buffer_empties_under_live_load(broker, tmp_path):
+    broker.reachable = False
+    writer = MqttDataWriter(
+        "localhost",
+        1883,
+        "meter/grid/",
+        0,
+        writeAheadBuffer=WriteAheadBuffer(str(tmp_path), fsyncPolicy=FSYNC_NEVER),
+        drainRate=100,
+    )
+    # outage: 50 readings go to the buffer
+    for power in range(50):
+        writer.writeData(createTelegram(power))
+    assert len(broker.messages) == 0
+    assert not writer.writeAheadBuffer.isEmpty()
+
+    broker.reachable = True
+    broker.clients[0].reconnect()
+    # live readings at about 500 messages per second, five times the drain rate of the backlog
+    power = 50
+    deadline = time.monotonic() + 5
+    while not writer.writeAheadBuffer.isEmpty() and time.monotonic() < deadline:
+        writer.writeData(createTelegram(power))
+        power += 1
+        time.sleep(0.002)
+    assert writer.writeAheadBuffer.isEmpty()
+
+    # after the drain caught up the readings are published directly
+    delivered = len(broker.messages)
+    writer.writeData(createTelegram(power))
+    assert len(broker.messages) == delivered + 1
+    assert writer.writeAheadBuffer.isEmpty()
+    writer.close()
+    assert publishedValues(broker) == list(range(power + 1))
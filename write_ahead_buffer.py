@@ -0,0 +1,192 @@
+import binascii
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger('general_logger')
+
+# fsync after every record
+FSYNC_ALWAYS = "always"
+# fsync at most every fsyncInterval seconds and when a segment is closed
+FSYNC_INTERVAL = "interval"
+# leave writing to the operating system, least wear of SD cards
+FSYNC_NEVER = "never"
+FSYNC_POLICIES = [FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER]
+
+# length and crc32 of the record body
+RECORD_HEADER = struct.Struct("<II")
+SEGMENT_SUFFIX = ".wal"
+CURSOR_FILE_NAME = "cursor"
+# fourth field of a record with a binary payload (MessagePack, CBOR), the payload is stored as base64
+BINARY_PAYLOAD = "base64"
+
+
+class WriteAheadBuffer:
+    """
+    Append-only ring buffer of messages in segment files of about segmentSize bytes.
+    When more than maxSegments segments exist the oldest segment is deleted.
+    Records are read in batches and removed by commit after they were delivered,
+    the read position survives restarts in the cursor file. Torn records at the end of a segment are skipped.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segmentSize: int = 1 << 20,
+        maxSegments: int = 16,
+        fsyncPolicy: str = FSYNC_INTERVAL,
+        fsyncInterval: float = 5.0,
+        clock=time.time,
+    ):
+        super().__init__()
+        self.directory = directory
+        self.segmentSize = segmentSize
+        self.maxSegments = max(2, maxSegments)
+        self.fsyncPolicy = fsyncPolicy
+        self.fsyncInterval = fsyncInterval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.droppedSegmentCount = 0
+        self.lastSync = 0.0
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(
+            int(name[: -len(SEGMENT_SUFFIX)]) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)
+        )
+        self.cursor = self.readCursor()
+        # always append to a new segment, the last one can end with a torn record
+        self.writeFile = None
+        self.openSegment(self.segments[-1] + 1 if self.segments else 0)
+
+    def segmentPath(self, segment: int):
+        return os.path.join(self.directory, "{:012d}{}".format(segment, SEGMENT_SUFFIX))
+
+    def readCursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE_NAME), "r") as cursorFile:
+                segment, offset = json.load(cursorFile)
+        except (OSError, ValueError):
+            return (self.segments[0], 0) if self.segments else (0, 0)
+        if self.segments and segment < self.segments[0]:
+            return (self.segments[0], 0)
+        return (segment, offset)
+
+    def writeCursor(self):
+        cursorPath = os.path.join(self.directory, CURSOR_FILE_NAME)
+        with open(cursorPath + ".tmp", "w") as cursorFile:
+            json.dump(list(self.cursor), cursorFile)
+        os.replace(cursorPath + ".tmp", cursorPath)
+
+    def openSegment(self, segment: int):
+        if self.writeFile is not None:
+            self.sync()
+            self.writeFile.close()
+        self.writeSegment = segment
+        self.writeFile = open(self.segmentPath(segment), "ab")
+        self.writeOffset = self.writeFile.tell()
+        if segment not in self.segments:
+            self.segments.append(segment)
+        while len(self.segments) > self.maxSegments:
+            oldest = self.segments.pop(0)
+            os.remove(self.segmentPath(oldest))
+            self.droppedSegmentCount += 1
+            logger.warning("Write-ahead buffer full, segment {} dropped".format(oldest))
+            if self.cursor[0] <= oldest:
+                self.cursor = (self.segments[0], 0)
+
+    def sync(self):
+        self.writeFile.flush()
+        if self.fsyncPolicy != FSYNC_NEVER:
+            os.fsync(self.writeFile.fileno())
+        self.lastSync = self.clock()
+
+    def append(self, topic: str, payload, timestamp: float = None):
+        record = [self.clock() if timestamp is None else timestamp, topic, payload]
+        if isinstance(payload, bytes):
+            record[2] = binascii.b2a_base64(payload, newline=False).decode("ascii")
+            record.append(BINARY_PAYLOAD)
+        body = json.dumps(record).encode("utf-8")
+        with self.lock:
+            if self.writeOffset > 0 and self.writeOffset + RECORD_HEADER.size + len(body) > self.segmentSize:
+                self.openSegment(self.writeSegment + 1)
+            self.writeFile.write(RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body)
+            self.writeOffset += RECORD_HEADER.size + len(body)
+            if self.fsyncPolicy == FSYNC_ALWAYS or (
+                self.fsyncPolicy == FSYNC_INTERVAL and self.clock() - self.lastSync >= self.fsyncInterval
+            ):
+                self.sync()
+            else:
+                self.writeFile.flush()
+
+    def isEmpty(self):
+        with self.lock:
+            return self.cursor >= (self.writeSegment, self.writeOffset)
+
+    def readBatch(self, maxRecords: int):
+        """
+        Read up to maxRecords records (timestamp, topic, payload) from the cursor.
+        Returns the records and the cursor behind them for commit.
+        """
+        with self.lock:
+            segment, offset = self.cursor
+            writeSegment = self.writeSegment
+            segments = list(self.segments)
+        records = []
+        while len(records) < maxRecords:
+            if segment not in segments:
+                following = [later for later in segments if later > segment]
+                if not following:
+                    break
+                segment, offset = following[0], 0
+            try:
+                with open(self.segmentPath(segment), "rb") as segmentFile:
+                    segmentFile.seek(offset)
+                    while len(records) < maxRecords:
+                        header = segmentFile.read(RECORD_HEADER.size)
+                        if len(header) < RECORD_HEADER.size:
+                            break
+                        length, crc = RECORD_HEADER.unpack(header)
+                        body = segmentFile.read(length)
+                        if len(body) < length or zlib.crc32(body) != crc:
+                            if segment != writeSegment:
+                                logger.warning("Torn record in segment {} skipped".format(segment))
+                            break
+                        records.append(decodeRecord(body))
+                        offset += RECORD_HEADER.size + length
+            except FileNotFoundError:
+                pass
+            if len(records) >= maxRecords or segment == writeSegment:
+                break
+            # the segment is read completely
+            segment, offset = segment + 1, 0
+        return records, (segment, offset)
+
+    def commit(self, cursor: tuple):
+        """
+        Mark the records in front of the cursor as delivered and delete the segments read completely.
+        """
+        with self.lock:
+            if cursor <= self.cursor:
+                return
+            self.cursor = cursor
+            while len(self.segments) > 1 and self.segments[0] < cursor[0]:
+                os.remove(self.segmentPath(self.segments.pop(0)))
+            self.writeCursor()
+
+    def close(self):
+        with self.lock:
+            self.sync()
+            self.writeFile.close()
+
+
+def decodeRecord(body: bytes):
+    """
+    Record (timestamp, topic, payload) of a record body, binary payloads are returned as bytes.
+    """
+    record = json.loads(body)
+    if len(record) > 3 and record[3] == BINARY_PAYLOAD:
+        return record[0], record[1], binascii.a2b_base64(record[2])
+    return tuple(record)
@@ -1,21 +1,67 @@
 from sml_block_maper import SmlEntry
+from sml_metrics import MetricsRegistry, METRICS_DISABLED, METRIC_TYPE_GAUGE, METRIC_TYPE_COUNTER
+from sml_serializer import EntrySerializer
+from write_ahead_buffer import WriteAheadBuffer
 from typing import List
-import json
 import logging
+import sys
+import threading
+import time
 
-try:
-    import paho.mqtt.client as mqtt
-except ImportError:
-    logging.error("paho.mqtt package not found")
+logger = logging.getLogger('general_logger')
+
+# paho.mqtt.client, loaded by the first mqtt writer
+mqtt = None
+
+
+def importMqttClient():
+    global mqtt
+    if mqtt is None:
+        try:
+            import paho.mqtt.client as mqttClient
+        except ImportError:
+            logging.error("paho.mqtt package not found")
+            raise
+        mqtt = mqttClient
+    return mqtt
 
 
 class WriteData(object):
-    def __init__(self):
+    def __init__(self, serializer: EntrySerializer = None):
         super().__init__()
+        self.serializer = EntrySerializer() if serializer is None else serializer
 
     def writeData(self, data: List[SmlEntry]):
+        serializer = self.serializer
         for dataItem in data:
-            print(json.dumps(dataItem.__dict__))
+            payload = serializer.serializeEntry(dataItem)
+            if not serializer.binary:
+                print(payload if isinstance(payload, str) else payload.decode())
+            else:
+                sys.stdout.buffer.write(payload)
+        if serializer.binary:
+            sys.stdout.buffer.flush()
+
+    def close(self):
+        pass
+
+
+class MultiDataWriter(WriteData):
+    """
+    Write the entries with several writers, e.g. publish with mqtt and store in a local database.
+    """
+
+    def __init__(self, writers: List[WriteData]):
+        super().__init__()
+        self.writers = writers
+
+    def writeData(self, data: List[SmlEntry]):
+        for writer in self.writers:
+            writer.writeData(data)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
 
 
 class MqttValue:
@@ -23,23 +69,242 @@ class MqttValue:
         super().__init__()
         self.value = smlValue.value
         self.unit = smlValue.unit
+        if getattr(smlValue, "exact", False):
+            # unscaled integer and power of ten, value = rawValue * 10**scaler
+            self.rawValue = smlValue.baseValue
+            self.scaler = smlValue.scaler
+        # window summaries of the aggregator
+        summary = getattr(smlValue, "summary", None)
+        if summary is not None:
+            self.__dict__.update(summary)
+
+
+# publish every entry on its own topic
+MQTT_MODE_ENTRY = "entry"
+# publish one JSON document with all entries of a telegram
+MQTT_MODE_TELEGRAM = "telegram"
+# publish only entries whose value or unit changed since the last telegram
+MQTT_MODE_CHANGED = "changed"
+MQTT_MODES = [MQTT_MODE_ENTRY, MQTT_MODE_TELEGRAM, MQTT_MODE_CHANGED]
 
 
 class MqttDataWriter(WriteData):
-    def __init__(self, urls: str, port: int, topic: str, qos: int):
-        super().__init__()
+    """
+    Long-lived MQTT publisher. The connection is opened once and kept by the paho network loop thread,
+    which reconnects with an increasing delay. Messages are queued by paho up to maxQueuedMessages.
+    With a write-ahead buffer the messages are stored on disk while the broker is not reachable
+    and published by the drain thread after the reconnect. The rate limit of drainRate messages per second
+    only applies to the messages buffered before the reconnect, new messages wait behind them in the buffer
+    to keep the order and are published without delay, so the buffer empties under live load.
+    """
+
+    def __init__(
+        self,
+        urls: str,
+        port: int,
+        topic: str,
+        qos: int,
+        mode: str = MQTT_MODE_ENTRY,
+        maxQueuedMessages: int = 1000,
+        minReconnectDelay: int = 1,
+        maxReconnectDelay: int = 120,
+        metrics: MetricsRegistry = METRICS_DISABLED,
+        writeAheadBuffer: WriteAheadBuffer = None,
+        drainRate: float = 20,
+        drainBatchSize: int = 100,
+        publishTimeout: float = 10,
+        serializer: EntrySerializer = None,
+    ):
+        super().__init__(serializer)
         self.urls = urls
-        self.port = port
+        self.port = int(port)
         self.topic = topic
-        self.qos = qos
-        self.client = mqtt.Client()
+        self.qos = int(qos)
+        self.mode = mode
+        self.connected = False
+        self.started = False
+        self.droppedMessages = 0
+        self.lastValues = dict()
+        # topic per prefix and OBIS key
+        self.topics = dict()
+        self.writeAheadBuffer = writeAheadBuffer
+        self.drainRate = drainRate
+        # buffer time of the last connect, older records are the backlog of the outage
+        self.connectedSince = 0.0
+        self.drainBatchSize = drainBatchSize
+        self.publishTimeout = publishTimeout
+        self.drainEvent = threading.Event()
+        self.drainThread = None
+        self.client = importMqttClient().Client()
+        self.client.max_queued_messages_set(maxQueuedMessages)
+        self.client.reconnect_delay_set(minReconnectDelay, maxReconnectDelay)
+        self.client.on_connect = self.onConnect
+        self.client.on_disconnect = self.onDisconnect
+        metrics.callback(
+            "sml_mqtt_connected", METRIC_TYPE_GAUGE, "Connected to the mqtt broker", lambda: int(self.connected)
+        )
+        metrics.callback(
+            "sml_mqtt_dropped_messages_total",
+            METRIC_TYPE_COUNTER,
+            "Messages which were not queued by the mqtt client",
+            lambda: self.droppedMessages,
+        )
 
-    def createTopic(self, value: SmlEntry):
-        return str(self.topic) + str(value.obis)
+    def onConnect(self, client, userdata, flags, rc, *args):
+        self.connected = rc == 0
+        if self.connected:
+            logger.info("Connected to mqtt broker {}:{}".format(self.urls, self.port))
+            if self.writeAheadBuffer is not None:
+                self.connectedSince = self.writeAheadBuffer.clock()
+            self.drainEvent.set()
+        else:
+            logger.error("Connection to mqtt broker refused: {}".format(rc))
+
+    def onDisconnect(self, client, userdata, *args):
+        self.connected = False
+        logger.warning("Disconnected from mqtt broker {}:{}".format(self.urls, self.port))
+
+    def start(self):
+        self.client.connect_async(self.urls, self.port)
+        self.client.loop_start()
+        self.started = True
+        if self.writeAheadBuffer is not None:
+            self.drainThread = threading.Thread(target=self.drainBuffer, name="mqtt-drain", daemon=True)
+            self.drainThread.start()
+
+    def close(self):
+        if self.started:
+            self.started = False
+            if self.drainThread is not None:
+                self.drainEvent.set()
+                self.drainThread.join()
+            self.client.disconnect()
+            self.client.loop_stop()
+        if self.writeAheadBuffer is not None:
+            self.writeAheadBuffer.close()
+
+    def drainBuffer(self):
+        """
+        Publish the buffered messages in batches, a batch is removed from the buffer when all messages are published.
+        The messages keep the time of the reading as timestamp. Only the backlog of the outage is rate limited.
+        """
+        delay = 1.0 / self.drainRate if self.drainRate else 0
+        while self.started:
+            if not self.connected or self.writeAheadBuffer.isEmpty():
+                self.drainEvent.wait(1)
+                self.drainEvent.clear()
+                continue
+            records, cursor = self.writeAheadBuffer.readBatch(self.drainBatchSize)
+            results = []
+            for timestamp, topic, payload in records:
+                payload = self.serializer.addTimestamp(payload, timestamp)
+                results.append(self.client.publish(topic, payload, qos=self.qos))
+                if delay > 0 and timestamp < self.connectedSince:
+                    time.sleep(delay)
+            if self.waitForPublish(results):
+                self.writeAheadBuffer.commit(cursor)
+            else:
+                logger.warning("Buffered messages not published, retry after reconnect")
+                self.drainEvent.wait(1)
+
+    def waitForPublish(self, results: list):
+        if any(result.rc != mqtt.MQTT_ERR_SUCCESS for result in results):
+            return False
+        if self.qos == 0:
+            return True
+        deadline = time.monotonic() + self.publishTimeout
+        while not all(result.is_published() for result in results):
+            if not self.connected or time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def createTopic(self, value: SmlEntry, topic: str = None):
+        key = (topic, value.obis)
+        entryTopic = self.topics.get(key)
+        if entryTopic is None:
+            entryTopic = str(self.topic if topic is None else topic) + str(value.obis)
+            self.topics[key] = entryTopic
+        return entryTopic
+
+    def createTelegramTopic(self, topic: str = None):
+        return str(self.topic if topic is None else topic).rstrip("/")
+
+    def publish(self, topic: str, payload):
+        if self.writeAheadBuffer is not None and (not self.connected or not self.writeAheadBuffer.isEmpty()):
+            # keep the order, new messages wait behind the buffered ones
+            self.writeAheadBuffer.append(topic, payload)
+            if self.connected:
+                self.drainEvent.set()
+            return
+        result = self.client.publish(topic, payload, qos=self.qos)
+        if result.rc != mqtt.MQTT_ERR_SUCCESS and self.writeAheadBuffer is not None:
+            self.writeAheadBuffer.append(topic, payload)
+        elif result.rc != mqtt.MQTT_ERR_SUCCESS:
+            self.droppedMessages += 1
+            logger.warning(
+                "Message for {} not queued ({}), {} messages dropped".format(
+                    topic, result.rc, self.droppedMessages
+                )
+            )
+
+    def writeData(self, data: List[SmlEntry], topic: str = None):
+        if not self.started:
+            self.start()
+        serializer = self.serializer
+        if self.mode == MQTT_MODE_TELEGRAM:
+            telegram = dict()
+            for dataItem in data:
+                telegram[dataItem.obis] = MqttValue(dataItem).__dict__
+            self.publish(self.createTelegramTopic(topic), serializer.serializeTelegram(telegram))
+            return
 
-    def writeData(self, data: List[SmlEntry]):
-        self.client.connect(self.urls, self.port)
         for dataItem in data:
-            topic = self.createTopic(dataItem)
-            dataAsJson = json.dumps(MqttValue(dataItem).__dict__)
-            self.client.publish(topic, dataAsJson, qos=self.qos)
+            entryTopic = self.createTopic(dataItem, topic)
+            value = dataItem.value
+            unit = dataItem.unit
+            if self.mode == MQTT_MODE_CHANGED:
+                lastValue = (value, unit)
+                if self.lastValues.get(entryTopic) == lastValue:
+                    continue
+                self.lastValues[entryTopic] = lastValue
+            if isPlainValue(dataItem):
+                payload = serializer.serializeValue(value, unit)
+            else:
+                payload = serializer.serializePayload(MqttValue(dataItem).__dict__)
+            self.publish(entryTopic, payload)
+
+
+def isPlainValue(dataItem: SmlEntry):
+    """
+    True if the mqtt payload only has value and unit and can be built from a template.
+    """
+    return not getattr(dataItem, "exact", False) and getattr(dataItem, "summary", None) is None
+
+
+class MqttTopicWriter(WriteData):
+    """
+    Publish with a shared mqtt writer on an own topic prefix, e.g. for several meters in one process.
+    """
+
+    def __init__(self, mqttWriter: MqttDataWriter, topic: str):
+        super().__init__()
+        self.mqttWriter = mqttWriter
+        self.topic = topic
+
+    def writeData(self, data: List[SmlEntry]):
+        self.mqttWriter.writeData(data, self.topic)
+
+
+class SharedDataWriter(WriteData):
+    """
+    Write with a writer shared by several meters. Closing does not close the shared writer,
+    it is closed once by its owner after the writers of all meters.
+    """
+
+    def __init__(self, writer: WriteData):
+        super().__init__()
+        self.writer = writer
+
+    def writeData(self, data: List[SmlEntry]):
+        self.writer.writeData(data)